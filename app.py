@@ -1,41 +1,495 @@
-from paramiko import SSHClient
-from typing import Dict
-from flask import Flask, jsonify, request
-from marshmallow import fields, Schema, ValidationError, post_load, validates, validate
+from collections import Counter
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple, Union
+from flask import Flask, Response, jsonify, make_response, request, g, url_for, has_app_context, \
+    has_request_context, stream_with_context
+from marshmallow import fields, Schema, ValidationError, post_load, pre_load, validates, validate
+from sqlalchemy import Column, and_, bindparam, event, func, or_, select
+from sqlalchemy.ext import baked
+from sqlalchemy.orm import Query, Session, joinedload, selectinload
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 from sqlalchemy.orm.exc import NoResultFound
 from apispec import APISpec
 from apispec.ext.marshmallow import MarshmallowPlugin
 from apispec_webframeworks.flask import FlaskPlugin
 from flask_sqlalchemy import SQLAlchemy
 import json
-from ipaddress import IPv4Address, AddressValueError
-from create_db import Interface, Address
-from connection import Connection, Iproute2Error
-from config import database_path
+from hashlib import md5
+from datetime import datetime, timedelta
+from hmac import compare_digest
+from threading import Lock, Thread, get_ident
+from time import perf_counter
+from types import SimpleNamespace
+from ipaddress import IPv4Address, IPv4Network, AddressValueError
+from create_db import Host, Interface, Address, Change, Deployment, DEFAULT_HOST, engine_options, migrate, tune
+from connection import AsyncsshConnection, Batch, Connection, Iproute2Error, Recorder, plan_addresses
+from reconcile import apply_plans, plan_interfaces, reconcile, reconcile_async, reconcile_interface
+from fleet import Fleet
+from jobs import Job, JobQueue
+from cache import Collection, Row
+from serialize import Serializer, dumps, iter_list, read_ndjson, reformat
+from iproute2 import LinkState, error_code
+from metrics import Profile, request_duration, serialization_duration, statement_duration, render as render_metrics
+from config import database_path, list_page_size, import_chunk_size, baked_queries, query_count_header, deployment_id, \
+    deployment_timeout, deployment_history, metrics_enabled, profiling, profile_token, profile_interval, profile_top
 
 app = Flask(__name__)
 app.config['SQLALCHEMY_DATABASE_URI'] = database_path
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options()
 db = SQLAlchemy(app)
+bakery = baked.bakery()
 spec = APISpec(
     title="Network Interfaces Management Service",
     version="1.0",
     openapi_version="3.0.3",
-    info=dict(description="This API allows to create, change and delete network interfaces on internal VM via ssh."),
+    info=dict(description="This API allows to create, change and delete network interfaces on internal VMs via ssh."),
     plugins=[FlaskPlugin(), MarshmallowPlugin()],
 )
 
 
-def startup(conn: Connection) -> None:
-    for interface in db.session.query(Interface).all():
+def get_connection(host_id: int = DEFAULT_HOST) -> Connection:
+    """Return SSH connection to given host checked out from its pool for the current request."""
+    connections = g.setdefault('connections', {})
+    if host_id not in connections:
+        connections[host_id] = fleet.pool(host_id).checkout()
+    return connections[host_id]
+
+
+@app.teardown_appcontext
+def checkin_connection(_):
+    for host_id, conn in g.pop('connections', {}).items():
+        fleet.pool(host_id).checkin(conn)
+
+
+@event.listens_for(db.engine, 'before_cursor_execute')
+def count_statement(conn, cursor, statement, parameters, context, executemany):
+    if has_app_context():
+        g.statements = g.get('statements', 0) + 1
+    if context is not None:
+        context.nims_started = perf_counter()
+
+
+@event.listens_for(db.engine, 'after_cursor_execute')
+def time_statement(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, 'nims_started', None)
+    if started is not None:
+        statement_duration.observe(perf_counter() - started, statement.split(None, 1)[0].upper())
+
+
+@app.after_request
+def add_statement_count(response: Response) -> Response:
+    """Report the number of SQL statements the request executed, for tests that bound it."""
+    if query_count_header:
+        response.headers['X-Query-Count'] = str(g.get('statements', 0))
+    return response
+
+
+def route() -> str:
+    """Rule of the current request for metrics, e.g. `/interfaces/<int:int_id>`, background outside requests."""
+    if not has_request_context():
+        return 'background'
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+
+@app.before_request
+def start_request():
+    g.started = perf_counter()
+    if profiling:
+        header = request.headers.get('X-Profile')
+        if header and (not profile_token or compare_digest(header, profile_token)):
+            g.profile = Profile(get_ident(), profile_interval)
+
+
+@app.after_request
+def finish_request(response: Response) -> Response:
+    """Observe the duration of the request and attach its profile if it was profiled, a streamed body is not
+    included in either."""
+    profile = g.pop('profile', None) if profiling else None
+    if profile is not None:
+        profile.stop()
+        response.headers['X-Profile'] = profile.summary(profile_top)
+    if 'started' in g:
+        request_duration.observe(perf_counter() - g.started, request.method, route(), str(response.status_code))
+    return response
+
+
+def hot_query(build: Callable[[Session], Query], **params):
+    """Return the query built by build(session) with params bound, compiled only once if baked queries are enabled.
+
+    build is cached by its code, so it must not depend on anything but the session, values are passed as params.
+    """
+    if baked_queries:
+        return bakery(build)(db.session()).params(**params)
+    return build(db.session).params(**params)
+
+
+def interface_by_id(int_id: int) -> Interface:
+    return hot_query(lambda session: session.query(Interface).options(joinedload(Interface.addresses)).
+                     filter(Interface.id == bindparam('id')), id=int_id).one()
+
+
+def address_by_id(addr_id: int) -> Address:
+    return hot_query(lambda session: session.query(Address).options(joinedload(Address.interface)).
+                     filter(Address.id == bindparam('id')), id=addr_id).one()
+
+
+def reload_interfaces(ids: List[int]) -> List[Interface]:
+    """Return interfaces with given ids, in order, with their addresses, in two statements instead of a refresh and a
+    lazy load of addresses per interface expired by commit."""
+    found = {interface.id: interface for interface in db.session.query(Interface).
+             options(selectinload(Interface.addresses)).filter(Interface.id.in_(ids))}
+    return [found[id_] for id_ in ids]
+
+
+def reload_addresses(ids: List[int]) -> List[Address]:
+    """Return addresses with given ids, in order, in one statement instead of a refresh per address expired by
+    commit."""
+    found = {address.id: address for address in db.session.query(Address).filter(Address.id.in_(ids))}
+    return [found[id_] for id_ in ids]
+
+
+def load_interfaces(ids: Optional[List[int]]) -> Dict[int, Row]:
+    if ids is None:
+        query = db.session.query(Interface).options(selectinload(Interface.addresses))
+    else:
+        query = hot_query(lambda session: session.query(Interface).options(selectinload(Interface.addresses)).
+                          filter(Interface.id.in_(bindparam('ids', expanding=True))), ids=ids)
+    interfaces = query.all()
+    with serialization_duration.time(route()):
+        return {interface.id: (dumps(interface_serializer.dump(interface)), interface.host_id)
+                for interface in interfaces}
+
+
+def load_addresses(ids: Optional[List[int]], serializer: Serializer) -> Dict[int, Row]:
+    if ids is None:
+        query = db.session.query(Address)
+    else:
+        query = hot_query(lambda session: session.query(Address).
+                          filter(Address.id.in_(bindparam('ids', expanding=True))), ids=ids)
+    addresses = query.all()
+    with serialization_duration.time(route()):
+        return {address.id: (dumps(serializer.dump(address)), address.interface_id) for address in addresses}
+
+
+@event.listens_for(db.session, 'after_flush')
+def record_changes(session, _):
+    """Record changed rows in the changes table, in the same transaction, keeping only the latest change of a row."""
+    changes = {}
+    changed = [(obj, False) for obj in session.new | session.dirty] + [(obj, True) for obj in session.deleted]
+    for obj, deleted in changed:
+        if isinstance(obj, Interface):
+            changes[('interfaces', obj.id)] = deleted or changes.get(('interfaces', obj.id), False)
+        elif isinstance(obj, Address):
+            changes[('addresses', obj.id)] = deleted
+            if obj.interface_id is not None:
+                changes.setdefault(('interfaces', obj.interface_id), False)
+    if changes:
+        table = Change.__table__
+        session.execute(table.delete().where(and_(table.c.table_name == bindparam('name'),
+                                                  table.c.row_id == bindparam('id'))),
+                        [{'name': name, 'id': id_} for name, id_ in changes])
+        session.execute(table.insert(), [{'table_name': name, 'row_id': id_, 'deleted': deleted}
+                                         for (name, id_), deleted in changes.items()])
+
+
+def sync_cache() -> int:
+    """Invalidate cached rows changed by any process since the last sync, return current change sequence."""
+    global cache_seq
+    seq = hot_query(lambda session: session.query(func.max(Change.seq))).scalar() or 0
+    with cache_lock:
+        if seq > cache_seq:
+            for change in db.session.query(Change).filter(Change.seq > cache_seq):
+                collections = [interfaces_cache] if change.table_name == 'interfaces' else \
+                    [addresses_cache, concise_addresses_cache]
+                for collection in collections:
+                    collection.invalidate(change.row_id, change.deleted)
+                seq = max(seq, change.seq)
+            cache_seq = seq
+    return seq
+
+
+def cached(collection: Collection, id_: int, group: Optional[int] = None) -> bytes:
+    """Return rendered row with given id, optionally checking that it belongs to group."""
+    row = collection.get(id_)
+    if row is None or group is not None and row[1] != group:
+        raise NoResultFound()
+    return row[0]
+
+
+def pretty() -> bool:
+    """Whether the client asked for indented JSON with ?pretty=1, responses are compact otherwise."""
+    return request.args.get('pretty') in fields.Boolean.truthy
+
+
+def render_json(data: Any) -> bytes:
+    with serialization_duration.time(route()):
+        return dumps(data, pretty())
+
+
+def indented(rendered: bytes) -> bytes:
+    """Return compact rendering from the cache as the client asked for it."""
+    return reformat(rendered) if pretty() else rendered
+
+
+def conditional(etag: str, render: Callable[[], Union[str, bytes, Response]]) -> Response:
+    """Respond with 304 if the client already has this version, render the body otherwise."""
+    if pretty():
+        etag += '-pretty'
+    response = Response(status=304) if request.if_none_match.contains(etag) else make_response(render())
+    response.set_etag(etag)
+    return response
+
+
+def conditional_row(collection: Collection, id_: int, group: Optional[int] = None) -> Response:
+    sync_cache()
+    rendered = cached(collection, id_, group)
+    return conditional(md5(rendered).hexdigest(), lambda: indented(rendered))
+
+
+def conditional_list(collection: Collection, group: Optional[int] = None) -> Response:
+    return conditional(str(sync_cache()), lambda: indented(collection.render(group)))
+
+
+def select_rows(query: Query, id_column: Column, limit: Optional[int],
+                match: Optional[Callable] = None) -> Tuple[List, bool]:
+    """Return rows of query ordered by id, at most limit of them, and whether more rows follow.
+
+    Rows for which match is false are filtered out in Python, the query is read in pages until enough rows match.
+    """
+    size = limit + 1 if limit is not None and match is None else list_page_size
+    rows, page = [], []
+    while True:
+        page = (query.filter(id_column > page[-1].id) if page else query).limit(size).all()
+        rows += [row for row in page if match is None or match(row)]
+        if len(page) < size or limit is not None and len(rows) > limit:
+            break
+    if limit is not None and len(rows) > limit:
+        return rows[:limit], True
+    return rows, False
+
+
+def paginate(query: Query, id_column: Column, args: Dict, match: Optional[Callable], schema_class: type,
+             serializer: Serializer) -> Response:
+    """Respond with the page of rows selected by limit and after, with a Link to the next page if there is one.
+
+    Rows are selected before the response starts, the body is streamed rendering one row at a time.
+    """
+    if 'after' in args:
+        query = query.filter(id_column > args['after'])
+    if 'only' in args:
+        try:
+            serializer = Serializer(schema_class(only=args['only'].split(',')))
+        except ValueError as e:
+            raise ValidationError({'fields': [str(e)]})
+    rows, more = [], False
+
+    def render():
+        nonlocal rows, more
+        rows, more = select_rows(query, id_column, args.get('limit'), match)
+        indent = pretty()
+        return Response(serialization_duration.time_items(
+            iter_list((dumps(serializer.dump(row), indent) for row in rows), indent), route()))
+    response = conditional(str(sync_cache()), render)
+    if more:
+        next_url = url_for(request.endpoint, **request.view_args, **dict(request.args.items(), after=rows[-1].id))
+        response.headers['Link'] = f'<{next_url}>; rel="next"'
+    return response
+
+
+class Conflict(Exception):
+    """Request conflicts with existing interfaces or addresses, found before any command was sent."""
+
+
+def check_hosts(host_ids: List[Tuple[Optional[int], int]]) -> None:
+    """Raise ValidationError if some host does not exist. Hosts are given with the index of their item in a bulk
+    request, or None."""
+    requested = {host_id for _, host_id in host_ids} - {DEFAULT_HOST}
+    known = {host_id for host_id, in db.session.query(Host.id).filter(Host.id.in_(requested))} if requested else set()
+    for index, host_id in host_ids:
+        if host_id != DEFAULT_HOST and host_id not in known:
+            message = {'host_id': [f'Host {host_id} does not exist.']}
+            raise ValidationError(message if index is None else {index: message})
+
+
+def check_host_unchanged(interfaces: List[Tuple[Optional[int], Interface, Dict]]) -> None:
+    """Raise ValidationError if a change moves an interface to another host. Interfaces are given with the index of
+    their item in a bulk request, or None, and the requested change."""
+    for index, interface, item in interfaces:
+        if item.get('host_id', interface.host_id) != interface.host_id:
+            message = {'host_id': ['Interfaces cannot be moved to another host.']}
+            raise ValidationError(message if index is None else {index: message})
+
+
+def check_names(names: List[Tuple[Optional[int], int, str]]) -> None:
+    """Raise Conflict if some name is requested twice for a host or is in use by an interface of the host, in the
+    database or, as far as the live index of the host knows, in the kernel. Names are given with the index of their
+    item in a bulk request, or None, and their host."""
+    taken = set(db.session.query(Interface.host_id, Interface.name).
+                filter(Interface.host_id.in_({h for _, h, _ in names}), Interface.name.in_({n for _, _, n in names})))
+    seen = set()
+    for index, host_id, name in names:
+        if (host_id, name) in seen or (host_id, name) in taken or fleet.peek(host_id, name) is not None:
+            raise Conflict(f'Interface name {name} is already in use.', index)
+        seen.add((host_id, name))
+
+
+def check_addresses(addresses: List[Tuple[Optional[int], Interface, str]], assigned: bool = True) -> None:
+    """Raise Conflict if some address is requested twice for an interface or, if assigned is true, is already assigned
+    to it, in the database or, as far as the live index knows, in the kernel. Addresses are given with the index of
+    their item in a bulk request, or None, and their interface."""
+    taken = set()
+    if assigned and addresses:
+        taken = set(db.session.query(Address.interface_id, Address.address).
+                    filter(Address.interface_id.in_({interface.id for _, interface, _ in addresses}),
+                           Address.address.in_({address for _, _, address in addresses})))
+    seen = set()
+    for index, interface, address in addresses:
+        link = fleet.peek(interface.host_id, interface.name) if assigned else None
+        if (interface, address) in seen or (interface.id, address) in taken or link and address in link.addrs:
+            raise Conflict(f'Address {address} is already assigned to interface {interface.name}. No need to assign \
+again.', index)
+        seen.add((interface, address))
+
+
+def send(connection: Connection, batch: Batch) -> None:
+    """Run batch, reverting commands applied before the one that failed."""
+    try:
+        connection.send(batch)
+    except Iproute2Error as e:
+        connection.undo(batch, e.args[0].get('line', len(batch) + 1) - 1)
+        raise e
+
+
+def apply_batches(commands: Callable[[Connection, int], None], host_ids: Iterable[int],
+                  items: Optional[List] = None) -> Dict[int, Batch]:
+    """Run commands issued by commands(recorder, host_id) as one batch per host, on all hosts in parallel.
+
+    Batches are recorded before any is sent, so commands cannot read kernel state. If some command fails, commands
+    applied before it on its host and batches applied on other hosts are reverted, and the index of the item among
+    items which the failed command was issued for is added to the error.
+    """
+    batches = {}
+    for host_id in dict.fromkeys(host_ids):
+        batches[host_id] = Batch()
+        commands(Recorder(batches[host_id]), host_id)
+    _, errors = fleet.fan_out(batches, lambda connection, host_id: send(connection, batches[host_id]))
+    if not errors:
+        return batches
+    fleet.fan_out(batches.keys() - errors.keys(), lambda connection, host_id: connection.undo(batches[host_id]))
+    e = next((error for error in errors.values() if isinstance(error, Iproute2Error)), next(iter(errors.values())))
+    if isinstance(e, Iproute2Error):
+        for index, item in enumerate(items or []):
+            if item is e.args[0].get('interface') or item is e.args[0].get('address'):
+                e.args[0]['index'] = index
+                break
+    raise e
+
+
+def apply_batch(commands: Callable[[Connection], None], items: Optional[List] = None,
+                host_id: int = DEFAULT_HOST) -> Dict[int, Batch]:
+    """Run commands issued by commands(recorder) on one host as one batch, see apply_batches()."""
+    return apply_batches(lambda recorder, _: commands(recorder), [host_id], items)
+
+
+def commit(batches: Dict[int, Batch]) -> None:
+    """Commit the session, reverting the applied batches if the commit fails."""
+    try:
+        db.session.commit()
+    except Exception as e:
+        fleet.fan_out(batches, lambda connection, host_id: connection.undo(batches[host_id]))
+        raise e
+
+
+def respond_async() -> bool:
+    """Whether the client asked to run iproute2 commands in the background, see RFC 7240."""
+    return any(preference.strip().lower() == 'respond-async'
+               for header in request.headers.getlist('Prefer') for preference in header.split(','))
+
+
+def accepted(interface_id: int, live_name: Optional[str], host_id: int) -> Response:
+    """Queue reconciliation of the committed interface and respond with the job."""
+    job = jobs.submit(interface_id, live_name, host_id)
+    response = make_response(render_json(job_schema.dump(job)), 202)
+    response.headers['Location'] = url_for('get_job', job_id=job.id)
+    return response
+
+
+def run_job(job: Job) -> Optional[str]:
+    """Make kernel state of the interface of the job match its latest state in the database, return its name in the
+    kernel, None once it is deleted."""
+    with app.app_context():
+        interface = db.session.query(Interface).options(selectinload(Interface.addresses)).\
+            filter_by(id=job.interface_id).one_or_none()
         try:
-            conn.ip_link_add(interface)
+            with fleet.pool(job.host_id).connection() as connection:
+                reconcile_interface(connection, interface, job.live_name)
         except Iproute2Error as e:
-            if e.args[0]['message'] == ['RTNETLINK answers: File exists\n']:
-                connection.ip_link_set(interface, mtu=interface.mtu)
-            else:
-                raise e
-        conn.set_addresses(interface)
+            raise RuntimeError(''.join(e.args[0]['message']).strip())
+        return None if interface is None else interface.name
+
+
+def host_target(host_id: int) -> Tuple[Optional[str], Optional[str]]:
+    """Return address and username of host for the fleet, read without the session, as any thread may ask."""
+    row = db.engine.execute(select([Host.address, Host.username]).where(Host.id == host_id)).first()
+    if row is None:
+        raise NoResultFound()
+    return row.address, row.username
+
+
+def load_desired(host_id: int, names: Optional[Set[str]]) -> List[Interface]:
+    """Return interfaces of host with given names, or all of them, with their addresses, for its reconciler."""
+    with app.app_context():
+        query = db.session.query(Interface).options(selectinload(Interface.addresses)).\
+            filter(Interface.host_id == host_id)
+        if names is not None:
+            query = query.filter(Interface.name.in_(names))
+        return query.all()
+
+
+def startup(conn: Connection, interfaces: List[Interface]) -> None:
+    if isinstance(conn, AsyncsshConnection):
+        conn.call(reconcile_async(conn.aio, interfaces))
+    else:
+        reconcile(conn, interfaces)
+
+
+def startup_once(deployment: str) -> None:
+    """Reconcile all interfaces of all hosts unless another process of the deployment did or does it. A failed
+    reconciliation, or one unfinished for deployment_timeout seconds, e.g. of a process that was killed, is run
+    again by the next process of the deployment that starts. Only the deployment_history latest deployments are kept.
+
+    Hosts are reconciled in parallel, one that fails does not stop the others, the deployment fails if any does.
+    """
+    with app.app_context():
+        now = datetime.utcnow()
+        stale = now - timedelta(seconds=deployment_timeout)
+        reclaimable = or_(Deployment.error.isnot(None), and_(Deployment.finished.is_(None), Deployment.started < stale))
+        if not db.session.query(Deployment).filter(Deployment.id == deployment, reclaimable).\
+                update({'started': now, 'error': None}, synchronize_session=False):
+            db.session.add(Deployment(id=deployment, started=now))
+        try:
+            db.session.flush()
+        except IntegrityError:
+            db.session.rollback()
+            return
+        latest = db.session.query(Deployment.id).order_by(Deployment.started.desc()).limit(deployment_history)
+        db.session.query(Deployment).filter(Deployment.id.notin_(latest.subquery())).delete(synchronize_session=False)
+        db.session.commit()
+        try:
+            interfaces = {host_id: [] for host_id, in db.session.query(Host.id)}
+            for interface in db.session.query(Interface).options(selectinload(Interface.addresses)):
+                interfaces[interface.host_id].append(interface)
+            _, errors = fleet.fan_out(interfaces, lambda conn, host_id: startup(conn, interfaces[host_id]))
+            for host_id, e in errors.items():
+                app.logger.error(f'Reconciliation at startup of host {host_id} failed: {e}')
+            result = {'error': '; '.join(f'host {host_id}: {e}' for host_id, e in errors.items())} if errors else \
+                {'finished': datetime.utcnow()}
+        except Exception as e:
+            app.logger.error(f'Reconciliation at startup failed: {e}')
+            db.session.rollback()
+            result = {'error': str(e)}
+        db.session.query(Deployment).filter(Deployment.id == deployment).update(result, synchronize_session=False)
+        db.session.commit()
 
 
 class ConciseAddressSchema(Schema):
@@ -62,6 +516,8 @@ class InterfaceSchema(Schema):
     id = fields.Integer(dump_only=True)
     name = fields.Str(required=True, validate=validate.Regexp('^[0-9A-Za-z_]+$'))
     mtu = fields.Integer(missing=1500, validate=validate.Range(0, 999999999))
+    host_id = fields.Integer(missing=DEFAULT_HOST, metadata={'description': 'host of the interface, it cannot be \
+changed, 1 is the configured server'})
     addresses = fields.List(fields.Nested(ConciseAddressSchema))
 
     @post_load
@@ -69,14 +525,130 @@ class InterfaceSchema(Schema):
         return Interface(**{k: v for (k, v) in data.items() if k != 'addresses'})
 
 
+class InterfaceUpdateSchema(InterfaceSchema):
+    id = fields.Integer(required=True)
+
+
+class BulkDeleteSchema(Schema):
+    ids = fields.List(fields.Integer(), required=True)
+
+
+class ListArgsSchema(Schema):
+    limit = fields.Integer(validate=validate.Range(1), metadata={'description': 'maximum number of rows to return'})
+    after = fields.Integer(metadata={'description': 'return rows with id greater than this one'})
+    cidr = fields.Str(metadata={'description': 'return rows with address in this IPv4 network'})
+    only = fields.Str(data_key='fields', metadata={'description': 'comma separated fields to return'})
+    pretty = fields.Boolean(metadata={'description': 'indent the JSON response, it is compact by default'})
+
+    @validates('cidr')
+    def validate_cidr(self, cidr: str):
+        try:
+            IPv4Network(cidr, strict=False)
+        except ValueError:
+            raise ValidationError(f'{cidr} is not a valid IPv4 network.')
+
+
+class InterfaceListArgsSchema(ListArgsSchema):
+    host_id = fields.Integer(metadata={'description': 'return interfaces of this host'})
+    name_prefix = fields.Str(metadata={'description': 'return interfaces with name starting with this prefix'})
+    mtu_min = fields.Integer(metadata={'description': 'return interfaces with mtu not less than this one'})
+    mtu_max = fields.Integer(metadata={'description': 'return interfaces with mtu not greater than this one'})
+    has_address = fields.Boolean(metadata={'description': 'return interfaces with or without addresses'})
+
+
+class AddressListArgsSchema(ListArgsSchema):
+    interface_id = fields.Integer(metadata={'description': 'return addresses of this interface'})
+
+
+class JobSchema(Schema):
+    id = fields.Str()
+    interface_id = fields.Integer()
+    host_id = fields.Integer()
+    live_name = fields.Str(allow_none=True)
+    status = fields.Str(validate=validate.OneOf(['queued', 'running', 'done', 'failed']))
+    error = fields.Str(allow_none=True)
+    created = fields.DateTime()
+    finished = fields.DateTime(allow_none=True)
+
+
+class DriftSchema(Schema):
+    events = fields.Integer(metadata={'description': 'interface changes reported by the live index'})
+    checks = fields.Integer(metadata={'description': 'comparisons of the database with the kernel'})
+    interfaces_checked = fields.Integer()
+    drift_detected = fields.Integer(metadata={'description': 'interfaces found out of sync'})
+    drift_fixed = fields.Integer(metadata={'description': 'interfaces brought back in sync'})
+    fix_failures = fields.Integer()
+    last_check = fields.DateTime(allow_none=True)
+    last_drift = fields.DateTime(allow_none=True)
+
+
+class InterfaceImportSchema(InterfaceSchema):
+    @pre_load
+    def drop_ids(self, data, **kwargs):
+        """Ignore ids of exported interfaces and their addresses, rows are matched by name."""
+        if not isinstance(data, dict):
+            return data
+        data = {k: v for k, v in data.items() if k != 'id'}
+        if isinstance(data.get('addresses'), list):
+            data['addresses'] = [{k: v for k, v in address.items() if k != 'id'} if isinstance(address, dict)
+                                 else address for address in data['addresses']]
+        return data
+
+
+class ImportResultSchema(Schema):
+    created = fields.Integer(metadata={'description': 'interfaces that were not in the database'})
+    updated = fields.Integer(metadata={'description': 'interfaces whose mtu or addresses were changed'})
+    unchanged = fields.Integer()
+
+
+class ReadinessSchema(Schema):
+    database = fields.Boolean(metadata={'description': 'the database can be read'})
+    ssh = fields.Boolean(metadata={'description': 'an SSH connection to the configured server (host 1) is open'})
+    reconciled = fields.Boolean(metadata={'description': 'reconciliation at startup of the deployment is finished'})
+
+
+class HostSchema(Schema):
+    id = fields.Integer(dump_only=True)
+    name = fields.Str(required=True, validate=validate.Regexp('^[0-9A-Za-z_.-]+$'))
+    address = fields.Str(required=True, metadata={'description': 'address to connect to over SSH'})
+    username = fields.Str(allow_none=True, missing=None, metadata={'description': 'SSH user, null for the \
+configured one'})
+
+    @post_load
+    def init_host(self, data: Dict, **kwargs):
+        return Host(**data)
+
+
+class DeletedSchema(Schema):
+    interfaces = fields.List(fields.Integer())
+    addresses = fields.List(fields.Integer())
+
+
+class ChangesSchema(Schema):
+    seq = fields.Integer()
+    interfaces = fields.List(fields.Nested(InterfaceSchema))
+    addresses = fields.List(fields.Nested(AddressSchema))
+    deleted = fields.Nested(DeletedSchema)
+
+
+class ChangesArgsSchema(Schema):
+    since = fields.Integer(missing=0, metadata={'description': 'sequence number of the last change already known to '
+                                                               'the client'})
+    pretty = fields.Boolean(metadata={'description': 'indent the JSON response, it is compact by default'})
+
+
 @app.route('/interfaces', methods=['GET'])
 def get_interfaces():
     """Return all interfaces.
     ---
     get:
         summary: Return all interfaces
-        description: Return all interfaces created through API.
+        description: Return all interfaces created through API, ordered by id. Can be filtered, paginated with limit \
+and after, in which case the Link header with rel="next" points to the next page, and projected to given fields.
         operationId: get_interfaces
+        parameters:
+        -   in: query
+            schema: InterfaceListArgsSchema
         responses:
             200:
                 description: list of all interfaces created through API
@@ -85,8 +657,35 @@ def get_interfaces():
                         schema:
                             type: array
                             items: Interface
+            304:
+                description: not modified, ETag given in If-None-Match is current
     """
-    return interface_schema.dumps(db.session.query(Interface).all(), many=True, indent=2)
+    return list_interfaces()
+
+
+def list_interfaces(host_id: Optional[int] = None) -> Response:
+    """Respond with interfaces, of given host only if host_id is given, as the query arguments ask for."""
+    if set(request.args) <= {'pretty'}:
+        return conditional_list(interfaces_cache, host_id)
+    args = interface_list_args_schema.load(request.args)
+    query = db.session.query(Interface).options(selectinload(Interface.addresses)).order_by(Interface.id)
+    if host_id is not None:
+        query = query.filter(Interface.host_id == host_id)
+    if 'host_id' in args:
+        query = query.filter(Interface.host_id == args['host_id'])
+    if 'name_prefix' in args:
+        query = query.filter(Interface.name.startswith(args['name_prefix'], autoescape=True))
+    if 'mtu_min' in args:
+        query = query.filter(Interface.mtu >= args['mtu_min'])
+    if 'mtu_max' in args:
+        query = query.filter(Interface.mtu <= args['mtu_max'])
+    if 'has_address' in args:
+        query = query.filter(Interface.addresses.any() if args['has_address'] else ~Interface.addresses.any())
+    match = None
+    if 'cidr' in args:
+        network = IPv4Network(args['cidr'], strict=False)
+        match = lambda interface: any(IPv4Address(address.address) in network for address in interface.addresses)
+    return paginate(query, Interface.id, args, match, InterfaceSchema, interface_serializer)
 
 
 @app.route('/interfaces', methods=['POST'])
@@ -95,20 +694,37 @@ def post_interface():
     ---
     post:
         summary: Add new interface
-        description: Create interface with given name and, possibly, set its mtu. Also can bind one or many \
-specified IP addresses to newly created interface. Name MUST NOT match name of any existing interface, including \
-system interfaces.
+        description: Create interface with given name on given host, the configured server by default, and, \
+possibly, set its mtu. Also can bind one or many specified IP addresses to newly created interface. Name MUST NOT \
+match name of any existing interface of the host, including system interfaces. With Prefer header set to \
+respond-async the interface is stored and created in the background.
         operationId: post_interface
         requestBody:
             content:
                 application/json:
                     schema: Interface
+        parameters:
+        -   in: header
+            name: Prefer
+            description: respond-async to run iproute2 commands in the background
+            schema:
+                 type: string
         responses:
             201:
                 description: interface was successfully created
                 content:
                     application/json:
                         schema: Interface
+            202:
+                description: interface was stored, iproute2 commands are queued as a job
+                headers:
+                    Location:
+                        description: URL of the job
+                        schema:
+                            type: string
+                content:
+                    application/json:
+                        schema: Job
             400:
                 description: bad request
                 content:
@@ -120,24 +736,33 @@ system interfaces.
                     application/json:
                         schema: Error
     """
-    # initialize and create interface
-    interface = interface_schema.load(request.json)
-    connection.ip_link_add(interface)
+    return create_interface(request.json)
+
+
+def create_interface(data: Dict) -> Response:
+    # initialize interface and addresses
+    interface = interface_schema.load(data)
+    check_hosts([(None, interface.host_id)])
+    check_names([(None, interface.host_id, interface.name)])
+    check_addresses([(None, interface, item['address']) for item in data.get('addresses', [])], False)
     db.session.add(interface)
     db.session.flush()
+    addresses = [Address(**item, interface_id=interface.id) for item in data.get('addresses', [])]
+    if respond_async():
+        db.session.add_all(addresses)
+        db.session.commit()
+        return accepted(interface.id, None, interface.host_id)
 
-    try:
-        # initialize and create addresses
-        addresses = [Address(**data, interface_id=interface.id) for data in request.json.get('addresses', [])]
+    # create interface and addresses in one batch, interface is deleted if it was created but some address was not
+    def commands(connection: Connection):
+        connection.ip_link_add(interface)
         for address in addresses:
             connection.ip_address_add(address, interface)
-        db.session.add_all(addresses)
-    except Exception as e:
-        connection.ip_link_delete(interface)
-        raise e
+    batches = apply_batch(commands, host_id=interface.host_id)
 
-    db.session.commit()
-    return interface_schema.dumps(interface, indent=2), 201
+    db.session.add_all(addresses)
+    commit(batches)
+    return make_response(render_json(interface_serializer.dump(interface)), 201)
 
 
 @app.route('/interfaces/<int:int_id>', methods=['GET'])
@@ -165,8 +790,10 @@ def get_interface(int_id: int):
                 content:
                     application/json:
                         schema: Error
+            304:
+                description: not modified, ETag given in If-None-Match is current
     """
-    return interface_schema.dumps(db.session.query(Interface).filter(Interface.id == int_id).one(), indent=2)
+    return conditional_row(interfaces_cache, int_id)
 
 
 @app.route('/interfaces/<int:int_id>', methods=['PUT'])
@@ -177,7 +804,8 @@ def put_interface(int_id: int):  # TODO: requestBody schema (partial=True)
         summary: Change interface
         description: Change name and/or mtu of interface previously created through API. If a list of addresses \
 is passed, deletes addresses outside of this list and creates missing addresses. Name MUST NOT match name of any \
-existing interface, including system interfaces.
+existing interface of its host, including system interfaces. The host cannot be changed. With Prefer header set \
+to respond-async the changes are stored and applied in the background.
         operationId: put_interface
         requestBody:
             content:
@@ -189,12 +817,27 @@ existing interface, including system interfaces.
             description: interface id
             schema:
                  type: integer
+        -   in: header
+            name: Prefer
+            description: respond-async to run iproute2 commands in the background
+            schema:
+                 type: string
         responses:
             200:
                 description: interface was successfully changed
                 content:
                     application/json:
                         schema: Interface
+            202:
+                description: changes were stored, iproute2 commands are queued as a job
+                headers:
+                    Location:
+                        description: URL of the job
+                        schema:
+                            type: string
+                content:
+                    application/json:
+                        schema: Job
             400:
                 description: bad request
                 content:
@@ -211,22 +854,40 @@ existing interface, including system interfaces.
                     application/json:
                         schema: Error
     """
-    interface = db.session.query(Interface).filter_by(id=int_id).one()
+    interface = interface_by_id(int_id)
 
     # change interface
     interface_schema.load(request.json, partial=True)
+    check_host_unchanged([(None, interface, request.json)])
+    if request.json.get('name', interface.name) != interface.name:
+        check_names([(None, interface.host_id, request.json['name'])])
+    check_addresses([(None, interface, data['address']) for data in request.json.get('addresses', [])], False)
+    if respond_async():
+        live_name = interface.name
+        interface.name = request.json.get('name', interface.name)
+        interface.mtu = request.json.get('mtu', interface.mtu)
+        if 'addresses' in request.json:
+            kept = {address.address: address for address in interface.addresses}
+            interface.addresses = [kept.pop(data['address'], None) or Address(**data)
+                                   for data in request.json['addresses']]
+            db.session.add_all(interface.addresses)
+        db.session.commit()
+        return accepted(interface.id, live_name, interface.host_id)
+    connection = get_connection(interface.host_id)
     connection.ip_link_set(interface, name=request.json.get('name'), mtu=request.json.get('mtu'))
     interface.name = request.json.get('name', interface.name)
     interface.mtu = request.json.get('mtu', interface.mtu)
 
-    # delete/create addresses
+    # delete stale/create missing addresses, addresses that are kept retain their ids
     if 'addresses' in request.json:
-        interface.addresses = [Address(**data) for data in request.json['addresses']]
+        kept = {address.address: address for address in interface.addresses}
+        interface.addresses = [kept.pop(data['address'], None) or Address(**data) for data in request.json['addresses']]
         db.session.add_all(interface.addresses)
-        connection.set_addresses(interface)
+        plan = connection.set_addresses(interface)
+        app.logger.debug(f'{interface.name}: {plan}')
 
     db.session.commit()
-    return interface_schema.dumps(interface, indent=2)
+    return render_json(interface_serializer.dump(interface))
 
 
 @app.route('/interfaces/<int:int_id>', methods=['DELETE'])
@@ -235,7 +896,8 @@ def delete_interface(int_id: int):
     ---
     delete:
         summary: Delete interface
-        description: Delete interface previously created through API.
+        description: Delete interface previously created through API. With Prefer header set to respond-async the \
+interface is deleted from the database at once and from the system in the background.
         operationId: delete_interface
         parameters:
         -   in: path
@@ -243,17 +905,37 @@ def delete_interface(int_id: int):
             description: interface id
             schema:
                  type: integer
+        -   in: header
+            name: Prefer
+            description: respond-async to run iproute2 commands in the background
+            schema:
+                 type: string
         responses:
             204:
                 description: interface deleted
+            202:
+                description: interface was deleted from the database, iproute2 commands are queued as a job
+                headers:
+                    Location:
+                        description: URL of the job
+                        schema:
+                            type: string
+                content:
+                    application/json:
+                        schema: Job
             404:
                 description: interface not found
                 content:
                     application/json:
                         schema: Error
     """
-    interface = db.session.query(Interface).filter_by(id=int_id).one()
-    connection.ip_link_delete(interface)
+    interface = interface_by_id(int_id)
+    if respond_async():
+        live_name = interface.name
+        db.session.delete(interface)
+        db.session.commit()
+        return accepted(int_id, live_name, interface.host_id)
+    get_connection(interface.host_id).ip_link_delete(interface)
     db.session.delete(interface)
     db.session.commit()
     return '', 204
@@ -265,8 +947,13 @@ def get_addresses():
     ---
     get:
         summary: Return all IP addresses
-        description: Return all IP addresses assigned to some interfaces through API.
+        description: Return all IP addresses assigned to some interfaces through API, ordered by id. Can be \
+filtered, paginated with limit and after, in which case the Link header with rel="next" points to the next page, and \
+projected to given fields.
         operationId: get_addresses
+        parameters:
+        -   in: query
+            schema: AddressListArgsSchema
         responses:
             200:
                 description: list of all addresses assigned through API
@@ -275,8 +962,20 @@ def get_addresses():
                         schema:
                             type: array
                             items: Address
+            304:
+                description: not modified, ETag given in If-None-Match is current
     """
-    return address_schema.dumps(db.session.query(Address).all(), many=True, indent=2)
+    if set(request.args) <= {'pretty'}:
+        return conditional_list(addresses_cache)
+    args = address_list_args_schema.load(request.args)
+    query = db.session.query(Address).order_by(Address.id)
+    if 'interface_id' in args:
+        query = query.filter(Address.interface_id == args['interface_id'])
+    match = None
+    if 'cidr' in args:
+        network = IPv4Network(args['cidr'], strict=False)
+        match = lambda address: IPv4Address(address.address) in network
+    return paginate(query, Address.id, args, match, AddressSchema, address_serializer)
 
 
 @app.route('/addresses', methods=['POST'])
@@ -314,10 +1013,12 @@ def post_addresses():
                         schema: Error
     """
     address = address_schema.load(request.json)
-    connection.ip_address_add(address, db.session.query(Interface).filter_by(id=address.interface_id).one())
+    interface = interface_by_id(address.interface_id)
+    check_addresses([(None, interface, address.address)])
+    get_connection(interface.host_id).ip_address_add(address, interface)
     db.session.add(address)
     db.session.commit()
-    return address_schema.dumps(address, indent=2), 201
+    return render_json(address_serializer.dump(address)), 201
 
 
 @app.route('/addresses/<int:addr_id>', methods=['GET'])
@@ -345,8 +1046,10 @@ def get_address(addr_id: int):
                 content:
                     application/json:
                         schema: Error
+            304:
+                description: not modified, ETag given in If-None-Match is current
     """
-    return address_schema.dumps(db.session.query(Address).filter_by(id=addr_id).one(), indent=2)
+    return conditional_row(addresses_cache, addr_id)
 
 
 @app.route('/addresses/<int:addr_id>', methods=['DELETE'])
@@ -372,8 +1075,8 @@ def delete_address(addr_id: int):
                     application/json:
                         schema: Error
     """
-    address = db.session.query(Address).filter_by(id=addr_id).one()
-    connection.ip_address_delete(address, db.session.query(Interface).filter_by(id=address.interface_id).one())
+    address = address_by_id(addr_id)
+    get_connection(address.interface.host_id).ip_address_delete(address, address.interface)
     db.session.delete(address)
     db.session.commit()
     return '', 204
@@ -406,10 +1109,12 @@ def get_addresses_by_interface(int_id: int):
                 content:
                     application/json:
                         schema: Error
+            304:
+                description: not modified, ETag given in If-None-Match is current
     """
-    db.session.query(Interface).filter_by(id=int_id).one()
-    return concise_address_schema.dumps(db.session.query(Address).filter_by(interface_id=int_id).all(),
-                                        many=True, indent=2)
+    seq = sync_cache()
+    cached(interfaces_cache, int_id)
+    return conditional(str(seq), lambda: indented(concise_addresses_cache.render(int_id)))
 
 
 @app.route('/interfaces/<int:int_id>/addresses', methods=['POST'])
@@ -454,10 +1159,12 @@ def post_addresses_by_interface(int_id: int):
     """
     address = concise_address_schema.load(request.json)
     address.interface_id = int_id
-    connection.ip_address_add(address, db.session.query(Interface).filter_by(id=int_id).one())
+    interface = interface_by_id(int_id)
+    check_addresses([(None, interface, address.address)])
+    get_connection(interface.host_id).ip_address_add(address, interface)
     db.session.add(address)
     db.session.commit()
-    return concise_address_schema.dumps(address, indent=2), 201
+    return render_json(concise_address_serializer.dump(address)), 201
 
 
 @app.route('/interfaces/<int:int_id>/addresses/<int:addr_id>', methods=['GET'])
@@ -490,10 +1197,10 @@ def get_address_by_interface(int_id: int, addr_id: int):
                 content:
                     application/json:
                         schema: Error
+            304:
+                description: not modified, ETag given in If-None-Match is current
     """
-    return concise_address_schema.dumps(db.session.query(Address).
-                                        filter_by(interface_id=int_id).
-                                        filter_by(id=addr_id).one(), indent=2)
+    return conditional_row(concise_addresses_cache, addr_id, int_id)
 
 
 @app.route('/interfaces/<int:int_id>/addresses/<int:addr_id>', methods=['DELETE'])
@@ -524,84 +1231,1018 @@ def delete_address_by_interface(int_id: int, addr_id: int):
                     application/json:
                         schema: Error
     """
-    address = db.session.query(Address).filter_by(interface_id=int_id).filter_by(id=addr_id).one()
-    connection.ip_address_delete(address, db.session.query(Interface).filter_by(id=int_id).one())
+    address = address_by_id(addr_id)
+    if address.interface_id != int_id:
+        raise NoResultFound()
+    get_connection(address.interface.host_id).ip_address_delete(address, address.interface)
     db.session.delete(address)
     db.session.commit()
     return '', 204
 
 
-@app.errorhandler(ValidationError)
-def validation_error(error):
-    return jsonify({'error': error.messages}), 400
+@app.route('/interfaces:bulk', methods=['POST'])
+def post_interfaces_bulk():
+    """Add interfaces.
+    ---
+    post:
+        summary: Add new interfaces
+        description: Create all given interfaces with their addresses, as POST /interfaces does for one. All \
+interfaces are validated before any is created. Interfaces of different hosts are created on their hosts in \
+parallel. Either all interfaces are created or none, the index of the interface that could not be created is \
+returned with the error.
+        operationId: post_interfaces_bulk
+        requestBody:
+            content:
+                application/json:
+                    schema:
+                        type: array
+                        items: Interface
+        responses:
+            201:
+                description: interfaces were successfully created
+                content:
+                    application/json:
+                        schema:
+                            type: array
+                            items: Interface
+            400:
+                description: bad request
+                content:
+                    application/json:
+                        schema: Error
+            409:
+                description: some interface cannot be created, because name is already in use
+                content:
+                    application/json:
+                        schema: Error
+    """
+    interfaces = interface_schema.load(request.json, many=True)
+    check_hosts([(index, interface.host_id) for index, interface in enumerate(interfaces)])
+    check_names([(index, interface.host_id, interface.name) for index, interface in enumerate(interfaces)])
+    check_addresses([(index, interface, data['address']) for index, (interface, item)
+                     in enumerate(zip(interfaces, request.json)) for data in item.get('addresses', [])], False)
+    db.session.add_all(interfaces)
+    db.session.flush()
+    addresses = [[Address(**data, interface_id=interface.id) for data in item.get('addresses', [])]
+                 for interface, item in zip(interfaces, request.json)]
 
+    def commands(connection: Connection, host_id: int):
+        for interface, interface_addresses in zip(interfaces, addresses):
+            if interface.host_id == host_id:
+                connection.ip_link_add(interface)
+                for address in interface_addresses:
+                    connection.ip_address_add(address, interface)
+    batches = apply_batches(commands, [interface.host_id for interface in interfaces], interfaces)
 
-@app.errorhandler(NoResultFound)
-def not_found(_):
-    return jsonify({'error': 'No result found.'}), 404
+    for interface_addresses in addresses:
+        db.session.add_all(interface_addresses)
+    ids = [interface.id for interface in interfaces]
+    commit(batches)
+    return render_json(interface_serializer.dump_many(reload_interfaces(ids))), 201
 
 
-@app.errorhandler(Iproute2Error)
-def iproute2_error(error):
-    args_ = error.args[0]
-    if args_['message'] == ['RTNETLINK answers: File exists\n']:
-        if args_['command'].startswith('sudo ip link add'):
-            return jsonify({'error': f'Interface name {args_["interface"].name} is already in use.'}), 409
-        elif args_['command'].startswith('sudo ip link set'):
-            return jsonify({'error': f'Interface name {args_["name"]} is already in use.'}), 409
-        elif args_['command'].startswith('sudo ip address add'):
-            return jsonify({'error': f'Address {args_["address"].address} is already assigned to interface \
-{args_["interface"].name}. No need to assign again.'}), 409
-    return jsonify({'error': str(args_)}), 500
+@app.route('/interfaces:bulk', methods=['PUT'])
+def put_interfaces_bulk():
+    """Change interfaces.
+    ---
+    put:
+        summary: Change interfaces
+        description: Change all given interfaces, identified by id, as PUT /interfaces/{int_id} does for one. All \
+changes are validated before any is applied. Interfaces of different hosts are changed on their hosts in parallel. \
+Either all interfaces are changed or none, the index of the interface that could not be changed is returned with the \
+error.
+        operationId: put_interfaces_bulk
+        requestBody:
+            content:
+                application/json:
+                    schema:
+                        type: array
+                        items: Interface
+        responses:
+            200:
+                description: interfaces were successfully changed
+                content:
+                    application/json:
+                        schema:
+                            type: array
+                            items: Interface
+            400:
+                description: bad request
+                content:
+                    application/json:
+                        schema: Error
+            404:
+                description: some interface not found
+                content:
+                    application/json:
+                        schema: Error
+            409:
+                description: some interface cannot be changed, because name is already in use
+                content:
+                    application/json:
+                        schema: Error
+    """
+    errors = interface_update_schema.validate(request.json, many=True, partial=('name', 'mtu', 'addresses'))
+    if errors:
+        raise ValidationError(errors)
+    found = {interface.id: interface for interface in db.session.query(Interface).
+             options(selectinload(Interface.addresses)).filter(Interface.id.in_([item['id'] for item in request.json]))}
+    if len(found) < len({item['id'] for item in request.json}):
+        raise NoResultFound()
+    interfaces = [found[item['id']] for item in request.json]
+    check_host_unchanged([(index, interface, item) for index, (interface, item)
+                          in enumerate(zip(interfaces, request.json))])
+    check_names([(index, interface.host_id, item['name']) for index, (interface, item)
+                 in enumerate(zip(interfaces, request.json)) if item.get('name', interface.name) != interface.name])
+    check_addresses([(index, interface, data['address']) for index, (interface, item)
+                     in enumerate(zip(interfaces, request.json)) for data in item.get('addresses', [])], False)
+    host_ids = [interface.host_id for interface in interfaces]
+    states, errors = fleet.fan_out(host_ids, lambda connection, _: connection.dump_state())
+    if errors:
+        raise next(iter(errors.values()))
 
+    def commands(connection: Connection, host_id: int):
+        for interface, item in zip(interfaces, request.json):
+            if interface.host_id != host_id:
+                continue
+            link = states[host_id].get(interface.name)
+            connection.ip_link_set(interface, name=item.get('name'), mtu=item.get('mtu'))
+            interface.name = item.get('name', interface.name)
+            interface.mtu = item.get('mtu', interface.mtu)
+            if 'addresses' in item:
+                kept = {address.address: address for address in interface.addresses}
+                interface.addresses = [kept.pop(data['address'], None) or Address(**data) for data in item['addresses']]
+                db.session.add_all(interface.addresses)
+                connection.apply_address_plan(interface, plan_addresses(interface, link.addrs if link else []))
+    batches = apply_batches(commands, host_ids, interfaces)
 
-@app.errorhandler(400)
-def bad_request(_):
-    return jsonify({'error': 'Bad request.'}), 400
+    ids = [interface.id for interface in interfaces]
+    commit(batches)
+    return render_json(interface_serializer.dump_many(reload_interfaces(ids)))
 
 
-@app.errorhandler(404)
-def not_found(_):
-    return jsonify({'error': 'Not found.'}), 404
+@app.route('/interfaces:bulk', methods=['DELETE'])
+def delete_interfaces_bulk():
+    """Delete interfaces.
+    ---
+    delete:
+        summary: Delete interfaces
+        description: Delete all interfaces with given ids. Either all interfaces are deleted or none, the index of \
+the interface that could not be deleted is returned with the error.
+        operationId: delete_interfaces_bulk
+        requestBody:
+            content:
+                application/json:
+                    schema: BulkDelete
+        responses:
+            204:
+                description: interfaces deleted
+            400:
+                description: bad request
+                content:
+                    application/json:
+                        schema: Error
+            404:
+                description: some interface not found
+                content:
+                    application/json:
+                        schema: Error
+    """
+    ids = bulk_delete_schema.load(request.json)['ids']
+    found = {interface.id: interface for interface in db.session.query(Interface).
+             options(selectinload(Interface.addresses)).filter(Interface.id.in_(ids))}
+    if len(found) < len(set(ids)):
+        raise NoResultFound()
+    interfaces = [found[id_] for id_ in dict.fromkeys(ids)]
 
+    def commands(connection: Connection, host_id: int):
+        for interface in interfaces:
+            if interface.host_id == host_id:
+                connection.ip_link_delete(interface)
+    batches = apply_batches(commands, [interface.host_id for interface in interfaces], interfaces)
 
-@app.errorhandler(405)
-def method_not_allowed(_):
-    return jsonify({'error': 'Method not allowed.'}), 405
+    for interface in interfaces:
+        db.session.delete(interface)
+    commit(batches)
+    return '', 204
 
 
-def generate_spec():
-    spec.components.schema("Interface", schema=InterfaceSchema)
-    spec.components.schema("Address", schema=AddressSchema)
-    spec.components.schema("Error", {"properties": {"error": {"type": "string"}}})  # TODO ValidationError?
-    with app.test_request_context():
-        spec.path(view=get_interfaces)
-        spec.path(view=get_interface)
-        spec.path(view=post_interface)
-        spec.path(view=put_interface)
-        spec.path(view=delete_interface)
-        spec.path(view=get_address)
-        spec.path(view=get_addresses)
+@app.route('/addresses:bulk', methods=['POST'])
+def post_addresses_bulk():
+    """Assign addresses.
+    ---
+    post:
+        summary: Assign addresses
+        description: Assign all given addresses to previously created interfaces. All addresses are validated \
+before any is assigned. Either all addresses are assigned or none, the index of the address that could not be \
+assigned is returned with the error.
+        operationId: post_addresses_bulk
+        requestBody:
+            content:
+                application/json:
+                    schema:
+                        type: array
+                        items: Address
+        responses:
+            201:
+                description: addresses successfully assigned
+                content:
+                    application/json:
+                        schema:
+                            type: array
+                            items: Address
+            400:
+                description: bad request
+                content:
+                    application/json:
+                        schema: Error
+            404:
+                description: some interface not found
+                content:
+                    application/json:
+                        schema: Error
+            409:
+                description: some address is already assigned to its interface
+                content:
+                    application/json:
+                        schema: Error
+    """
+    addresses = address_schema.load(request.json, many=True)
+    interfaces = {interface.id: interface for interface in db.session.query(Interface).
+                  filter(Interface.id.in_([address.interface_id for address in addresses]))}
+    if len(interfaces) < len({address.interface_id for address in addresses}):
+        raise NoResultFound()
+    check_addresses([(index, interfaces[address.interface_id], address.address)
+                     for index, address in enumerate(addresses)])
+
+    def commands(connection: Connection, host_id: int):
+        for address in addresses:
+            if interfaces[address.interface_id].host_id == host_id:
+                connection.ip_address_add(address, interfaces[address.interface_id])
+    batches = apply_batches(commands, [interface.host_id for interface in interfaces.values()], addresses)
+
+    db.session.add_all(addresses)
+    db.session.flush()
+    ids = [address.id for address in addresses]
+    commit(batches)
+    return render_json(address_serializer.dump_many(reload_addresses(ids))), 201
+
+
+@app.route('/addresses:bulk', methods=['DELETE'])
+def delete_addresses_bulk():
+    """Delete addresses.
+    ---
+    delete:
+        summary: Delete addresses
+        description: Delete all addresses with given ids. Either all addresses are deleted or none, the index of the \
+address that could not be deleted is returned with the error.
+        operationId: delete_addresses_bulk
+        requestBody:
+            content:
+                application/json:
+                    schema: BulkDelete
+        responses:
+            204:
+                description: addresses deleted
+            400:
+                description: bad request
+                content:
+                    application/json:
+                        schema: Error
+            404:
+                description: some address not found
+                content:
+                    application/json:
+                        schema: Error
+    """
+    ids = bulk_delete_schema.load(request.json)['ids']
+    found = {address.id: address for address in db.session.query(Address).
+             options(joinedload(Address.interface)).filter(Address.id.in_(ids))}
+    if len(found) < len(set(ids)):
+        raise NoResultFound()
+    addresses = [found[id_] for id_ in dict.fromkeys(ids)]
+
+    def commands(connection: Connection, host_id: int):
+        for address in addresses:
+            if address.interface.host_id == host_id:
+                connection.ip_address_delete(address, address.interface)
+    batches = apply_batches(commands, [address.interface.host_id for address in addresses], addresses)
+
+    for address in addresses:
+        db.session.delete(address)
+    commit(batches)
+    return '', 204
+
+
+@app.route('/changes', methods=['GET'])
+def get_changes():
+    """Return changes.
+    ---
+    get:
+        summary: Return changes
+        description: Return interfaces and addresses changed or deleted after change with given sequence number, and \
+the sequence number of the latest change to pass as since in the next call.
+        operationId: get_changes
+        parameters:
+        -   in: query
+            schema: ChangesArgsSchema
+        responses:
+            200:
+                description: rows changed after given change
+                content:
+                    application/json:
+                        schema: Changes
+            304:
+                description: not modified, ETag given in If-None-Match is current
+            400:
+                description: bad request
+                content:
+                    application/json:
+                        schema: Error
+    """
+    since = changes_args_schema.load(request.args)['since']
+    seq = sync_cache()
+
+    def render():
+        changed = {'interfaces': set(), 'addresses': set()}
+        deleted = {'interfaces': [], 'addresses': []}
+        for change in db.session.query(Change).filter(Change.seq > since, Change.seq <= seq).order_by(Change.seq):
+            if change.deleted:
+                deleted[change.table_name].append(change.row_id)
+            else:
+                changed[change.table_name].add(change.row_id)
+        return render_json({
+            'seq': seq,
+            'interfaces': interface_serializer.dump_many(db.session.query(Interface).
+                                                         options(selectinload(Interface.addresses)).
+                                                         filter(Interface.id.in_(changed['interfaces']))),
+            'addresses': address_serializer.dump_many(db.session.query(Address).
+                                                      filter(Address.id.in_(changed['addresses']))),
+            'deleted': deleted,
+        })
+    return conditional(str(seq), render)
+
+
+@app.route('/export', methods=['GET'])
+def get_export():
+    """Export interfaces.
+    ---
+    get:
+        summary: Export interfaces
+        description: Stream all interfaces created through API with their addresses, ordered by id, one JSON \
+document per line. Rows are read through two cursors, so memory does not grow with the inventory. Rows changed \
+while the export runs may or may not be included.
+        operationId: get_export
+        responses:
+            200:
+                description: interfaces as newline delimited JSON
+                content:
+                    application/x-ndjson:
+                        schema: Interface
+    """
+    def lines():
+        interfaces = db.session.query(Interface.id, Interface.name, Interface.mtu, Interface.host_id).\
+            order_by(Interface.id).yield_per(list_page_size)
+        addresses = iter(db.session.query(Address.interface_id, Address.id, Address.address).
+                         filter(Address.interface_id.isnot(None)).order_by(Address.interface_id, Address.id).
+                         yield_per(list_page_size))
+        address, spent = next(addresses, None), 0.0
+        try:
+            for interface in interfaces:
+                own = []
+                while address is not None and address.interface_id <= interface.id:
+                    if address.interface_id == interface.id:
+                        own.append(address)
+                    address = next(addresses, None)
+                start = perf_counter()
+                line = dumps(interface_serializer.dump(SimpleNamespace(**interface._asdict(), addresses=own))) + b'\n'
+                spent += perf_counter() - start
+                yield line
+        finally:
+            serialization_duration.observe(spent, '/export')
+    return Response(stream_with_context(lines()), mimetype='application/x-ndjson')
+
+
+def import_chunk(chunk: List[Tuple[int, Dict]], states: Dict[int, Dict[str, LinkState]],
+                 imported: Set[Tuple[int, str]], counts: Dict[str, int]) -> None:
+    """Store and apply one chunk of imported interfaces in one transaction and one batch per host.
+
+    Interfaces are matched by host and name. A dummy interface that exists in the system but not in the database is
+    adopted, any other system interface is a conflict. states are the states of hosts by host id, read on first use
+    and refreshed for interfaces imported by earlier chunks, which are given by host and name.
+    """
+    items = []
+    for index, item in chunk:
+        try:
+            items.append((index, interface_import_schema.load(item), item))
+        except ValidationError as e:
+            raise ValidationError({index: e.messages})
+    check_hosts([(index, loaded.host_id) for index, loaded, _ in items])
+    found = {(interface.host_id, interface.name): interface for interface in db.session.query(Interface).
+             options(selectinload(Interface.addresses)).filter(Interface.host_id.in_({i.host_id for _, i, _ in items}),
+                                                               Interface.name.in_({i.name for _, i, _ in items}))}
+    names = {(loaded.host_id, loaded.name) for _, loaded, _ in items}
+
+    def dump_state(connection: Connection, host_id: int) -> Dict[str, LinkState]:
+        if host_id not in states:
+            return connection.dump_state(details=True, fresh=True)
+        state = states[host_id]
+        for name in {name for host, name in names & imported if host == host_id}:
+            state.pop(name, None)
+            state.update(connection.dump_state(name, details=True))
+        return state
+    host_ids = [loaded.host_id for _, loaded, _ in items]
+    dumped, errors = fleet.fan_out(host_ids, dump_state)
+    if errors:
+        raise next(iter(errors.values()))
+    states.update(dumped)
+    imported |= names
+
+    interfaces = []
+    for index, loaded, item in items:
+        interface = found.get((loaded.host_id, loaded.name))
+        if interface is None:
+            link = states[loaded.host_id].get(loaded.name)
+            if link is not None and link.kind != 'dummy':
+                raise Conflict(f'Interface name {loaded.name} is already in use.', index)
+            interface = found[(loaded.host_id, loaded.name)] = loaded
+            db.session.add(interface)
+            counts['created'] += 1
+        desired = [data['address'] for data in item.get('addresses', [])]
+        check_addresses([(index, interface, address) for address in desired], False)
+        if interface is not loaded:
+            changed = interface.mtu != loaded.mtu or {a.address for a in interface.addresses} != set(desired)
+            counts['updated' if changed else 'unchanged'] += 1
+            interface.mtu = loaded.mtu
+        kept = {address.address: address for address in interface.addresses}
+        interface.addresses = [kept.pop(address, None) or Address(address=address) for address in desired]
+        db.session.add_all(interface.addresses)
+        interfaces.append(interface)
+
+    plans = {host_id: plan_interfaces([interface for interface in interfaces if interface.host_id == host_id],
+                                      states[host_id]) for host_id in dict.fromkeys(host_ids)}
+    try:
+        batches = apply_batches(lambda connection, host_id: apply_plans(connection, plans[host_id]), plans, interfaces)
+    except Iproute2Error as e:
+        if 'index' in e.args[0]:
+            e.args[0]['index'] = chunk[e.args[0]['index']][0]
+        raise e
+    commit(batches)
+
+
+@app.route('/import', methods=['POST'])
+def post_import():
+    """Import interfaces.
+    ---
+    post:
+        summary: Import interfaces
+        description: Create or change interfaces given one JSON document per line, e.g. as returned by GET /export, \
+matched by host and name, ids are ignored, a missing host_id means the configured server. Each line is the whole \
+state of an interface, a missing mtu means 1500, missing addresses mean none. Interfaces not in the stream are \
+left as they are. The stream is read, validated, stored and applied in chunks, the next chunk is read only when the \
+previous one is applied. Either a whole chunk is imported or none of it, chunks before a failed one stay imported, \
+the index of the failed line is returned with the error. Import is idempotent, the stream can be sent again after \
+fixing it.
+        operationId: post_import
+        requestBody:
+            content:
+                application/x-ndjson:
+                    schema: Interface
+        responses:
+            200:
+                description: all lines were imported
+                content:
+                    application/json:
+                        schema: Import
+            400:
+                description: bad request
+                content:
+                    application/json:
+                        schema: Error
+            409:
+                description: some interface name is in use by a system interface that is not a dummy one
+                content:
+                    application/json:
+                        schema: Error
+    """
+    counts = {'created': 0, 'updated': 0, 'unchanged': 0}
+    states, imported = {}, set()
+    for chunk in read_ndjson(request.stream, import_chunk_size):
+        import_chunk(chunk, states, imported, counts)
+    return render_json(import_result_schema.dump(counts))
+
+
+@app.route('/hosts', methods=['GET'])
+def get_hosts():
+    """Return all hosts.
+    ---
+    get:
+        summary: Return all hosts
+        description: Return all hosts interfaces are managed on, ordered by id. Host 1 is the configured server.
+        operationId: get_hosts
+        responses:
+            200:
+                description: list of all hosts
+                content:
+                    application/json:
+                        schema:
+                            type: array
+                            items: Host
+    """
+    return render_json(host_serializer.dump_many(db.session.query(Host).order_by(Host.id)))
+
+
+@app.route('/hosts', methods=['POST'])
+def post_host():
+    """Add host.
+    ---
+    post:
+        summary: Add new host
+        description: Register a host to manage interfaces on over SSH. Unless the live index is disabled, its \
+`ip monitor` connection is opened at once, in the background, connections for commands are opened on first use.
+        operationId: post_host
+        requestBody:
+            content:
+                application/json:
+                    schema: Host
+        responses:
+            201:
+                description: host was successfully added
+                content:
+                    application/json:
+                        schema: Host
+            400:
+                description: bad request
+                content:
+                    application/json:
+                        schema: Error
+            409:
+                description: host name is already in use
+                content:
+                    application/json:
+                        schema: Error
+    """
+    host = host_schema.load(request.json)
+    if db.session.query(Host.id).filter_by(name=host.name).first() is not None:
+        raise Conflict(f'Host name {host.name} is already in use.', None)
+    db.session.add(host)
+    db.session.commit()
+    fleet.get(host.id)
+    return make_response(render_json(host_serializer.dump(host)), 201)
+
+
+@app.route('/hosts/<int:host_id>', methods=['GET'])
+def get_host(host_id: int):
+    """Return selected host.
+    ---
+    get:
+        summary: Return selected host
+        description: Return host with given id.
+        operationId: get_host
+        parameters:
+        -   in: path
+            name: host_id
+            description: host id
+            schema:
+                 type: integer
+        responses:
+            200:
+                description: host with given id
+                content:
+                    application/json:
+                        schema: Host
+            404:
+                description: host not found
+                content:
+                    application/json:
+                        schema: Error
+    """
+    return render_json(host_serializer.dump(db.session.query(Host).filter_by(id=host_id).one()))
+
+
+@app.route('/hosts/<int:host_id>', methods=['DELETE'])
+def delete_host(host_id: int):
+    """Delete selected host.
+    ---
+    delete:
+        summary: Delete selected host
+        description: Stop managing host with given id and close its connections. Interfaces of the host must be \
+deleted first, the configured server cannot be deleted.
+        operationId: delete_host
+        parameters:
+        -   in: path
+            name: host_id
+            description: host id
+            schema:
+                 type: integer
+        responses:
+            204:
+                description: host was successfully deleted
+            404:
+                description: host not found
+                content:
+                    application/json:
+                        schema: Error
+            409:
+                description: host is the configured server or still has interfaces
+                content:
+                    application/json:
+                        schema: Error
+    """
+    host = db.session.query(Host).filter_by(id=host_id).one()
+    if host.id == DEFAULT_HOST:
+        raise Conflict('The configured server cannot be deleted.', None)
+    if db.session.query(Interface.id).filter_by(host_id=host.id).first() is not None:
+        raise Conflict(f'Host {host.name} still has interfaces.', None)
+    db.session.delete(host)
+    db.session.commit()
+    fleet.remove(host_id)
+    return '', 204
+
+
+@app.route('/hosts/<int:host_id>/interfaces', methods=['GET'])
+def get_interfaces_by_host(host_id: int):
+    """Return all interfaces of selected host.
+    ---
+    get:
+        summary: Return all interfaces of selected host
+        description: Same as GET /interfaces, for interfaces of host with given id only.
+        operationId: get_interfaces_by_host
+        parameters:
+        -   in: path
+            name: host_id
+            description: host id
+            schema:
+                 type: integer
+        -   in: query
+            schema: InterfaceListArgsSchema
+        responses:
+            200:
+                description: list of all interfaces of host with given id
+                content:
+                    application/json:
+                        schema:
+                            type: array
+                            items: Interface
+            304:
+                description: not modified, ETag given in If-None-Match is current
+            404:
+                description: host not found
+                content:
+                    application/json:
+                        schema: Error
+    """
+    db.session.query(Host.id).filter_by(id=host_id).one()
+    return list_interfaces(host_id)
+
+
+@app.route('/hosts/<int:host_id>/interfaces', methods=['POST'])
+def post_interface_by_host(host_id: int):
+    """Add interface to selected host.
+    ---
+    post:
+        summary: Add new interface to selected host
+        description: Same as POST /interfaces, on host with given id, host_id of the body is ignored.
+        operationId: post_interface_by_host
+        parameters:
+        -   in: path
+            name: host_id
+            description: host id
+            schema:
+                 type: integer
+        requestBody:
+            content:
+                application/json:
+                    schema: Interface
+        responses:
+            201:
+                description: interface was successfully created
+                content:
+                    application/json:
+                        schema: Interface
+            202:
+                description: interface was stored, iproute2 commands are queued as a job
+                content:
+                    application/json:
+                        schema: Job
+            400:
+                description: bad request
+                content:
+                    application/json:
+                        schema: Error
+            404:
+                description: host not found
+                content:
+                    application/json:
+                        schema: Error
+            409:
+                description: interface cannot be created, because name is already in use
+                content:
+                    application/json:
+                        schema: Error
+    """
+    db.session.query(Host.id).filter_by(id=host_id).one()
+    return create_interface(dict(request.json or {}, host_id=host_id))
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id: str):
+    """Return selected job.
+    ---
+    get:
+        summary: Return selected job
+        description: Return job queued by a request with Prefer header set to respond-async. Jobs are kept in memory \
+of the process that accepted the request, finished jobs are forgotten when there are too many of them.
+        operationId: get_job
+        parameters:
+        -   in: path
+            name: job_id
+            description: job id
+            schema:
+                 type: string
+        responses:
+            200:
+                description: job with given id
+                content:
+                    application/json:
+                        schema: Job
+            404:
+                description: job not found
+                content:
+                    application/json:
+                        schema: Error
+    """
+    job = jobs.get(job_id)
+    if job is None:
+        raise NoResultFound()
+    return render_json(job_schema.dump(job))
+
+
+@app.route('/drift', methods=['GET'])
+def get_drift():
+    """Return drift counters.
+    ---
+    get:
+        summary: Return drift counters
+        description: Return counters of the background reconcilers that detect interfaces changed on hosts \
+bypassing the API and bring them back in sync with the database, summed over all hosts.
+        operationId: get_drift
+        responses:
+            200:
+                description: drift counters since start of the process
+                content:
+                    application/json:
+                        schema: Drift
+    """
+    reconcilers = [member.reconciler for member in fleet.members().values()]
+    counters = Counter()
+    for reconciler in reconcilers:
+        counters.update(reconciler.counters)
+    return render_json(drift_schema.dump(dict(
+        counters, last_check=max(filter(None, (reconciler.last_check for reconciler in reconcilers)), default=None),
+        last_drift=max(filter(None, (reconciler.last_drift for reconciler in reconcilers)), default=None))))
+
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Return metrics.
+    ---
+    get:
+        summary: Return metrics
+        description: Return histograms of the durations of requests by route, of iproute2 commands by kind, of SQL \
+statements by kind and of JSON rendering by route, in the Prometheus text format. Every process of a deployment \
+reports only what it handled itself.
+        operationId: get_metrics
+        responses:
+            200:
+                description: metrics since start of the process
+                content:
+                    text/plain:
+                        schema:
+                            type: string
+            404:
+                description: metrics are disabled
+                content:
+                    application/json:
+                        schema: Error
+    """
+    if not metrics_enabled:
+        raise NoResultFound()
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/health/live', methods=['GET'])
+def get_liveness():
+    """Return liveness.
+    ---
+    get:
+        summary: Return liveness
+        description: Respond as long as the process serves requests, without touching the database or the VM.
+        operationId: get_liveness
+        responses:
+            204:
+                description: the process is alive
+    """
+    return '', 204
+
+
+@app.route('/health/ready', methods=['GET'])
+def get_readiness():
+    """Return readiness.
+    ---
+    get:
+        summary: Return readiness
+        description: Check that the database can be read, that an SSH connection to the VM is open, opening it if \
+needed, and that reconciliation at startup of the deployment is finished.
+        operationId: get_readiness
+        responses:
+            200:
+                description: the process is ready to serve requests
+                content:
+                    application/json:
+                        schema: Readiness
+            503:
+                description: some check failed
+                content:
+                    application/json:
+                        schema: Readiness
+    """
+    checks = {'database': False, 'ssh': False, 'reconciled': False}
+    try:
+        deployment = db.session.query(Deployment).get(app.config.get('NIMS_DEPLOYMENT', deployment_id))
+        checks['database'] = True
+        checks['reconciled'] = deployment is not None and deployment.finished is not None
+    except SQLAlchemyError:
+        pass
+    try:
+        get_connection()
+        checks['ssh'] = True
+    except Exception as e:
+        app.logger.warning(f'SSH connection failed: {e}')
+    return render_json(readiness_schema.dump(checks)), 200 if all(checks.values()) else 503
+
+
+@app.errorhandler(ValidationError)
+def validation_error(error):
+    return jsonify({'error': error.messages}), 400
+
+
+@app.errorhandler(NoResultFound)
+def not_found(_):
+    return jsonify({'error': 'No result found.'}), 404
+
+
+@app.errorhandler(Conflict)
+def conflict(error):
+    message, index = error.args
+    return jsonify({'error': message} if index is None else {'error': message, 'index': index}), 409
+
+
+@app.errorhandler(IntegrityError)
+def integrity_error(_):
+    # a concurrent request took the name or the address after this one was checked
+    return jsonify({'error': 'Interface name or address is already in use.'}), 409
+
+
+@app.errorhandler(Iproute2Error)
+def iproute2_error(error):
+    # conflicts are normally found before any command is sent, this covers the kernel changing in between
+    args_ = error.args[0]
+    code, op = error_code(args_['message']), args_.get('op')
+    response, status = {'error': str(args_), 'code': code}, 500
+    if code == 'EEXIST' and op == 'link add':
+        response, status = {'error': f'Interface name {args_["interface"].name} is already in use.', 'code': code}, 409
+    elif code == 'EEXIST' and op == 'link set':
+        response, status = {'error': f'Interface name {args_["name"]} is already in use.', 'code': code}, 409
+    elif code == 'EEXIST' and op == 'address add':
+        response, status = {'error': f'Address {args_["address"].address} is already assigned to interface \
+{args_["interface"].name}. No need to assign again.', 'code': code}, 409
+    if 'index' in args_:
+        response['index'] = args_['index']
+    return jsonify(response), status
+
+
+@app.errorhandler(400)
+def bad_request(_):
+    return jsonify({'error': 'Bad request.'}), 400
+
+
+@app.errorhandler(404)
+def not_found(_):
+    return jsonify({'error': 'Not found.'}), 404
+
+
+@app.errorhandler(405)
+def method_not_allowed(_):
+    return jsonify({'error': 'Method not allowed.'}), 405
+
+
+def generate_spec():
+    spec.components.schema("Interface", schema=InterfaceSchema)
+    spec.components.schema("Address", schema=AddressSchema)
+    spec.components.schema("Changes", schema=ChangesSchema)
+    spec.components.schema("BulkDelete", schema=BulkDeleteSchema)
+    spec.components.schema("Job", schema=JobSchema)
+    spec.components.schema("Drift", schema=DriftSchema)
+    spec.components.schema("Import", schema=ImportResultSchema)
+    spec.components.schema("Readiness", schema=ReadinessSchema)
+    spec.components.schema("Host", schema=HostSchema)
+    spec.components.schema("Error", {"properties": {"error": {"type": "string"},  # TODO ValidationError?
+                                                    "code": {"type": "string"},
+                                                    "index": {"type": "integer"}}})
+    with app.test_request_context():
+        spec.path(view=get_interfaces)
+        spec.path(view=get_interface)
+        spec.path(view=post_interface)
+        spec.path(view=put_interface)
+        spec.path(view=delete_interface)
+        spec.path(view=get_address)
+        spec.path(view=get_addresses)
         spec.path(view=post_addresses)
         spec.path(view=delete_address)
         spec.path(view=get_address_by_interface)
         spec.path(view=get_addresses_by_interface)
         spec.path(view=post_addresses_by_interface)
         spec.path(view=delete_address_by_interface)
+        spec.path(view=get_changes)
+        spec.path(view=post_interfaces_bulk)
+        spec.path(view=put_interfaces_bulk)
+        spec.path(view=delete_interfaces_bulk)
+        spec.path(view=post_addresses_bulk)
+        spec.path(view=delete_addresses_bulk)
+        spec.path(view=get_export)
+        spec.path(view=post_import)
+        spec.path(view=get_hosts)
+        spec.path(view=post_host)
+        spec.path(view=get_host)
+        spec.path(view=delete_host)
+        spec.path(view=get_interfaces_by_host)
+        spec.path(view=post_interface_by_host)
+        spec.path(view=get_job)
+        spec.path(view=get_drift)
+        spec.path(view=get_metrics)
+        spec.path(view=get_liveness)
+        spec.path(view=get_readiness)
     with open('openapi.json', 'w') as f:
         f.write(json.dumps(spec.to_dict(), indent=2))
 
 
-with SSHClient() as ssh:
-    interface_schema = InterfaceSchema()
-    address_schema = AddressSchema()
-    concise_address_schema = ConciseAddressSchema()
-    connection = Connection(ssh)
-    startup(connection)
+@app.cli.command('spec')
+def spec_command():
+    """Write openapi.json, run `flask spec` at build time whenever the API changes."""
     generate_spec()
 
-    if __name__ == '__main__':
-        app.run(debug=True)
+
+interface_schema = InterfaceSchema()
+address_schema = AddressSchema()
+concise_address_schema = ConciseAddressSchema()
+interface_update_schema = InterfaceUpdateSchema()
+bulk_delete_schema = BulkDeleteSchema()
+interface_list_args_schema = InterfaceListArgsSchema()
+address_list_args_schema = AddressListArgsSchema()
+changes_args_schema = ChangesArgsSchema()
+job_schema = JobSchema()
+interface_import_schema = InterfaceImportSchema()
+import_result_schema = ImportResultSchema()
+readiness_schema = ReadinessSchema()
+drift_schema = DriftSchema()
+host_schema = HostSchema()
+interface_serializer = Serializer(interface_schema)
+address_serializer = Serializer(address_schema)
+concise_address_serializer = Serializer(concise_address_schema)
+host_serializer = Serializer(host_schema)
+interfaces_cache = Collection(load_interfaces)
+addresses_cache = Collection(lambda ids: load_addresses(ids, address_serializer))
+concise_addresses_cache = Collection(lambda ids: load_addresses(ids, concise_address_serializer))
+cache_seq = 0
+cache_lock = Lock()
+tune(db.engine)
+fleet = Fleet(host_target, load_desired)
+jobs = JobQueue(run_job)
+started = Lock()
+
+
+def create_app(deployment: str = deployment_id) -> Flask:
+    """Return the application, on first call migrating the database and starting background work of the process.
+
+    Importing the module has no side effects. The live index of every host opens its `ip monitor` connection in the
+    background, connections for commands are opened on first use, so a worker starts at once. Reconciliation at
+    startup runs in the background too, once per deployment, see startup_once(). Serve it with e.g.
+    `gunicorn 'app:create_app()'` from the repository root, where gunicorn.conf.py gives its workers one deployment.
+    """
+    if started.acquire(blocking=False):
+        app.config['NIMS_DEPLOYMENT'] = deployment
+        migrate(db.engine)
+        fleet.start()
+        with app.app_context():
+            for host_id, in db.session.query(Host.id):
+                fleet.get(host_id)
+        Thread(target=startup_once, args=(deployment,), name='startup', daemon=True).start()
+    return app
+
+
+if __name__ == '__main__':
+    create_app().run(debug=True, threaded=True)
 
 
 # TODO: IPv6 addresses
@@ -620,3 +2261,22 @@ with SSHClient() as ssh:
 #   POST /interfaces/1/addresses
 #   GET /interfaces/1/addresses/1
 #   DELETE /interfaces/1/addresses/1
+#   GET /changes
+#   POST /interfaces:bulk
+#   PUT /interfaces:bulk
+#   DELETE /interfaces:bulk
+#   POST /addresses:bulk
+#   DELETE /addresses:bulk
+#   GET /export
+#   POST /import
+#   GET /hosts
+#   POST /hosts
+#   GET /hosts/1
+#   DELETE /hosts/1
+#   GET /hosts/1/interfaces
+#   POST /hosts/1/interfaces
+#   GET /jobs/1
+#   GET /drift
+#   GET /metrics
+#   GET /health/live
+#   GET /health/ready
@@ -0,0 +1,274 @@
+"""Latency and throughput of every route of app.py against a simulated VM, see fakevm.py.
+
+Every route is requested one request at a time for p50 and p99 latency and for SQL statements and SSH round trips per
+request, then by threads clients at once for throughput. Requests that change or delete interfaces, addresses or hosts
+get rows of their own, created before timing starts, and the background work that creating them caused finishes
+before, too. The inventory has the given number of interfaces on the configured server and a tenth of it on a second
+host, each with one address. Results are compared with the baseline of the same backend and parameters, see
+baselines.py, and regressions make the exit status 1. NIMS_* variables set in the environment apply, e.g.
+NIMS_LIVE_INDEX=0.
+
+Usage: python benchmarks/api.py [--backend exec|shell|asyncssh] [--interfaces N] [--requests N] [--threads N]
+                                [--round-trip MS] [--error-rate RATE] [--tolerance RATE] [--save]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+from itertools import count
+from random import Random
+from statistics import mean
+from threading import Thread
+from time import monotonic, perf_counter, sleep
+from typing import Callable, Dict, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import baselines  # noqa: E402
+import fakevm  # noqa: E402
+
+# method, URL and keyword arguments of the test client
+Request = Tuple[str, str, Dict]
+
+CHANGES = r'^(link|address) (add|set|delete) '
+names = (f'b{i}' for i in count())
+addresses = (f'10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}' for i in count(1 << 20))
+random = Random(0)
+# URLs of async jobs queued by scenarios and not known to be finished yet
+submitted: List[str] = []
+
+
+def create(client, number: int, per_interface: int = 1, host_id: int = 1) -> List[Dict]:
+    """Create interfaces with addresses through the API and return them as it does."""
+    created = []
+    for start in range(0, number, 500):
+        response = client.post('/interfaces:bulk', json=[
+            {'name': next(names), 'host_id': host_id,
+             'addresses': [{'address': next(addresses)} for _ in range(per_interface)]}
+            for _ in range(min(500, number - start))])
+        assert response.status_code == 201, response.get_data(as_text=True)
+        created += json.loads(response.get_data())
+    return created
+
+
+def scenarios(client, seeds: List[Dict]) -> Dict[str, Callable[[int], List[Request]]]:
+    """Return functions that create what number requests of a route need and return the requests, by route."""
+    def pick(number: int) -> List[Dict]:
+        return [random.choice(seeds) for _ in range(number)]
+
+    def jobs(number: int) -> List[Request]:
+        locations = [client.post('/interfaces', json={'name': next(names)}, headers={'Prefer': 'respond-async'}).
+                     headers['Location'] for _ in range(number)]
+        submitted.extend(locations)
+        return [('GET', location, {}) for location in locations]
+
+    def hosts(number: int) -> List[Dict]:
+        return [json.loads(client.post('/hosts', json={'name': next(names), 'address': next(addresses)}).get_data())
+                for _ in range(number)]
+
+    def imported(number: int) -> List[Request]:
+        lines = client.get('/export').get_data().splitlines(keepends=True)[:100]
+        return [('POST', '/import', {'data': b''.join(lines)})] * number
+
+    def since(number: int) -> List[Request]:
+        seq = int(client.get('/interfaces').headers['ETag'].strip('"W/'))
+        return [('GET', f'/changes?since={max(0, seq - 100)}', {})] * number
+
+    return {
+        'GET /interfaces': lambda n: [('GET', '/interfaces', {})] * n,
+        'GET /interfaces (filtered)': lambda n: [
+            ('GET', '/interfaces?name_prefix=b1&has_address=1&limit=100', {})] * n,
+        'POST /interfaces': lambda n: [
+            ('POST', '/interfaces', {'json': {'name': next(names), 'addresses': [{'address': next(addresses)}]}})
+            for _ in range(n)],
+        'GET /interfaces/<int:int_id>': lambda n: [('GET', f'/interfaces/{i["id"]}', {}) for i in pick(n)],
+        'PUT /interfaces/<int:int_id>': lambda n: [
+            ('PUT', f'/interfaces/{i["id"]}', {'json': {'mtu': 1400, 'addresses': [
+                {'address': i['addresses'][0]['address']}, {'address': next(addresses)}]}}) for i in create(client, n)],
+        'DELETE /interfaces/<int:int_id>': lambda n: [('DELETE', f'/interfaces/{i["id"]}', {})
+                                                      for i in create(client, n)],
+        'GET /interfaces/<int:int_id>/addresses': lambda n: [('GET', f'/interfaces/{i["id"]}/addresses', {})
+                                                             for i in pick(n)],
+        'POST /interfaces/<int:int_id>/addresses': lambda n: [
+            ('POST', f'/interfaces/{i["id"]}/addresses', {'json': {'address': next(addresses)}}) for i in pick(n)],
+        'GET /interfaces/<int:int_id>/addresses/<int:addr_id>': lambda n: [
+            ('GET', f'/interfaces/{i["id"]}/addresses/{i["addresses"][0]["id"]}', {}) for i in pick(n)],
+        'DELETE /interfaces/<int:int_id>/addresses/<int:addr_id>': lambda n: [
+            ('DELETE', f'/interfaces/{i["id"]}/addresses/{i["addresses"][0]["id"]}', {}) for i in create(client, n)],
+        'GET /addresses': lambda n: [('GET', '/addresses', {})] * n,
+        'GET /addresses (cidr)': lambda n: [('GET', '/addresses?cidr=10.0.1.0/24', {})] * n,
+        'POST /addresses': lambda n: [
+            ('POST', '/addresses', {'json': {'address': next(addresses), 'interface_id': i['id']}}) for i in pick(n)],
+        'GET /addresses/<int:addr_id>': lambda n: [('GET', f'/addresses/{i["addresses"][0]["id"]}', {})
+                                                   for i in pick(n)],
+        'DELETE /addresses/<int:addr_id>': lambda n: [('DELETE', f'/addresses/{i["addresses"][0]["id"]}', {})
+                                                      for i in create(client, n)],
+        'POST /addresses:bulk': lambda n: [
+            ('POST', '/addresses:bulk', {'json': [{'address': next(addresses), 'interface_id': i['id']}
+                                                  for i in pick(10)]}) for _ in range(n)],
+        'DELETE /addresses:bulk': lambda n: [
+            ('DELETE', '/addresses:bulk', {'json': {'ids': [address['id'] for address in i['addresses']]}})
+            for i in create(client, n, 10)],
+        'POST /interfaces:bulk': lambda n: [
+            ('POST', '/interfaces:bulk', {'json': [{'name': next(names), 'addresses': [{'address': next(addresses)}]}
+                                                   for _ in range(10)]}) for _ in range(n)],
+        'PUT /interfaces:bulk': lambda n: [
+            ('PUT', '/interfaces:bulk', {'json': [{'id': i['id'], 'mtu': 1400} for i in chunk]})
+            for chunk in zip(*[iter(create(client, 10 * n))] * 10)],
+        'DELETE /interfaces:bulk': lambda n: [
+            ('DELETE', '/interfaces:bulk', {'json': {'ids': [i['id'] for i in chunk]}})
+            for chunk in zip(*[iter(create(client, 10 * n))] * 10)],
+        'GET /changes': since,
+        'GET /export': lambda n: [('GET', '/export', {})] * n,
+        'POST /import': imported,
+        'GET /jobs/<job_id>': jobs,
+        'GET /drift': lambda n: [('GET', '/drift', {})] * n,
+        'GET /metrics': lambda n: [('GET', '/metrics', {})] * n,
+        'GET /health/live': lambda n: [('GET', '/health/live', {})] * n,
+        'GET /health/ready': lambda n: [('GET', '/health/ready', {})] * n,
+        'GET /hosts': lambda n: [('GET', '/hosts', {})] * n,
+        'POST /hosts': lambda n: [('POST', '/hosts', {'json': {'name': next(names), 'address': next(addresses)}})
+                                  for _ in range(n)],
+        'GET /hosts/<int:host_id>': lambda n: [('GET', '/hosts/2', {})] * n,
+        'DELETE /hosts/<int:host_id>': lambda n: [('DELETE', f'/hosts/{host["id"]}', {}) for host in hosts(n)],
+        'GET /hosts/<int:host_id>/interfaces': lambda n: [('GET', '/hosts/2/interfaces', {})] * n,
+        'POST /hosts/<int:host_id>/interfaces': lambda n: [
+            ('POST', '/hosts/2/interfaces', {'json': {'name': next(names),
+                                                      'addresses': [{'address': next(addresses)}]}}) for _ in range(n)],
+    }
+
+
+def send(client, request: Request):
+    method, url, kwargs = request
+    response = client.open(url, method=method, **kwargs)
+    response.get_data()  # consume streamed responses
+    return response
+
+
+def quiesce(client, network: fakevm.Network, fleet, idle: float = 0.05, timeout: float = 60) -> None:
+    """Wait until submitted jobs have finished, the live index has read every monitor event, drift reconcilers have
+    checked again what they saw out of sync and no host has been sent a command for idle seconds. Jobs, the live index
+    and the drift reconcilers run in threads of their own, and round trips are counted on the hosts, so that only then
+    the round trips counted next are those of the requests timed."""
+    deadline = monotonic() + timeout
+    while submitted:
+        assert monotonic() < deadline, f'jobs not finished after {timeout:g}s'
+        response = client.get(submitted[-1])
+        # finished jobs beyond NIMS_JOB_HISTORY are forgotten
+        if response.status_code == 404 or json.loads(response.get_data())['status'] in ('done', 'failed'):
+            submitted.pop()
+        else:
+            sleep(0.01)
+    round_trips = None
+    while network.unread() or any(member.reconciler.settling() for member in fleet.members().values()) or \
+            network.counts()['round trip'] != round_trips:
+        assert monotonic() < deadline, f'hosts still busy after {timeout:g}s'
+        round_trips = network.counts()['round trip']
+        sleep(idle)
+
+
+def latency(client, network: fakevm.Network, requests: List[Request]) -> Dict[str, float]:
+    times, statements, errors = [], [], 0
+    round_trips = network.counts()['round trip']
+    for request in requests:
+        start = perf_counter()
+        response = send(client, request)
+        times.append(perf_counter() - start)
+        statements.append(int(response.headers.get('X-Query-Count', 0)))
+        errors += response.status_code >= 400
+    return {'p50': baselines.percentile(times, 0.5) * 1e3, 'p99': baselines.percentile(times, 0.99) * 1e3,
+            'queries': mean(statements), 'round_trips': (network.counts()['round trip'] - round_trips) / len(requests),
+            'errors': errors}
+
+
+def throughput(app, requests: List[Request], threads: int) -> Tuple[float, int]:
+    """Return requests per second and failed requests of threads clients sending requests at once."""
+    statuses = []
+
+    def work(chunk: List[Request]):
+        client = app.test_client()
+        for request in chunk:
+            statuses.append(send(client, request).status_code)
+
+    workers = [Thread(target=work, args=(requests[i::threads],)) for i in range(threads)]
+    start = perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return len(requests) / (perf_counter() - start), sum(status >= 400 for status in statuses)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--backend', default='exec', choices=['exec', 'shell', 'asyncssh'])
+    parser.add_argument('--interfaces', type=int, default=1000, help='inventory size')
+    parser.add_argument('--requests', type=int, default=200, help='requests per route and phase')
+    parser.add_argument('--threads', type=int, default=8, help='concurrent clients for throughput')
+    parser.add_argument('--round-trip', type=float, default=1, help='SSH round trip in milliseconds')
+    parser.add_argument('--error-rate', type=float, default=0, help='rate of failing iproute2 changes')
+    parser.add_argument('--tolerance', type=float, default=0.5, help='allowed slowdown against the baseline')
+    parser.add_argument('--save', action='store_true', help='store results as the new baseline')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    # read by config.py when the app is imported
+    os.environ['NIMS_BACKEND'] = args.backend
+    os.environ['NIMS_DATABASE_PATH'] = f'sqlite:///{directory}/interfaces.db'
+    os.environ.setdefault('NIMS_QUERY_COUNT_HEADER', '1')
+    os.environ.setdefault('NIMS_DRIFT_INTERVAL', '0')
+    os.environ.setdefault('NIMS_DEPLOYMENT_ID', 'benchmark')
+    network = fakevm.install(fakevm.Network(round_trip=args.round_trip / 1e3))
+    import app
+
+    app.create_app()
+    client = app.app.test_client()
+    deadline = monotonic() + 60
+    while client.get('/health/ready').status_code != 200:
+        assert monotonic() < deadline, 'not ready after 60s'
+        sleep(0.01)
+    assert client.post('/hosts', json={'name': 'second', 'address': '10.255.0.2'}).status_code == 201
+    seeds = create(client, args.interfaces)
+    create(client, max(1, args.interfaces // 10), host_id=2)
+
+    routes = scenarios(client, seeds)
+    covered = {' '.join(label.split()[:2]) for label in routes}
+    missing = [f'{method} {rule}' for rule in app.app.url_map.iter_rules() if rule.endpoint != 'static'
+               for method in sorted(rule.methods - {'HEAD', 'OPTIONS'}) if f'{method} {rule}' not in covered]
+    print(f'{args.backend} backend, {args.interfaces} interfaces, {args.round_trip:g} ms round trip, '
+          f'{args.requests} requests per route, {args.threads} threads, error rate {args.error_rate:g}')
+    if missing:
+        print('  routes without a scenario:', ', '.join(missing))
+    print(f'  {"route":58} {"p50 ms":>8} {"p99 ms":>8} {"req/s":>8} {"queries":>8} {"trips":>6} {"errors":>6}')
+
+    results = {}
+    for label, requests in routes.items():
+        sequential, concurrent = requests(args.requests), requests(args.requests)
+        for host in network.hosts.values():
+            host.fail(CHANGES, rate=args.error_rate)
+        quiesce(client, network, app.fleet)
+        result = latency(client, network, sequential)
+        result['rps'], errors = throughput(app.app, concurrent, args.threads)
+        result['errors'] += errors
+        for host in network.hosts.values():
+            host.heal()
+        print(f'  {label:58} {result["p50"]:8.2f} {result["p99"]:8.2f} {result["rps"]:8.0f} '
+              f'{result["queries"]:8.1f} {result["round_trips"]:6.1f} {result.pop("errors"):6}')
+        results[label] = {key: round(value, 3) for key, value in result.items()}
+
+    # results depend on every parameter but the tolerance, those of other runs are no baseline
+    suite = (f'api {args.backend} interfaces {args.interfaces} requests {args.requests} threads {args.threads} '
+             f'round-trip {args.round_trip:g}' + (f' error-rate {args.error_rate:g}' if args.error_rate else ''))
+    if args.save:
+        baselines.save(suite, results)
+        return 0
+    if suite not in baselines.load():
+        print(f'  no baseline of {suite!r} to compare with, record one with --save')
+    regressions = baselines.compare(suite, results, args.tolerance)
+    for regression in regressions:
+        print('  regression:', regression)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,54 @@
+"""Results of benchmarks stored in baselines.json, so that later runs show regressions against them.
+
+Baselines depend on the machine they were recorded on, record them again with --save after an intended change of
+performance or on other hardware.
+"""
+import json
+import os
+from statistics import median
+from typing import Dict, List
+
+PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines.json')
+
+# metrics where more is better, any other one is a duration in milliseconds or a count per request
+HIGHER_IS_BETTER = {'rps'}
+
+
+def percentile(times: List[float], fraction: float) -> float:
+    times = sorted(times)
+    return median(times) if fraction == 0.5 else times[min(len(times) - 1, int(len(times) * fraction))]
+
+
+def load() -> Dict[str, Dict[str, Dict[str, float]]]:
+    if not os.path.exists(PATH):
+        return {}
+    with open(PATH) as f:
+        return json.load(f)
+
+
+def save(suite: str, results: Dict[str, Dict[str, float]]) -> None:
+    """Store results of a suite, e.g. `api exec`, replacing its previous baseline."""
+    baselines = load()
+    baselines[suite] = results
+    with open(PATH, 'w') as f:
+        json.dump(baselines, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+def compare(suite: str, results: Dict[str, Dict[str, float]], tolerance: float) -> List[str]:
+    """Return regressions of results against the baseline of a suite, metrics worse by more than tolerance, e.g. 0.5
+    for 50%. Values below one in both are ignored, they are noise."""
+    regressions, baselines = [], load().get(suite, {})
+    for name, metrics in results.items():
+        baseline = baselines.get(name, {})
+        for metric, value in metrics.items():
+            old = baseline.get(metric)
+            if not old:
+                continue
+            if metric in HIGHER_IS_BETTER:
+                worse = value < old / (1 + tolerance)
+            else:
+                worse = value > old * (1 + tolerance) and max(value, old) >= 1
+            if worse:
+                regressions.append(f'{name} {metric}: {old:.4g} -> {value:.4g}')
+    return regressions
@@ -0,0 +1,64 @@
+"""Latency of the lookups the API does by interface name, by interface id and by address, with and without the
+indexes of schema version 2.
+
+Usage: python benchmarks/db_lookups.py [rows]
+"""
+import os
+import sys
+import tempfile
+from random import Random
+from statistics import median
+from time import perf_counter
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from create_db import Interface, Address, migrate  # noqa: E402
+
+
+def address(i: int) -> str:
+    return f'10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}'
+
+
+def fill(engine, rows: int) -> None:
+    with engine.begin() as connection:
+        connection.execute(Interface.__table__.insert(),
+                           [{'id': i, 'name': f'dummy_{i}', 'mtu': 1500} for i in range(1, rows + 1)])
+        connection.execute(Address.__table__.insert(),
+                           [{'id': i, 'address': address(i), 'interface_id': i} for i in range(1, rows + 1)])
+
+
+def measure(lookup, keys) -> str:
+    times = []
+    for key in keys:
+        start = perf_counter()
+        lookup(key)
+        times.append(perf_counter() - start)
+    times.sort()
+    return f'p50 {median(times) * 1e6:9.1f} us   p99 {times[int(len(times) * 0.99)] * 1e6:9.1f} us'
+
+
+def main(rows: int = 100000, lookups: int = 200) -> None:
+    random = Random(0)
+    keys = [random.randint(1, rows) for _ in range(lookups)]
+    with tempfile.TemporaryDirectory() as directory:
+        for version in (1, 2):
+            engine = create_engine(f'sqlite:///{directory}/v{version}.db')
+            migrate(engine, 1)
+            fill(engine, rows)
+            migrate(engine, version)
+            session = Session(engine)
+            print(f'schema version {version}, {rows} interfaces and addresses')
+            query = session.query
+            print('  interface by name                 ',
+                  measure(lambda i: query(Interface).filter_by(name=f'dummy_{i}').one(), keys))
+            print('  addresses by interface_id         ',
+                  measure(lambda i: query(Address).filter_by(interface_id=i).all(), keys))
+            print('  address by interface_id, address  ',
+                  measure(lambda i: query(Address).filter_by(interface_id=i, address=address(i)).one(), keys))
+            session.close()
+            engine.dispose()
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:2]))
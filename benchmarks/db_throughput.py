@@ -0,0 +1,85 @@
+"""Read and write throughput of concurrent threads with the default SQLite setup and with the tuned one of
+config.py, with plain and baked single-row queries.
+
+Usage: python benchmarks/db_throughput.py [seconds] [readers] [writers]
+"""
+import os
+import sys
+import tempfile
+from random import Random
+from threading import Thread
+from time import perf_counter
+from sqlalchemy import bindparam, create_engine
+from sqlalchemy.ext import baked
+from sqlalchemy.orm import scoped_session, sessionmaker
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from create_db import Interface, engine_options, migrate, tune  # noqa: E402
+
+ROWS = 10000
+PROFILES = [
+    # name, pool size, pragmas, baked
+    ('default', 0, None, False),
+    ('tuned', 8, {}, False),
+    ('tuned, baked', 8, {}, True),
+]
+
+
+def run(path: str, pool_size: int, pragmas, use_baked: bool, seconds: float, readers: int, writers: int):
+    url = f'sqlite:///{path}'
+    engine = create_engine(url, **engine_options(url, pool_size, readers + writers))
+    if pragmas is not None:
+        tune(engine, **pragmas)
+    migrate(engine)
+    with engine.begin() as connection:
+        connection.execute(Interface.__table__.delete())
+        connection.execute(Interface.__table__.insert(),
+                           [{'id': i, 'name': f'dummy_{i}', 'mtu': 1500} for i in range(1, ROWS + 1)])
+    session = scoped_session(sessionmaker(engine))
+    bakery = baked.bakery()
+    counts = {'read': 0, 'write': 0}
+    deadline = perf_counter() + seconds
+
+    def lookup(int_id: int) -> Interface:
+        if use_baked:
+            query = bakery(lambda s: s.query(Interface).filter(Interface.id == bindparam('id')))
+            return query(session()).params(id=int_id).one()
+        return session.query(Interface).filter(Interface.id == bindparam('id')).params(id=int_id).one()
+
+    def reader(seed: int):
+        random, done = Random(seed), 0
+        while perf_counter() < deadline:
+            lookup(random.randint(1, ROWS))
+            session.remove()
+            done += 1
+        counts['read'] += done
+
+    def writer(seed: int):
+        random, done = Random(seed), 0
+        while perf_counter() < deadline:
+            lookup(random.randint(1, ROWS)).mtu = random.randint(1000, 9000)
+            session.commit()
+            session.remove()
+            done += 1
+        counts['write'] += done
+
+    threads = [Thread(target=reader, args=(i,)) for i in range(readers)] + \
+              [Thread(target=writer, args=(-i,)) for i in range(1, writers + 1)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    engine.dispose()
+    return counts['read'] / seconds, counts['write'] / seconds
+
+
+def main(seconds: float = 5, readers: int = 8, writers: int = 2) -> None:
+    print(f'{readers} readers, {writers} writers, {ROWS} interfaces, {seconds:g}s per profile')
+    with tempfile.TemporaryDirectory() as directory:
+        for number, (name, pool_size, pragmas, use_baked) in enumerate(PROFILES):
+            reads, writes = run(f'{directory}/{number}.db', pool_size, pragmas, use_baked, seconds, readers, writers)
+            print(f'  {name:14} {reads:9.0f} reads/s {writes:9.0f} writes/s')
+
+
+if __name__ == '__main__':
+    main(*(float(arg) if i == 0 else int(arg) for i, arg in enumerate(sys.argv[1:4])))
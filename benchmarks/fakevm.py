@@ -0,0 +1,516 @@
+"""Simulated VMs for benchmarks: an in-process stand-in for SSH and the iproute2 commands the service runs.
+
+VirtualHost keeps interfaces and addresses in memory and answers `ip link`, `ip address`, `ip -batch` and
+`ip -json monitor` the way iproute2 does, with the same messages on stderr, so that errors are handled as on a real
+VM. Every round trip and every command can be given a latency, and commands can be made to fail. install() makes the
+exec, shell and asyncssh backends reach virtual hosts of a Network instead of SSH servers:
+
+    network = Network(round_trip=0.001)
+    install(network)
+    network.host(server_address).add_link('eth0', kind=None)
+
+asyncssh itself is not needed, the asyncssh backend gets a stand-in of the parts of it the service uses.
+"""
+import asyncio
+import json
+import re
+import shlex
+from collections import Counter
+from io import StringIO
+from queue import Queue
+from random import Random
+from threading import Lock
+from time import sleep
+from types import SimpleNamespace
+from typing import Dict, Iterator, List, Optional, Pattern, Tuple
+from paramiko import SSHException
+
+IFNAMSIZ = 16
+
+# stderr of iproute2 on failures, as parsed by iproute2.error_code()
+EXISTS = 'RTNETLINK answers: File exists\n'
+NOT_SUPPORTED = 'RTNETLINK answers: Operation not supported\n'
+NO_ADDRESS = 'RTNETLINK answers: Cannot assign requested address\n'
+
+# options of ip link and ip address that take a value, anything else is positional
+ARGUMENTS = {'dev', 'name', 'mtu', 'type', 'local'}
+
+
+def operation(argv: List[str]) -> str:
+    """Object and command of an ip command line, e.g. `link add`, with the abbreviations ip accepts expanded."""
+    obj = 'address' if argv and 'address'.startswith(argv[0]) else argv[0] if argv else ''
+    return f'{obj} {argv[1] if len(argv) > 1 else "show"}'
+
+
+class Link:
+    __slots__ = ('ifindex', 'mtu', 'kind', 'addrs')
+
+    def __init__(self, ifindex: int, mtu: int, kind: Optional[str], addrs: List[Tuple[str, int]]):
+        self.ifindex = ifindex
+        self.mtu = mtu
+        self.kind = kind
+        self.addrs = addrs
+
+
+class VirtualHost:
+    """Kernel state of a simulated VM and the `ip` commands that read and change it.
+
+    Every command sent over SSH takes round_trip seconds, every command line, also within a batch, the seconds given
+    for its operation in latency, e.g. {'link add': 0.0005}, sleeping outside the lock of the host so that commands of
+    concurrent channels overlap. counts holds the number of round trips and of commands run by operation.
+    Connections opened before the last disconnect() are dead, new ones can be opened at once.
+    """
+
+    def __init__(self, round_trip: float = 0.0, latency: Optional[Dict[str, float]] = None, seed: int = 0):
+        self.round_trip = round_trip
+        self.latency = dict(latency or {})
+        self.links: Dict[str, Link] = {'lo': Link(1, 65536, None, [('127.0.0.1', 8)])}
+        self.counts = Counter()
+        self.generation = 0
+        self._next_index = 2
+        self._faults: List[Tuple[Pattern, str, float]] = []
+        self._random = Random(seed)
+        self._lock = Lock()
+        self._monitors: List[Queue] = []
+
+    def add_link(self, name: str, mtu: int = 1500, addrs: Tuple[str, ...] = (), kind: Optional[str] = 'dummy') -> None:
+        """Create an interface as if by someone else, without latency and without monitor events."""
+        with self._lock:
+            self.links[name] = Link(self._next_index, mtu, kind, [(addr, 32) for addr in addrs])
+            self._next_index += 1
+
+    def fail(self, pattern: str, message: str = 'RTNETLINK answers: No buffer space available\n',
+             rate: float = 1.0) -> None:
+        """Make command lines matching the regular expression fail with message, a rate of them at random."""
+        self._faults.append((re.compile(pattern), message, rate))
+
+    def heal(self) -> None:
+        self._faults.clear()
+
+    def disconnect(self) -> None:
+        """Drop all SSH connections, as a reboot of the VM does. Clients reconnect on their next command."""
+        self.generation += 1
+        with self._lock:
+            monitors, self._monitors = self._monitors, []
+        for monitor in monitors:
+            monitor.put(None)
+
+    def run(self, command: str, stdin: str = '') -> Tuple[str, str, float]:
+        """Run a command line as sent over SSH, return its stdout, stderr and the seconds it takes."""
+        argv = shlex.split(command)
+        if argv[:1] == ['sudo']:
+            argv = argv[1:]
+        if argv[:1] != ['ip']:
+            return '', f'bash: {argv[0] if argv else ""}: command not found\n', self.round_trip
+        options, argv = self._options(argv[1:])
+        self.counts['round trip'] += 1
+        if '-batch' not in options:
+            with self._lock:
+                out, err = self._run(options, argv)
+            return out, err, self.round_trip + self.latency.get(operation(argv), 0.0)
+        out, err, delay = self.run_lines(stdin.splitlines(), '-force' in options)
+        return out, err, self.round_trip + delay
+
+    def run_lines(self, lines: List[str], force: bool, first: int = 1) -> Tuple[str, str, float]:
+        """Run lines of `ip -batch -` input numbered from first, return stdout, stderr and the seconds they take."""
+        out, err, delay = '', '', 0.0
+        with self._lock:
+            for number, line in enumerate(lines, first):
+                options, argv = self._options(shlex.split(line))
+                line_out, line_err = self._run(options, argv)
+                out += line_out
+                delay += self.latency.get(operation(argv), 0.0)
+                if line_err:
+                    err += f'{line_err}Command failed -:{number}\n'
+                    if not force:
+                        break
+        return out, err, delay
+
+    @staticmethod
+    def _options(argv: List[str]) -> Tuple[List[str], List[str]]:
+        options = []
+        while argv and argv[0].startswith('-'):
+            options.append(argv.pop(0))
+        if options and options[-1] == '-batch' and argv[:1] == ['-']:
+            argv.pop(0)
+        return options, argv
+
+    def _run(self, options: List[str], argv: List[str]) -> Tuple[str, str]:
+        op = operation(argv)
+        self.counts[op] += 1
+        line = ' '.join(argv)
+        for pattern, message, rate in self._faults:
+            if pattern.search(line) and self._random.random() < rate:
+                return '', message
+        words = argv[2:]
+        positional = [word for i, word in enumerate(words) if (i == 0 or words[i - 1] not in ARGUMENTS) and
+                      word not in ARGUMENTS]
+        args = dict(zip(words, words[1:]))
+        args = {key: value for key, value in args.items() if key in ARGUMENTS}
+        if 'mtu' in args and not args['mtu'].isdigit():
+            return '', f'Error: argument "{args["mtu"]}" is wrong: "mtu" value is invalid\n'
+        handler = getattr(self, '_' + op.replace(' ', '_'), None)
+        if handler is None:
+            return '', f'Command "{argv[1] if len(argv) > 1 else ""}" is unknown, try "ip help".\n'
+        return handler(options, args, positional)
+
+    def _device(self, args: Dict[str, str]) -> Tuple[Optional[Link], str]:
+        name = args.get('dev', '')
+        link = self.links.get(name)
+        return link, '' if link is not None else f'Cannot find device "{name}"\n'
+
+    def _link_add(self, _, args: Dict[str, str], positional: List[str]) -> Tuple[str, str]:
+        name = positional[0] if positional else args.get('name', '')
+        if not name or len(name) >= IFNAMSIZ:
+            return '', f'Error: argument "{name}" is wrong: "name" not a valid ifname\n'
+        if name in self.links:
+            return '', EXISTS
+        link = self.links[name] = Link(self._next_index, int(args.get('mtu', 1500)), args.get('type'), [])
+        self._next_index += 1
+        self._event(self._link_json(name, link, True, False))
+        return '', ''
+
+    def _link_set(self, _, args: Dict[str, str], __) -> Tuple[str, str]:
+        link, err = self._device(args)
+        if link is None:
+            return '', err
+        name = args['dev']
+        if 'name' in args and args['name'] != name:
+            if args['name'] in self.links:
+                return '', EXISTS
+            if len(args['name']) >= IFNAMSIZ:
+                return '', f'Error: argument "{args["name"]}" is wrong: "name" not a valid ifname\n'
+            self.links[args['name']] = self.links.pop(name)
+            name = args['name']
+        if 'mtu' in args:
+            link.mtu = int(args['mtu'])
+        self._event(self._link_json(name, link, True, False))
+        return '', ''
+
+    def _link_delete(self, _, args: Dict[str, str], __) -> Tuple[str, str]:
+        link, err = self._device(args)
+        if link is None:
+            return '', err
+        if 'type' in args and args['type'] != link.kind:
+            return '', NOT_SUPPORTED
+        del self.links[args['dev']]
+        self._event(dict(self._link_json(args['dev'], link, False, False), deleted=True))
+        return '', ''
+
+    def _change_address(self, add: bool, args: Dict[str, str]) -> Tuple[str, str]:
+        link, err = self._device(args)
+        if link is None:
+            return '', err
+        local, _, prefixlen = args.get('local', '').partition('/')
+        addr = (local, int(prefixlen or 32))
+        if add == (addr in link.addrs):
+            return '', EXISTS if add else NO_ADDRESS
+        if add:
+            link.addrs.append(addr)
+        else:
+            link.addrs.remove(addr)
+        event = {'index': link.ifindex, 'dev': args['dev'], 'family': 'inet', 'local': local, 'prefixlen': addr[1]}
+        self._event(event if add else dict(event, deleted=True))
+        return '', ''
+
+    def _address_add(self, _, args: Dict[str, str], __) -> Tuple[str, str]:
+        return self._change_address(True, args)
+
+    def _address_delete(self, _, args: Dict[str, str], __) -> Tuple[str, str]:
+        return self._change_address(False, args)
+
+    def _show(self, options: List[str], args: Dict[str, str], addresses: bool) -> Tuple[str, str]:
+        links = self.links.items()
+        if 'dev' in args:
+            if len(args['dev']) >= IFNAMSIZ:
+                return '', f'Error: argument "{args["dev"]}" is wrong: "dev" not a valid ifname\n'
+            if args['dev'] not in self.links:
+                return '', f'Device "{args["dev"]}" does not exist.\n'
+            links = [(args['dev'], self.links[args['dev']])]
+        if 'type' in args:
+            links = [(name, link) for name, link in links if link.kind == args['type']]
+        details = '-details' in options or '-d' in options
+        if '-json' in options or '-j' in options:
+            return json.dumps([self._link_json(name, link, details, addresses) for name, link in links]) + '\n', ''
+        out = ''
+        for name, link in links:
+            out += f'{link.ifindex}: {name}: <BROADCAST,NOARP,UP,LOWER_UP> mtu {link.mtu} qdisc noqueue state ' \
+                   f'UNKNOWN\n    link/ether 00:00:00:00:00:00 brd ff:ff:ff:ff:ff:ff\n'
+            for local, prefixlen in link.addrs if addresses else []:
+                out += f'    inet {local}/{prefixlen} scope global {name}\n       valid_lft forever preferred_lft ' \
+                       f'forever\n'
+        return out, ''
+
+    def _link_show(self, options: List[str], args: Dict[str, str], __) -> Tuple[str, str]:
+        return self._show(options, args, False)
+
+    def _address_show(self, options: List[str], args: Dict[str, str], __) -> Tuple[str, str]:
+        return self._show(options, args, True)
+
+    @staticmethod
+    def _link_json(name: str, link: Link, details: bool, addresses: bool) -> Dict:
+        data = {'ifindex': link.ifindex, 'ifname': name, 'flags': ['BROADCAST', 'NOARP', 'UP', 'LOWER_UP'],
+                'mtu': link.mtu, 'operstate': 'UNKNOWN'}
+        if details and link.kind:
+            data['linkinfo'] = {'info_kind': link.kind}
+        if addresses:
+            data['addr_info'] = [{'family': 'inet', 'local': local, 'prefixlen': prefixlen, 'scope': 'global'}
+                                 for local, prefixlen in link.addrs]
+        return data
+
+    def _event(self, event: Dict) -> None:
+        line = json.dumps(event) + '\n'
+        for monitor in self._monitors:
+            monitor.put(line)
+
+    def monitor(self) -> Queue:
+        """Return a queue of `ip -json monitor link address` lines, None once the stream ends."""
+        monitor = Queue()
+        with self._lock:
+            self._monitors.append(monitor)
+        return monitor
+
+    def unmonitor(self, monitor: Queue) -> None:
+        with self._lock:
+            if monitor in self._monitors:
+                self._monitors.remove(monitor)
+        monitor.put(None)
+
+    def unread(self) -> int:
+        """Monitor lines not yet read by their clients."""
+        with self._lock:
+            return sum(monitor.qsize() for monitor in self._monitors)
+
+
+class Network:
+    """Virtual hosts by address, created with the same latencies on first connection to an address."""
+
+    def __init__(self, round_trip: float = 0.0, latency: Optional[Dict[str, float]] = None, connect: float = 0.0):
+        self.round_trip = round_trip
+        self.latency = latency
+        self.connect = connect
+        self.hosts: Dict[str, VirtualHost] = {}
+        self._lock = Lock()
+
+    def host(self, address: str) -> VirtualHost:
+        with self._lock:
+            if address not in self.hosts:
+                self.hosts[address] = VirtualHost(self.round_trip, self.latency, seed=len(self.hosts))
+            return self.hosts[address]
+
+    def counts(self) -> Counter:
+        """Round trips and commands of all hosts."""
+        total = Counter()
+        for host in list(self.hosts.values()):
+            total.update(host.counts)
+        return total
+
+    def unread(self) -> int:
+        """Monitor lines of all hosts not yet read by their clients."""
+        return sum(host.unread() for host in list(self.hosts.values()))
+
+
+class Output:
+    """stdout or stderr of a command run over SSH, the command runs when output is read first."""
+
+    def __init__(self, channel: 'Channel', index: int):
+        self._channel = channel
+        self._index = index
+
+    def _buffer(self) -> StringIO:
+        return StringIO(self._channel.result()[self._index])
+
+    def read(self) -> bytes:
+        return self._buffer().read().encode()
+
+    def readlines(self) -> List[str]:
+        return self._buffer().readlines()
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._buffer())
+
+
+class Channel:
+    """Channel of one command, its stdin is sent when it is closed."""
+
+    def __init__(self, host: VirtualHost, command: str):
+        self._host = host
+        self._command = command
+        self._stdin = StringIO()
+        self._result: Optional[Tuple[str, str]] = None
+
+    def write(self, data: str) -> None:
+        self._stdin.write(data)
+
+    def close(self) -> None:
+        pass
+
+    def flush(self) -> None:
+        pass
+
+    def result(self) -> Tuple[str, str]:
+        if self._result is None:
+            out, err, delay = self._host.run(self._command, self._stdin.getvalue())
+            sleep(delay)
+            self._result = out, err
+        return self._result
+
+
+class Monitor:
+    """stdout of `ip monitor`, its lines until the client is closed or the host disconnects."""
+
+    def __init__(self, host: VirtualHost):
+        self._host = host
+        self._queue = host.monitor()
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._queue.get, None)
+
+    def close(self) -> None:
+        self._host.unmonitor(self._queue)
+
+
+class Session:
+    """Channel of a long-lived `ip -force -batch -` process: lines written run when flushed, after one round trip,
+    and their failures are read from stderr."""
+    closed = False
+
+    def __init__(self, host: VirtualHost):
+        self._host = host
+        self._generation = host.generation
+        self._pending = ''
+        self._sent = 0
+        self._stderr: List[str] = []
+
+    def exec_command(self, command: str) -> None:
+        self._host.counts['round trip'] += 1
+
+    def exit_status_ready(self) -> bool:
+        return self._generation != self._host.generation
+
+    def makefile_stdin(self, _) -> 'Session':
+        return self
+
+    def makefile_stderr(self, _) -> 'Session':
+        return self
+
+    def write(self, data: str) -> None:
+        self._pending += data
+
+    def flush(self) -> None:
+        *lines, self._pending = self._pending.split('\n')
+        if self.exit_status_ready():
+            return
+        self._host.counts['round trip'] += 1
+        _, err, delay = self._host.run_lines(lines, True, self._sent + 1)
+        self._sent += len(lines)
+        sleep(self._host.round_trip + delay)
+        self._stderr.extend(StringIO(err).readlines())
+
+    def readline(self) -> str:
+        return self._stderr.pop(0) if self._stderr else ''
+
+    def close(self) -> None:
+        self.closed = True
+
+
+class Transport:
+    def __init__(self, host: VirtualHost):
+        self.host = host
+        self._generation = host.generation
+
+    def is_active(self) -> bool:
+        return self._generation == self.host.generation
+
+    def set_keepalive(self, interval: int) -> None:
+        pass
+
+    def open_session(self) -> Session:
+        if not self.is_active():
+            raise SSHException('SSH session not active')
+        return Session(self.host)
+
+
+class SSHClient:
+    """Stand-in for paramiko.SSHClient connected to a virtual host of a network."""
+    network = Network()
+
+    def __init__(self):
+        self._transport: Optional[Transport] = None
+        self._monitors: List[Monitor] = []
+
+    def load_system_host_keys(self) -> None:
+        pass
+
+    def set_missing_host_key_policy(self, policy) -> None:
+        pass
+
+    def connect(self, hostname: str, **kwargs) -> None:
+        sleep(self.network.connect)
+        self._transport = Transport(self.network.host(hostname))
+
+    def get_transport(self) -> Optional[Transport]:
+        return self._transport
+
+    def close(self) -> None:
+        for monitor in self._monitors:
+            monitor.close()
+        self._monitors = []
+        self._transport = None
+
+    def exec_command(self, command: str, **kwargs):
+        if self._transport is None or not self._transport.is_active():
+            raise SSHException('SSH session not active')
+        host = self._transport.host
+        if ' monitor' in command:
+            host.counts['round trip'] += 1
+            monitor = Monitor(host)
+            self._monitors.append(monitor)
+            return Channel(host, command), monitor, StringIO()
+        channel = Channel(host, command)
+        return channel, Output(channel, 0), Output(channel, 1)
+
+
+class AsyncsshError(Exception):
+    pass
+
+
+class ChannelOpenError(AsyncsshError):
+    pass
+
+
+class AsyncClient:
+    """Stand-in for asyncssh.SSHClientConnection, commands sleep on the event loop instead of blocking it."""
+
+    def __init__(self, host: VirtualHost):
+        self._host = host
+        self._generation = host.generation
+        self._closed = False
+
+    def is_closed(self) -> bool:
+        return self._closed or self._generation != self._host.generation
+
+    def close(self) -> None:
+        self._closed = True
+
+    async def run(self, command: str, input: Optional[str] = None) -> SimpleNamespace:
+        if self.is_closed():
+            raise ChannelOpenError('Connection closed')
+        out, err, delay = self._host.run(command, input or '')
+        await asyncio.sleep(delay)
+        return SimpleNamespace(stdout=out, stderr=err, exit_status=1 if err else 0)
+
+
+def install(network: Network) -> Network:
+    """Make connections of the service reach hosts of network, call it before the first connection is opened."""
+    import connection
+    import live
+
+    async def connect(host: str, **kwargs) -> AsyncClient:
+        await asyncio.sleep(network.connect)
+        return AsyncClient(network.host(host))
+
+    SSHClient.network = network
+    connection.SSHClient = live.SSHClient = SSHClient
+    connection.asyncssh = SimpleNamespace(connect=connect, Error=AsyncsshError, ChannelOpenError=ChannelOpenError)
+    return network
@@ -0,0 +1,104 @@
+"""Startup time of the service against inventory size, with a simulated VM, see fakevm.py.
+
+For every size the database is filled with that many interfaces with one address each and the service is started in
+a process of its own, against a VM that has none of them (cold) and against one that already has all of them (warm).
+Import of the app, create_app() and the time until /health/ready reports reconciliation at startup finished are
+measured, with the SSH round trips it took. Results are compared with the baseline of the backend, see baselines.py,
+and regressions make the exit status 1.
+
+Usage: python benchmarks/startup.py [--backend exec|shell|asyncssh] [--sizes 100,1000,10000] [--round-trip MS]
+                                    [--tolerance RATE] [--save]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from time import monotonic, perf_counter, sleep
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import baselines  # noqa: E402
+import fakevm  # noqa: E402
+
+
+def address(i: int) -> str:
+    return f'10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}'
+
+
+def start(size: int, warm: bool, round_trip: float) -> None:
+    """Fill the database, start the service and print what it took as JSON, run in a process of its own."""
+    from sqlalchemy import create_engine
+    from create_db import Interface, Address, migrate
+    from config import database_path, server_address
+
+    engine = create_engine(database_path)
+    migrate(engine)
+    with engine.begin() as connection:
+        connection.execute(Interface.__table__.insert(),
+                           [{'id': i, 'name': f'dummy_{i}', 'mtu': 1500} for i in range(1, size + 1)])
+        connection.execute(Address.__table__.insert(),
+                           [{'id': i, 'address': address(i), 'interface_id': i} for i in range(1, size + 1)])
+    engine.dispose()
+    network = fakevm.install(fakevm.Network(round_trip=round_trip))
+    if warm:
+        host = network.host(server_address)
+        for i in range(1, size + 1):
+            host.add_link(f'dummy_{i}', addrs=(address(i),))
+
+    begin = perf_counter()
+    import app
+    imported = perf_counter()
+    app.create_app('benchmark')
+    created = perf_counter()
+    client = app.app.test_client()
+    deadline = monotonic() + 600
+    while client.get('/health/ready').status_code != 200:
+        assert monotonic() < deadline, 'not ready after 600s'
+        sleep(0.005)
+    ready = perf_counter()
+    print(json.dumps({'import': (imported - begin) * 1e3, 'create_app': (created - imported) * 1e3,
+                      'ready': (ready - begin) * 1e3, 'round_trips': network.counts()['round trip']}))
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--backend', default='exec', choices=['exec', 'shell', 'asyncssh'])
+    parser.add_argument('--sizes', default='100,1000,10000', help='comma separated inventory sizes')
+    parser.add_argument('--round-trip', type=float, default=1, help='SSH round trip in milliseconds')
+    parser.add_argument('--tolerance', type=float, default=0.5, help='allowed slowdown against the baseline')
+    parser.add_argument('--save', action='store_true', help='store results as the new baseline')
+    parser.add_argument('--child', nargs=2, metavar=('SIZE', 'STATE'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        start(int(args.child[0]), args.child[1] == 'warm', args.round_trip / 1e3)
+        return 0
+
+    print(f'{args.backend} backend, {args.round_trip:g} ms round trip')
+    print(f'  {"inventory":16} {"import ms":>10} {"create ms":>10} {"ready ms":>10} {"trips":>6}')
+    results = {}
+    for size in map(int, args.sizes.split(',')):
+        for state in ('cold', 'warm'):
+            with tempfile.TemporaryDirectory() as directory:
+                env = dict(os.environ, NIMS_BACKEND=args.backend, NIMS_DATABASE_PATH=f'sqlite:///{directory}/i.db',
+                           NIMS_DRIFT_INTERVAL='0')
+                out = subprocess.run([sys.executable, '-W', 'ignore', __file__, '--child', str(size), state,
+                                      '--round-trip', str(args.round_trip)], env=env, check=True,
+                                     stdout=subprocess.PIPE, universal_newlines=True).stdout
+            result = json.loads(out.splitlines()[-1])
+            print(f'  {f"{size} {state}":16} {result["import"]:10.1f} {result["create_app"]:10.1f} '
+                  f'{result["ready"]:10.1f} {result["round_trips"]:6}')
+            results[f'{state} {size}'] = {key: round(value, 3) for key, value in result.items()}
+
+    suite = f'startup {args.backend}'
+    if args.save:
+        baselines.save(suite, results)
+        return 0
+    regressions = baselines.compare(suite, results, args.tolerance)
+    for regression in regressions:
+        print('  regression:', regression)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
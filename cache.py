@@ -0,0 +1,84 @@
+from threading import RLock
+from typing import Callable, Dict, List, Optional, Tuple
+from serialize import iter_list
+
+# compact JSON of a row and the key of the group it belongs to (interface id of an address)
+Row = Tuple[bytes, Optional[int]]
+
+
+class Collection:
+    """Read-through cache of the rendered rows of one table, by id.
+
+    load(ids) renders rows with given ids, or all rows if ids is None. Every invalidation bumps version, a load that
+    raced with an invalidation is returned to its caller but not stored. Rendered lists are kept until the next
+    invalidation.
+    """
+
+    def __init__(self, load: Callable[[Optional[List[int]]], Dict[int, Row]]):
+        self._load = load
+        self._lock = RLock()
+        self._rows: Dict[int, Optional[Row]] = {}
+        self._complete = False
+        self._lists: Dict[Optional[int], bytes] = {}
+        self.version = 0
+
+    def invalidate(self, id_: int, deleted: bool = False) -> None:
+        with self._lock:
+            if deleted:
+                self._rows.pop(id_, None)
+            else:
+                self._rows[id_] = None
+            self._lists.clear()
+            self.version += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._rows = {}
+            self._complete = False
+            self._lists.clear()
+            self.version += 1
+
+    def get(self, id_: int) -> Optional[Row]:
+        with self._lock:
+            if self._complete and id_ not in self._rows:
+                return None
+            row, version = self._rows.get(id_), self.version
+        if row is None:
+            row = self._load([id_]).get(id_)
+            with self._lock:
+                if row is not None and version == self.version:
+                    self._rows[id_] = row
+        return row
+
+    def _all(self) -> Tuple[Dict[int, Row], int]:
+        with self._lock:
+            rows = dict(self._rows) if self._complete else None
+            version = self.version
+        if rows is None:
+            rows = self._load(None)
+        else:
+            stale = [id_ for id_, row in rows.items() if row is None]
+            if stale:
+                loaded = self._load(stale)
+                for id_ in stale:
+                    if id_ in loaded:
+                        rows[id_] = loaded[id_]
+                    else:
+                        del rows[id_]
+        with self._lock:
+            if version == self.version:
+                self._rows = dict(rows)
+                self._complete = True
+        return rows, version
+
+    def render(self, group: Optional[int] = None) -> bytes:
+        """Return JSON list of all rows, or of rows of given group, ordered by id."""
+        with self._lock:
+            if group in self._lists:
+                return self._lists[group]
+        rows, version = self._all()
+        rendered = b''.join(iter_list(row[0] for _, row in sorted(rows.items()) if group is None or row[1] == group))
+        with self._lock:
+            if version == self.version:
+                self._lists[group] = rendered
+        return rendered
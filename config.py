@@ -1,5 +1,55 @@
-from os import environ
+from os import environ, getpid
+from time import time
+
+
+def server_start() -> str:
+    """Id of the start of this process: its process id and start time, so that a restart gets a new id."""
+    try:
+        with open('/proc/self/stat', 'rb') as f:
+            # field 22, the start time in clock ticks since boot, counted after the parenthesized command name
+            return f'{getpid()}-{int(f.read().rpartition(b")")[2].split()[19])}'
+    except (OSError, IndexError, ValueError):
+        return f'{getpid()}-{int(time())}'
+
 
 server_address = environ.get('NIMS_SERVER_ADDRESS', '192.168.122.178')
 server_username = environ.get('NIMS_SERVER_USERNAME', 'iluha')
 database_path = environ.get('NIMS_DATABASE_PATH', 'sqlite:///interfaces.db')
+startup_parallelism = int(environ.get('NIMS_STARTUP_PARALLELISM', 8))
+startup_chunk_size = int(environ.get('NIMS_STARTUP_CHUNK_SIZE', 256))
+host_parallelism = int(environ.get('NIMS_HOST_PARALLELISM', 8))
+pool_size = int(environ.get('NIMS_POOL_SIZE', 4))  # per host
+pool_channels = int(environ.get('NIMS_POOL_CHANNELS', 8))
+pool_timeout = float(environ.get('NIMS_POOL_TIMEOUT', 30))
+keepalive_interval = int(environ.get('NIMS_KEEPALIVE_INTERVAL', 30))
+reconnect_attempts = int(environ.get('NIMS_RECONNECT_ATTEMPTS', 5))
+reconnect_backoff = float(environ.get('NIMS_RECONNECT_BACKOFF', 0.5))
+# exec, shell or asyncssh over SSH, netlink to manage the host the service runs on
+backend = environ.get('NIMS_BACKEND', 'exec')
+list_page_size = int(environ.get('NIMS_LIST_PAGE_SIZE', 1000))
+import_chunk_size = int(environ.get('NIMS_IMPORT_CHUNK_SIZE', 256))
+job_workers = int(environ.get('NIMS_JOB_WORKERS', 4))
+job_history = int(environ.get('NIMS_JOB_HISTORY', 1000))
+drift_interval = float(environ.get('NIMS_DRIFT_INTERVAL', 300))
+drift_settle = float(environ.get('NIMS_DRIFT_SETTLE', 2))
+live_index = environ.get('NIMS_LIVE_INDEX', '1') == '1'
+sqlite_journal_mode = environ.get('NIMS_SQLITE_JOURNAL_MODE', 'wal')
+sqlite_synchronous = environ.get('NIMS_SQLITE_SYNCHRONOUS', 'normal')
+sqlite_busy_timeout = int(environ.get('NIMS_SQLITE_BUSY_TIMEOUT', 5000))
+sqlite_mmap_size = int(environ.get('NIMS_SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+db_pool_size = int(environ.get('NIMS_DB_POOL_SIZE', 8))
+db_pool_overflow = int(environ.get('NIMS_DB_POOL_OVERFLOW', 8))
+baked_queries = environ.get('NIMS_BAKED_QUERIES', '1') == '1'
+query_count_header = environ.get('NIMS_QUERY_COUNT_HEADER', '0') == '1'
+# processes of one deployment share it: by default the first process to read the configuration, e.g. the gunicorn
+# master by the on_starting hook of gunicorn.conf.py, exports the start of its own, which processes it starts inherit
+deployment_id = environ['NIMS_DEPLOYMENT_ID'] = environ.get('NIMS_DEPLOYMENT_ID') or server_start()
+# reconciliation at startup unfinished after this many seconds was interrupted and is run again
+deployment_timeout = float(environ.get('NIMS_DEPLOYMENT_TIMEOUT', 600))
+deployment_history = int(environ.get('NIMS_DEPLOYMENT_HISTORY', 20))
+metrics_enabled = environ.get('NIMS_METRICS', '1') == '1'
+# requests with an X-Profile header, equal to the token if one is set, are profiled and report it in their response
+profiling = environ.get('NIMS_PROFILING', '0') == '1'
+profile_token = environ.get('NIMS_PROFILE_TOKEN', '')
+profile_interval = float(environ.get('NIMS_PROFILE_INTERVAL', 0.001))
+profile_top = int(environ.get('NIMS_PROFILE_TOP', 20))
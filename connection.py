@@ -1,84 +1,802 @@
-from paramiko import SSHClient
-from typing import Optional, List, Tuple
+from paramiko import SSHClient, SSHException
+import asyncio
+import logging
+import os
+import socket
+from contextlib import contextmanager
+from threading import local, Lock, Condition, Thread
+from time import sleep
+from typing import Optional, List, Dict, Iterator, NamedTuple, Callable, Tuple, Awaitable, TypeVar, Set, TYPE_CHECKING
+try:
+    import asyncssh
+except ImportError:  # only the asyncssh backend needs it
+    asyncssh = None
 from create_db import Interface, Address
-from config import server_address, server_username
+from iproute2 import LinkState, parse_link, parse_links, parse_events
+from metrics import command_duration
+import netlink
+from netlink import RtnlSocket, RTMGRP_LINK, RTMGRP_IPV4_IFADDR, RTMGRP_IPV6_IFADDR, Message
+from config import server_address, server_username, backend, pool_size, pool_channels, pool_timeout, \
+    keepalive_interval, reconnect_attempts, reconnect_backoff
+
+if TYPE_CHECKING:
+    from live import LiveIndex
+
+logger = logging.getLogger(__name__)
 
 
 class Iproute2Error(Exception):
     pass
 
 
+class Batch:
+    """Commands collected for a single `ip -batch` run, each with the payload of the error it may raise and the
+    commands that revert it. The payload also gets the operation and the line number of its command."""
+
+    def __init__(self, force: bool = False):
+        self.force = force
+        self.lines: List[str] = []
+        self.payloads: List[Dict] = []
+        self.undo: List[List[str]] = []
+
+    def __len__(self) -> int:
+        return len(self.lines)
+
+    def add(self, line: str, payload: Dict, undo: List[str]) -> None:
+        self.lines.append(line)
+        self.payloads.append(payload)
+        self.undo.append(undo)
+        payload['op'] = operation(line)
+        payload['line'] = len(self.lines)
+
+    def command(self) -> str:
+        return 'sudo ip -force -batch -' if self.force else 'sudo ip -batch -'
+
+    def names(self) -> Set[str]:
+        """Names of interfaces the commands of the batch may change."""
+        return {name for line in self.lines for name in line_names(line)}
+
+    def errors(self, message: List[str]) -> List[Dict]:
+        """Split stderr of `ip -batch` into error payloads of failed commands.
+
+        iproute2 reports every failed line as its error message followed by `Command failed -:<line number>`.
+        Without -force execution stops at the first failure, with -force all failures are reported.
+        """
+        errors, lines = [], []
+        for line in message:
+            if line.startswith('Command failed -:'):
+                errors.append(dict(self.payloads[int(line.split(':')[1]) - 1], message=lines))
+                lines = []
+            else:
+                lines.append(line)
+        if lines:
+            errors.append({'command': self.command(), 'message': lines})
+        return errors
+
+
+def operation(line: str) -> str:
+    """Object and command of a line of `ip -batch` input, e.g. `link add`."""
+    return ' '.join(line.split()[:2])
+
+
+def command_kind(command: str) -> str:
+    """Kind of a command for metrics, e.g. `address show` for `ip -json address show dev eth0`, `batch` for a batch."""
+    words = command.split()
+    if '-batch' in words:
+        return 'batch'
+    return ' '.join([word for word in words if word not in ('sudo', 'ip') and not word.startswith('-')][:2])
+
+
+def line_names(line: str) -> Set[str]:
+    """Names of interfaces a line of `ip -batch` input refers to."""
+    words = line.split()
+    names = {words[i + 1] for i, word in enumerate(words[:-1]) if word in ('dev', 'name')}
+    if words[:2] == ['link', 'add'] and len(words) > 2:
+        names.add(words[2])
+    return names
+
+
+def raise_errors(errors: List[Dict]) -> None:
+    if errors:
+        if len(errors) > 1:
+            errors[0]['errors'] = errors
+        raise Iproute2Error(errors[0])
+
+
+class AddressPlan(NamedTuple):
+    """Addresses to add to and to delete from an interface to make its kernel state match the database."""
+    add: List[Address]
+    delete: List[str]
+
+    def __bool__(self) -> bool:
+        return bool(self.add or self.delete)
+
+    def __str__(self) -> str:
+        return f'add {[address.address for address in self.add]}, delete {self.delete}'
+
+
+def plan_addresses(interface: Interface, addrs: List[str]) -> AddressPlan:
+    actual = set(addrs)
+    desired = {address.address for address in interface.addresses}
+    return AddressPlan([address for address in interface.addresses if address.address not in actual],
+                       [addr for addr in addrs if addr not in desired])
+
+
 class Connection:
-    def __init__(self, ssh_: SSHClient):
+    live: Optional['LiveIndex'] = None  # answers reads without a round trip while it is ready
+
+    def __init__(self, ssh_: SSHClient, address: str = server_address, username: str = server_username):
         ssh_.load_system_host_keys()
-        ssh_.connect(server_address, username=server_username)
         self.ssh = ssh_
+        self.address = address
+        self.username = username
+        self._local = local()
+        self._lock = Lock()
+        self.connect()
 
-    def list_all_interface_names(self) -> List[str]:
-        command = 'ip link show'
-        _, out, err = self.ssh.exec_command(command)
-        message = err.readlines()
+    def connect(self) -> None:
+        self.ssh.close()
+        self.ssh.connect(self.address, username=self.username)
+        self.ssh.get_transport().set_keepalive(keepalive_interval)
+
+    def is_active(self) -> bool:
+        transport = self.ssh.get_transport()
+        return transport is not None and transport.is_active()
+
+    def ensure_active(self) -> None:
+        """Reconnect if the transport is dead, retrying with exponential backoff."""
+        with self._lock:
+            for attempt in range(reconnect_attempts + 1):
+                if self.is_active():
+                    return
+                if attempt:
+                    sleep(reconnect_backoff * 2 ** (attempt - 1))
+                try:
+                    self.connect()
+                except (SSHException, OSError) as e:
+                    if attempt == reconnect_attempts:
+                        raise e
+                    logger.warning(f'Reconnect to {self.address} failed: {e}')
+
+    def close(self) -> None:
+        self.ssh.close()
+
+    def _exec_command(self, command: str):
+        # a command that could not open a channel on a dead transport was never sent, so it is safe to retry
+        try:
+            return self.ssh.exec_command(command)
+        except SSHException as e:
+            if self.is_active():
+                raise e
+            self.ensure_active()
+            return self.ssh.exec_command(command)
+
+    @contextmanager
+    def batch(self, force: bool = False) -> Iterator[Batch]:
+        """Collect commands issued inside the block and send them as one `ip -batch` stream on exit.
+
+        Batches are per thread, a nested batch joins the outer one. Nothing is sent if the block raises.
+        """
+        batch = getattr(self._local, 'batch', None)
+        if batch is not None:
+            yield batch
+            return
+        batch = self._local.batch = Batch(force)
+        try:
+            yield batch
+        finally:
+            self._local.batch = None
+        self.send(batch)
+
+    def send(self, batch: Batch) -> None:
+        """Run a batch, e.g. one built by a Recorder."""
+        try:
+            self.run_batch(batch)
+        finally:
+            self._forget(batch.names())
+
+    def _forget(self, names: Set[str]) -> None:
+        if self.live is not None:
+            self.live.invalidate(names)
+
+    def run_batch(self, batch: Batch) -> None:
+        if not batch:
+            return
+        with command_duration.time('batch'):
+            stdin, _, err = self._exec_command(batch.command())
+            stdin.write(''.join(f'{line}\n' for line in batch.lines))
+            stdin.close()
+            message = err.readlines()
+        raise_errors(batch.errors(message))
+
+    def undo(self, batch: Batch, count: Optional[int] = None) -> None:
+        """Revert the first count (by default all) commands of a batch that was run without -force."""
+        undo = Batch(force=True)
+        for lines in reversed(batch.undo[:count]):
+            for line in lines:
+                undo.add(line, {'command': f'sudo ip {line}'}, [])
+        self.send(undo)
+
+    def _execute(self, line: str, payload: Dict, undo: List[str]) -> None:
+        """Run command now or add it to the current batch, undo assumes the interface still holds its old state."""
+        payload['command'] = f'sudo ip {line}'
+        payload['op'] = operation(line)
+        batch = getattr(self._local, 'batch', None)
+        if batch is not None:
+            batch.add(line, payload, undo)
+            return
+        try:
+            with command_duration.time(payload['op']):
+                message = self._exec_command(payload['command'])[2].readlines()
+        finally:
+            self._forget(line_names(line))
         if message:
-            raise Iproute2Error({'command': command, 'message': message})
-        return [line.split()[1][:-1] for line in out.readlines()[::2]]
+            raise Iproute2Error(dict(payload, message=message))
+
+    def _show(self, command: str, payload: Dict) -> List[LinkState]:
+        payload['command'] = command
+        with command_duration.time(command_kind(command)):
+            _, out, err = self._exec_command(command)
+            message = err.readlines()
+            output = out.read()
+        if message:
+            raise Iproute2Error(dict(payload, message=message))
+        return parse_links(output)
+
+    def list_all_interface_names(self) -> List[str]:
+        if self.live is not None and self.live.ready:
+            return list(self.dump_state())
+        return [link.name for link in self._show('ip -json link show', {})]
+
+    def monitor(self) -> Iterator[Dict]:
+        """Start `ip monitor` and return an iterator over its events, which ends when the channel is closed.
+
+        Events that happen after this call returns are not lost even if iteration starts later.
+        """
+        _, out, _ = self._exec_command('ip -details -json monitor link address')
+        return (event for line in out for event in parse_events(line))
 
     def ip_link_add(self, interface: Interface) -> None:
-        command = f'sudo ip link add {interface.name}'
+        line = f'link add {interface.name}'
         if interface.mtu:
-            command += f' mtu {interface.mtu}'
-        command += ' type dummy'
-        message = self.ssh.exec_command(command)[2].readlines()
-        if message:
-            raise Iproute2Error({'command': command, 'message': message, 'interface': interface})
+            line += f' mtu {interface.mtu}'
+        line += ' type dummy'
+        self._execute(line, {'interface': interface}, [f'link delete dev {interface.name} type dummy'])
 
     def ip_link_set(self, interface: Interface, name: Optional[str] = None, mtu: Optional[int] = None) -> None:
-        command = f'sudo ip link set dev {interface.name}'
+        if not name and not mtu:
+            return
+        line, undo = f'link set dev {interface.name}', f'link set dev {name or interface.name}'
         if name:
-            command += f' name {name}'
+            line += f' name {name}'
+            undo += f' name {interface.name}'
         if mtu:
-            command += f' mtu {mtu}'
-        message = self.ssh.exec_command(command)[2].readlines()
-        if message:
-            raise Iproute2Error(
-                {'command': command, 'message': message, 'interface': interface, 'name': name, 'mtu': mtu})
+            line += f' mtu {mtu}'
+            undo += f' mtu {interface.mtu}'
+        self._execute(line, {'interface': interface, 'name': name, 'mtu': mtu}, [undo])
 
     def ip_link_delete(self, interface: Interface) -> None:
-        command = f'sudo ip link delete dev {interface.name} type dummy'
-        message = self.ssh.exec_command(command)[2].readlines()
-        if message:
-            raise Iproute2Error({'command': command, 'message': message, 'interface': interface})
+        self._execute(f'link delete dev {interface.name} type dummy', {'interface': interface},
+                      [f'link add {interface.name} mtu {interface.mtu} type dummy'] +
+                      [f'address add dev {interface.name} local {address.address}' for address in interface.addresses])
 
     def ip_address_add(self, address: Address, interface: Interface) -> None:
-        command = f'sudo ip address add dev {interface.name} local {address.address}'
-        message = self.ssh.exec_command(command)[2].readlines()
-        if message:
-            raise Iproute2Error({'command': command, 'message': message, 'interface': interface, 'address': address})
+        self._execute(f'address add dev {interface.name} local {address.address}',
+                      {'interface': interface, 'address': address},
+                      [f'address delete dev {interface.name} local {address.address}/32'])
 
     def _ip_address_delete(self, addr: str, interface: Interface) -> None:
-        command = f'sudo ip address delete dev {interface.name} local {addr}/32'
-        message = self.ssh.exec_command(command)[2].readlines()
-        if message:
-            raise Iproute2Error({'command': command, 'message': message, 'interface': interface, 'address': addr})
+        self._execute(f'address delete dev {interface.name} local {addr}/32', {'interface': interface, 'address': addr},
+                      [f'address add dev {interface.name} local {addr}'])
 
     def ip_address_delete(self, address: Address, interface: Interface) -> None:
+        self._execute(f'address delete dev {interface.name} local {address.address}/32',
+                      {'interface': interface, 'address': address},
+                      [f'address add dev {interface.name} local {address.address}'])
+
+    def ip_address_show(self, interface: Interface) -> LinkState:
+        payload = {'interface': interface}
+        if self.live is not None and self.live.ready:
+            link = self.dump_state(interface.name).get(interface.name)
+            if link is None:
+                raise Iproute2Error(dict(payload, message=[f'Device "{interface.name}" does not exist.\n']))
+            if link.kind != 'dummy':
+                raise Iproute2Error(dict(payload, message=[f'Device "{interface.name}" is not a dummy interface.\n']))
+            return link
+        links = self._show(f'ip -json address show dev {interface.name} type dummy', payload)
+        if not links:
+            raise Iproute2Error(dict(payload, message=[f'Device "{interface.name}" is not a dummy interface.\n']))
+        return links[0]
+
+    def dump_state(self, name: Optional[str] = None, details: bool = False,
+                   fresh: bool = False) -> Dict[str, LinkState]:
+        """Return state of every interface on the VM, or only of interface with given name if it exists, by name.
+
+        It takes one round trip, or none if the live index is ready, has no stale interfaces and fresh state was not
+        asked for. With details the kind of interfaces read remotely is known.
+        """
+        live = self.live
+        if fresh or live is None or not live.ready:
+            return self._dump_state(name, details)
+        stale, seq = live.stale(name)
+        if len(stale) > 1:
+            state = self._dump_state(None, True)
+            for stale_name in stale:
+                live.update(stale_name, state.get(stale_name), seq)
+        elif stale:
+            live.update(stale[0], self._dump_state(stale[0], True).get(stale[0]), seq)
+        return live.state(name)
+
+    def _dump_state(self, name: Optional[str], details: bool) -> Dict[str, LinkState]:
+        command = 'ip -details -json address show' if details else 'ip -json address show'
+        if name is None:
+            return {link.name: link for link in self._show(command, {})}
         try:
-            self._ip_address_delete(address.address, interface)
+            return {link.name: link for link in self._show(f'{command} dev {name}', {})}
         except Iproute2Error as e:
-            e.args[0]['address'] = address
+            if e.args[0]['message'] == [f'Device "{name}" does not exist.\n']:
+                return {}
             raise e
 
-    def ip_address_show(self, interface: Interface) -> Tuple[int, List[str]]:
-        command = f'ip address show dev {interface.name} type dummy'
-        _, out, err = self.ssh.exec_command(command)
-        message = err.readlines()
+    def apply_address_plan(self, interface: Interface, plan: AddressPlan) -> None:
+        with self.batch():
+            for address in plan.add:
+                self.ip_address_add(address, interface)
+            for addr in plan.delete:
+                self._ip_address_delete(addr, interface)
+
+    def set_addresses(self, interface: Interface, addrs: Optional[List[str]] = None) -> AddressPlan:
+        """Add missing and delete stale addresses of interface, addrs are its current addresses if already known."""
+        if addrs is None:
+            addrs = self.ip_address_show(interface).addrs
+        plan = plan_addresses(interface, addrs)
+        self.apply_address_plan(interface, plan)
+        return plan
+
+
+class ShellConnection(Connection):
+    """Connection that sends all changes to one long-lived `ip -force -batch -` process instead of a channel per batch.
+
+    After every chunk of commands a sentinel command that always fails is sent, its `Command failed` report marks
+    that everything before it was executed, and failures reported in between are attributed by line number.
+    Batches without -force are sent one command at a time so that execution stops at the first failure.
+    Reads still use a channel per command.
+    """
+    sentinel = 'link show dev nims_sync_sentinel'  # longer than IFNAMSIZ, so no interface can ever have this name
+
+    def __init__(self, ssh_: SSHClient, address: str = server_address, username: str = server_username):
+        self._channel = None
+        self._session_lock = Lock()
+        super().__init__(ssh_, address, username)
+
+    def connect(self) -> None:
+        self._channel = None
+        super().connect()
+
+    def _start(self) -> None:
+        if self._channel is not None and not self._channel.closed and not self._channel.exit_status_ready():
+            return
+        self._channel = self.ssh.get_transport().open_session()
+        self._channel.exec_command('sudo ip -force -batch -')
+        self._stdin = self._channel.makefile_stdin('wb')
+        self._stderr = self._channel.makefile_stderr('r')
+        self._sent = 0
+
+    def _send(self, lines: List[str], payloads: List[Dict]) -> List[Dict]:
+        start = self._sent
+        self._stdin.write(''.join(f'{line}\n' for line in lines + [self.sentinel]))
+        self._stdin.flush()
+        self._sent += len(lines) + 1
+        errors, message = [], []
+        while True:
+            line = self._stderr.readline()
+            if not line:
+                self._channel.close()
+                raise Iproute2Error({'command': 'sudo ip -force -batch -', 'message': message + ['Session closed.\n']})
+            if line.startswith('Command failed -:'):
+                number = int(line.split(':')[1])
+                if number == self._sent:
+                    return errors
+                errors.append(dict(payloads[number - start - 1], message=message))
+                message = []
+            else:
+                message.append(line)
+
+    def _execute(self, line: str, payload: Dict, undo: List[str]) -> None:
+        with self.batch():
+            super()._execute(line, payload, undo)
+
+    def run_batch(self, batch: Batch) -> None:
+        if not batch:
+            return
+        with self._session_lock, command_duration.time('batch'):
+            self._start()
+            if batch.force:
+                errors = self._send(batch.lines, batch.payloads)
+            else:
+                for line, payload in zip(batch.lines, batch.payloads):
+                    errors = self._send([line], [payload])
+                    if errors:
+                        break
+        raise_errors(errors)
+
+
+class Recorder(Connection):
+    """Connection that only records commands into a batch, so that batches for AsyncConnection are built by the same
+    command methods. It cannot read remote state, set_addresses needs current addresses."""
+
+    def __init__(self, batch: Batch):
+        self._batch = batch
+
+    @contextmanager
+    def batch(self, force: bool = False) -> Iterator[Batch]:
+        yield self._batch
+
+    def _execute(self, line: str, payload: Dict, undo: List[str]) -> None:
+        payload['command'] = f'sudo ip {line}'
+        self._batch.add(line, payload, undo)
+
+
+class AsyncConnection:
+    """Connection for asyncio code, over asyncssh.
+
+    Every command runs on a channel of its own without blocking the event loop, at most `channels` of them at a time,
+    so one transport can carry many concurrent batches. Changes are built with Recorder and sent by execute().
+    """
+
+    def __init__(self, channels: int = pool_channels, address: str = server_address,
+                 username: str = server_username):
+        if asyncssh is None:
+            raise ImportError('asyncssh is required by AsyncConnection.')
+        self.ssh = None
+        self.address = address
+        self.username = username
+        self._channels = asyncio.Semaphore(channels)
+        self._lock = asyncio.Lock()
+
+    async def connect(self) -> None:
+        if self.ssh is not None:
+            self.ssh.close()
+        self.ssh = await asyncssh.connect(self.address, username=self.username,
+                                          keepalive_interval=keepalive_interval)
+
+    def is_active(self) -> bool:
+        return self.ssh is not None and not self.ssh.is_closed()
+
+    async def ensure_active(self) -> None:
+        """Reconnect if the connection is closed, retrying with exponential backoff."""
+        async with self._lock:
+            for attempt in range(reconnect_attempts + 1):
+                if self.is_active():
+                    return
+                if attempt:
+                    await asyncio.sleep(reconnect_backoff * 2 ** (attempt - 1))
+                try:
+                    await self.connect()
+                except (asyncssh.Error, OSError) as e:
+                    if attempt == reconnect_attempts:
+                        raise e
+                    logger.warning(f'Reconnect to {self.address} failed: {e}')
+
+    async def _run(self, command: str, input_: Optional[str] = None) -> Tuple[str, List[str]]:
+        """Run command, return its stdout and lines of its stderr."""
+        await self.ensure_active()
+        async with self._channels:
+            with command_duration.time(command_kind(command)):
+                # a command that could not open a channel on a closed connection was never sent, it is safe to retry
+                try:
+                    result = await self.ssh.run(command, input=input_)
+                except asyncssh.ChannelOpenError as e:
+                    if self.is_active():
+                        raise e
+                    await self.ensure_active()
+                    result = await self.ssh.run(command, input=input_)
+        return result.stdout or '', (result.stderr or '').splitlines(keepends=True)
+
+    async def run_batch(self, batch: Batch) -> None:
+        if not batch:
+            return
+        _, message = await self._run(batch.command(), ''.join(f'{line}\n' for line in batch.lines))
+        raise_errors(batch.errors(message))
+
+    async def execute(self, commands: Callable[[Connection], None], force: bool = False) -> Batch:
+        """Run commands issued by commands(recorder) as one batch."""
+        batch = Batch(force)
+        commands(Recorder(batch))
+        await self.run_batch(batch)
+        return batch
+
+    async def undo(self, batch: Batch, count: Optional[int] = None) -> None:
+        """Revert the first count (by default all) commands of a batch that was run without -force."""
+        undo = Batch(force=True)
+        for lines in reversed(batch.undo[:count]):
+            for line in lines:
+                undo.add(line, {'command': f'sudo ip {line}'}, [])
+        await self.run_batch(undo)
+
+    async def _show(self, command: str, payload: Dict) -> List[LinkState]:
+        payload['command'] = command
+        out, message = await self._run(command)
         if message:
-            raise Iproute2Error({'command': command, 'message': message, 'interface': interface})
-        mtu = int(out.readline().split()[4])
-        addrs = [x.split()[1].split('/')[0] for x in out.readlines()[1:-1:2]]
-        return mtu, addrs
-
-    def set_addresses(self, interface: Interface) -> None:  # TODO: this should be done better?
-        for addr in self.ip_address_show(interface)[1]:
-            self._ip_address_delete(addr, interface)
-        for address in interface.addresses:
-            self.ip_address_add(address, interface)
+            raise Iproute2Error(dict(payload, message=message))
+        return parse_links(out)
+
+    async def list_all_interface_names(self) -> List[str]:
+        return [link.name for link in await self._show('ip -json link show', {})]
+
+    async def ip_address_show(self, interface: Interface) -> LinkState:
+        payload = {'interface': interface}
+        links = await self._show(f'ip -json address show dev {interface.name} type dummy', payload)
+        if not links:
+            raise Iproute2Error(dict(payload, message=[f'Device "{interface.name}" is not a dummy interface.\n']))
+        return links[0]
+
+    async def dump_state(self, name: Optional[str] = None) -> Dict[str, LinkState]:
+        """Return state of every interface on the VM, or only of interface with given name if it exists, by name."""
+        if name is None:
+            return {link.name: link for link in await self._show('ip -json address show', {})}
+        try:
+            return {link.name: link for link in await self._show(f'ip -json address show dev {name}', {})}
+        except Iproute2Error as e:
+            if e.args[0]['message'] == [f'Device "{name}" does not exist.\n']:
+                return {}
+            raise e
+
+    def close(self) -> None:
+        if self.ssh is not None:
+            self.ssh.close()
+
+
+T = TypeVar('T')
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = Lock()
+
+
+def event_loop() -> asyncio.AbstractEventLoop:
+    """Return the event loop shared by all AsyncsshConnections, running in a daemon thread."""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            Thread(target=_loop.run_forever, name='asyncssh', daemon=True).start()
+    return _loop
+
+
+class AsyncsshConnection(Connection):
+    """Connection for synchronous code that runs an AsyncConnection on the shared event loop.
+
+    Threads only wait for their commands, all channels of all connections are multiplexed by one event loop thread.
+    """
+
+    def __init__(self, ssh_: SSHClient, address: str = server_address, username: str = server_username):
+        self.aio: AsyncConnection = self.call(self._create(address, username))
+        super().__init__(ssh_, address, username)
+
+    @staticmethod
+    async def _create(address: str, username: str) -> AsyncConnection:
+        return AsyncConnection(address=address, username=username)
+
+    @staticmethod
+    def call(coroutine: Awaitable[T]) -> T:
+        """Run coroutine on the shared event loop and wait for its result."""
+        return asyncio.run_coroutine_threadsafe(coroutine, event_loop()).result()
+
+    def connect(self) -> None:
+        self.call(self.aio.connect())
+
+    def is_active(self) -> bool:
+        return self.aio.is_active()
+
+    def ensure_active(self) -> None:
+        self.call(self.aio.ensure_active())
+
+    def close(self) -> None:
+        super().close()
+        event_loop().call_soon_threadsafe(self.aio.close)
+
+    def run_batch(self, batch: Batch) -> None:
+        self.call(self.aio.run_batch(batch))
+
+    def _execute(self, line: str, payload: Dict, undo: List[str]) -> None:
+        with self.batch():
+            super()._execute(line, payload, undo)
+
+    def _show(self, command: str, payload: Dict) -> List[LinkState]:
+        return self.call(self.aio._show(command, payload))
+
+
+class NetlinkConnection(Connection):
+    """Connection that manages the host it runs on by RTNETLINK requests on a local socket, without SSH and without
+    spawning `ip`.
+
+    Commands are built by the same methods and translated from their `ip -batch` lines. With -force the requests of a
+    batch are sent together, only a request that needs the index of an interface created or renamed by requests not
+    sent yet waits for their replies. Without -force they are sent one at a time until the first failure. Errors are
+    reported with the messages `ip` prints, so that they are handled the same way.
+    """
+
+    def __init__(self, ssh_: SSHClient, address: str = server_address, username: str = server_username):
+        self.ssh = ssh_  # never connected
+        self.address = address
+        self.username = username
+        self.rtnl: Optional[RtnlSocket] = None
+        self._monitor: Optional[RtnlSocket] = None
+        self._local = local()
+        self._lock = Lock()
+        self.connect()
+
+    def connect(self) -> None:
+        if self.rtnl is not None:
+            self.rtnl.close()
+        self.rtnl = RtnlSocket()
+
+    def is_active(self) -> bool:
+        return self.rtnl is not None and not self.rtnl.closed
+
+    def close(self) -> None:
+        self.rtnl.close()
+        if self._monitor is not None:
+            self._monitor.close()
+
+    def _execute(self, line: str, payload: Dict, undo: List[str]) -> None:
+        with self.batch():
+            super()._execute(line, payload, undo)
+
+    @staticmethod
+    def _index(name: str) -> int:
+        try:
+            return socket.if_nametoindex(name)
+        except OSError:
+            raise Iproute2Error({'message': [f'Cannot find device "{name}"\n']})
+
+    def _message(self, line: str) -> Message:
+        """Translate a line of `ip -batch` input built by the command methods into a request."""
+        words = line.split()
+        op = operation(line)
+        options = dict(zip(words[3::2], words[4::2]) if op == 'link add' else zip(words[2::2], words[3::2]))
+        mtu = options.get('mtu')
+        if mtu is not None and not mtu.isdigit():
+            raise Iproute2Error({'message': [f'Error: argument "{mtu}" is wrong: "mtu" value is invalid\n']})
+        mtu = mtu and int(mtu)
+        if op == 'link add':
+            return netlink.link_add(words[2], mtu, options.get('type'))
+        if op == 'link delete':
+            return netlink.link_delete(options['dev'])
+        if op == 'link set':
+            return netlink.link_set(self._index(options['dev']), options.get('name'), mtu)
+        local_, _, prefixlen = options['local'].partition('/')
+        return netlink.address(op == 'address add', self._index(options['dev']), local_, int(prefixlen or 32))
+
+    def _send(self, pending: List[Tuple[Message, Dict]]) -> List[Dict]:
+        if not pending:
+            return []
+        try:
+            results = self.rtnl.execute([message for message, _ in pending])
+        except OSError as e:
+            self.rtnl.close()
+            raise e
+        return [dict(payload, message=[f'RTNETLINK answers: {os.strerror(number)}\n'])
+                for (_, payload), number in zip(pending, results) if number]
+
+    def run_batch(self, batch: Batch) -> None:
+        if not batch:
+            return
+        with command_duration.time('batch'):
+            errors, pending, changed = [], [], set()
+            for line, payload in zip(batch.lines, batch.payloads):
+                names = line_names(line)
+                if names & changed:
+                    errors += self._send(pending)
+                    pending, changed = [], set()
+                try:
+                    pending.append((self._message(line), payload))
+                except Iproute2Error as e:
+                    errors.append(dict(payload, message=e.args[0]['message']))
+                if line.startswith('link '):
+                    changed |= names
+                if not batch.force:
+                    errors += self._send(pending)
+                    pending = []
+                    if errors:
+                        break
+            errors += self._send(pending)
+        raise_errors(sorted(errors, key=lambda error: error['line']))
+
+    def _links(self, name: Optional[str] = None) -> List[LinkState]:
+        try:
+            with command_duration.time('address show'):
+                return [parse_link(link) for link in self.rtnl.links(name)]
+        except OSError as e:
+            raise Iproute2Error({'command': f'ip -json address show dev {name}' if name else 'ip -json address show',
+                                 'message': [f'RTNETLINK answers: {e.strerror}\n']})
+
+    def list_all_interface_names(self) -> List[str]:
+        if self.live is not None and self.live.ready:
+            return list(self.dump_state())
+        return [link.name for link in self._links()]
+
+    def monitor(self) -> Iterator[Dict]:
+        """Subscribe to link and address notifications and return an iterator over them as `ip monitor` events."""
+        self._monitor = RtnlSocket(RTMGRP_LINK | RTMGRP_IPV4_IFADDR | RTMGRP_IPV6_IFADDR)
+        return self._monitor.events()
+
+    def ip_address_show(self, interface: Interface) -> LinkState:
+        if self.live is not None and self.live.ready:
+            return super().ip_address_show(interface)
+        payload = {'interface': interface}
+        links = self._links(interface.name)
+        if not links:
+            raise Iproute2Error(dict(payload, message=[f'Device "{interface.name}" does not exist.\n']))
+        if links[0].kind != 'dummy':
+            raise Iproute2Error(dict(payload, message=[f'Device "{interface.name}" is not a dummy interface.\n']))
+        return links[0]
+
+    def _dump_state(self, name: Optional[str], details: bool) -> Dict[str, LinkState]:
+        # the kind of interfaces is always known
+        return {link.name: link for link in self._links(name)}
+
+
+backends = {'exec': Connection, 'shell': ShellConnection, 'asyncssh': AsyncsshConnection, 'netlink': NetlinkConnection}
+
+
+class ConnectionPool:
+    """Persistent SSH connections to one host shared by concurrent requests.
+
+    Every checkout is served by the least loaded connection, at most `channels` checkouts use one transport at a time,
+    each on channels of its own. Connections are opened on first checkout, the first one serves all checkouts until
+    it is busy, so an idle process holds one connection at most. Dead transports are reconnected on checkout.
+    """
+
+    def __init__(self, size: int = pool_size, channels: int = pool_channels, timeout: float = pool_timeout,
+                 live: Optional['LiveIndex'] = None, address: str = server_address, username: str = server_username):
+        self.channels = channels
+        self.timeout = timeout
+        self.address = address
+        self.username = username
+        self.connections: List[Optional[Connection]] = [None] * size
+        self._live = live
+        self._load = [0] * size
+        self._condition = Condition()
+        self._open_lock = Lock()
+
+    def checkout(self) -> Connection:
+        with self._condition:
+            if not self._condition.wait_for(lambda: min(self._load) < self.channels, self.timeout):
+                raise TimeoutError(f'No SSH connection to {self.address} available.')
+            i = self._load.index(min(self._load))
+            self._load[i] += 1
+        try:
+            conn = self.connections[i] or self._open(i)
+            conn.ensure_active()
+        except Exception as e:
+            self._release(i)
+            raise e
+        return conn
+
+    def _open(self, i: int) -> Connection:
+        with self._open_lock:
+            if self.connections[i] is None:
+                conn = backends[backend](SSHClient(), self.address, self.username)
+                conn.live = self._live
+                self.connections[i] = conn
+            return self.connections[i]
+
+    def checkin(self, conn: Connection) -> None:
+        self._release(self.connections.index(conn))
+
+    def _release(self, i: int) -> None:
+        with self._condition:
+            self._load[i] -= 1
+            self._condition.notify()
+
+    @contextmanager
+    def connection(self) -> Iterator[Connection]:
+        conn = self.checkout()
+        try:
+            yield conn
+        finally:
+            self.checkin(conn)
+
+    def close(self) -> None:
+        for conn in filter(None, self.connections):
+            conn.close()
@@ -1,17 +1,42 @@
-from sqlalchemy import Column, Integer, String, create_engine, ForeignKey
+from typing import Callable, Dict, List, Optional, Union
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, Index, create_engine, event, ForeignKey
+from sqlalchemy.engine import Engine
+from sqlalchemy.engine.url import make_url
 from sqlalchemy.orm import relationship, backref
 from sqlalchemy.ext.declarative import declarative_base
-from config import database_path
+from sqlalchemy.pool import NullPool, QueuePool
+from config import database_path, sqlite_journal_mode, sqlite_synchronous, sqlite_busy_timeout, sqlite_mmap_size, \
+    db_pool_size, db_pool_overflow
 
 Base = declarative_base()
 
+# the host configured by NIMS_SERVER_ADDRESS, interfaces created before hosts were introduced belong to it
+DEFAULT_HOST = 1
+
+
+class Host(Base):
+    """Machine whose interfaces are managed, address and username are those of the configuration if null."""
+    __tablename__ = 'hosts'
+    __table_args__ = (Index('ix_hosts_name', 'name', unique=True), {'sqlite_autoincrement': True})
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String, nullable=False)
+    address = Column(String)
+    username = Column(String)
+
+    def __repr__(self):
+        return f"<Host(#{self.id}, {self.name}, {self.address})>"
+
 
 class Interface(Base):
     __tablename__ = 'interfaces'
+    # names are unique per host
+    __table_args__ = (Index('ix_interfaces_host_id_name', 'host_id', 'name', unique=True),)
 
     id = Column(Integer, primary_key=True)
     name = Column(String, nullable=False)
     mtu = Column(Integer, nullable=False)
+    host_id = Column(Integer, ForeignKey("hosts.id"), nullable=False, default=DEFAULT_HOST)
 
     def __repr__(self):
         return f"<Interface(#{self.id}, {self.name}, {self.mtu})>"
@@ -19,17 +44,163 @@ class Interface(Base):
 
 class Address(Base):
     __tablename__ = 'addresses'
+    # also serves lookups by interface_id alone
+    __table_args__ = (Index('ix_addresses_interface_id_address', 'interface_id', 'address', unique=True),)
 
     id = Column(Integer, primary_key=True)
     address = Column(String, nullable=False)
     interface_id = Column(Integer, ForeignKey("interfaces.id"))
 
-    interface = relationship(Interface, backref=backref("addresses", cascade="delete-orphan, delete"))
+    interface = relationship(Interface, backref=backref("addresses", cascade="delete-orphan, delete", order_by=id))
 
     def __repr__(self):
         return f"<Address(#{self.id}, {self.address}, dev #{self.interface_id})>"
 
 
+class Change(Base):
+    """Latest change of a row of interfaces or addresses table, seq grows with every change."""
+    __tablename__ = 'changes'
+    __table_args__ = (Index('ix_changes_row', 'table_name', 'row_id'), {'sqlite_autoincrement': True})
+
+    seq = Column(Integer, primary_key=True)
+    table_name = Column(String, nullable=False)
+    row_id = Column(Integer, nullable=False)
+    deleted = Column(Boolean, nullable=False, default=False)
+
+    def __repr__(self):
+        return f"<Change(#{self.seq}, {self.table_name} #{self.row_id}{', deleted' if self.deleted else ''})>"
+
+
+class Deployment(Base):
+    """Reconciliation at startup of a deployment, run by the first of its processes that claims it."""
+    __tablename__ = 'deployments'
+
+    id = Column(String, primary_key=True)
+    started = Column(DateTime, nullable=False)
+    finished = Column(DateTime)
+    error = Column(String)
+
+    def __repr__(self):
+        return f"<Deployment({self.id}, {self.finished or self.error or 'running'})>"
+
+
+def add_column(table: str, column: str, definition: str) -> Callable:
+    """Migration step that adds a column unless the table already has it, ALTER TABLE has no IF NOT EXISTS."""
+    def step(connection) -> None:
+        if column not in {row[1] for row in connection.execute(f'PRAGMA table_info({table})')}:
+            connection.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+    return step
+
+
+# statements of every schema version, in order, never edit a released one, append a new one instead
+MIGRATIONS: List[List[Union[str, Callable]]] = [
+    # 1: tables as created by create_all before migrations, kept if they exist
+    [
+        """CREATE TABLE IF NOT EXISTS interfaces (
+            id INTEGER NOT NULL,
+            name VARCHAR NOT NULL,
+            mtu INTEGER NOT NULL,
+            PRIMARY KEY (id)
+        )""",
+        """CREATE TABLE IF NOT EXISTS addresses (
+            id INTEGER NOT NULL,
+            address VARCHAR NOT NULL,
+            interface_id INTEGER,
+            PRIMARY KEY (id),
+            FOREIGN KEY(interface_id) REFERENCES interfaces (id)
+        )""",
+        """CREATE TABLE IF NOT EXISTS changes (
+            seq INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,
+            table_name VARCHAR NOT NULL,
+            row_id INTEGER NOT NULL,
+            deleted BOOLEAN NOT NULL,
+            CHECK (deleted IN (0, 1))
+        )""",
+        'CREATE INDEX IF NOT EXISTS ix_changes_row ON changes (table_name, row_id)',
+    ],
+    # 2: unique interface names and addresses per interface, duplicate addresses mean the same and are dropped
+    [
+        'DELETE FROM addresses WHERE id NOT IN (SELECT min(id) FROM addresses GROUP BY interface_id, address)',
+        'CREATE UNIQUE INDEX IF NOT EXISTS ix_interfaces_name ON interfaces (name)',
+        'CREATE UNIQUE INDEX IF NOT EXISTS ix_addresses_interface_id_address ON addresses (interface_id, address)',
+    ],
+    # 3: reconciliations at startup, one per deployment
+    [
+        """CREATE TABLE IF NOT EXISTS deployments (
+            id VARCHAR NOT NULL,
+            started DATETIME NOT NULL,
+            finished DATETIME,
+            error VARCHAR,
+            PRIMARY KEY (id)
+        )""",
+    ],
+    # 4: managed hosts, the configured server is host 1 and owns existing interfaces, names are unique per host
+    [
+        """CREATE TABLE IF NOT EXISTS hosts (
+            id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,
+            name VARCHAR NOT NULL,
+            address VARCHAR,
+            username VARCHAR
+        )""",
+        'CREATE UNIQUE INDEX IF NOT EXISTS ix_hosts_name ON hosts (name)',
+        "INSERT OR IGNORE INTO hosts (id, name) VALUES (1, 'default')",
+        add_column('interfaces', 'host_id', 'INTEGER NOT NULL DEFAULT 1 REFERENCES hosts (id)'),
+        'DROP INDEX IF EXISTS ix_interfaces_name',
+        'CREATE UNIQUE INDEX IF NOT EXISTS ix_interfaces_host_id_name ON interfaces (host_id, name)',
+    ],
+]
+
+
+def migrate(engine: Engine, target: Optional[int] = None) -> int:
+    """Apply migrations the database has not seen yet, up to target version (the latest by default), return its
+    version.
+
+    The version is kept in `PRAGMA user_version`. Statements, and steps that are callables of the connection, are
+    idempotent, so a migration interrupted before its version was stored is safe to run again.
+    """
+    target = len(MIGRATIONS) if target is None else target
+    with engine.begin() as connection:
+        version = connection.execute('PRAGMA user_version').scalar()
+        for number in range(version + 1, target + 1):
+            for statement in MIGRATIONS[number - 1]:
+                if callable(statement):
+                    statement(connection)
+                else:
+                    connection.execute(statement)
+            connection.execute(f'PRAGMA user_version = {number}')
+    return max(version, target)
+
+
+def engine_options(url: str = database_path, pool_size: int = db_pool_size, overflow: int = db_pool_overflow) -> Dict:
+    """Options of create_engine for a file database: a pool of pool_size connections shared by threads, no pool if
+    pool_size is 0. An in-memory database gets none: every pooled connection would open an empty database of its
+    own, Flask-SQLAlchemy shares a single connection for it instead."""
+    if make_url(url).database in (None, '', ':memory:'):
+        return {}
+    if pool_size <= 0:
+        return {'poolclass': NullPool}
+    return {'poolclass': QueuePool, 'pool_size': pool_size, 'max_overflow': overflow,
+            'connect_args': {'check_same_thread': False}}
+
+
+def tune(engine: Engine, journal_mode: str = sqlite_journal_mode, synchronous: str = sqlite_synchronous,
+         busy_timeout: int = sqlite_busy_timeout, mmap_size: int = sqlite_mmap_size) -> None:
+    """Set SQLite pragmas on every new connection of engine, before it is used.
+
+    In WAL mode readers do not block the writer and a commit appends to the log instead of syncing a rollback
+    journal, with synchronous=NORMAL the log is synced at checkpoints only. busy_timeout is in milliseconds.
+    """
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, _):
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f'PRAGMA busy_timeout = {busy_timeout}')
+        cursor.execute(f'PRAGMA journal_mode = {journal_mode}')
+        cursor.execute(f'PRAGMA synchronous = {synchronous}')
+        cursor.execute(f'PRAGMA mmap_size = {mmap_size}')
+        cursor.close()
+
+
 if __name__ == '__main__':
-    engine = create_engine(database_path)
-    Base.metadata.create_all(engine)
+    main_engine = create_engine(database_path, **engine_options())
+    tune(main_engine)
+    print(f'Schema version {migrate(main_engine)}')
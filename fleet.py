@@ -0,0 +1,124 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple, TypeVar
+from create_db import Interface
+from iproute2 import LinkState
+from connection import Connection, ConnectionPool
+from live import LiveIndex
+from reconcile import Reconciler
+from config import server_address, server_username, host_parallelism, live_index
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+
+class Member(NamedTuple):
+    """Connections to one managed host and background work that keeps it in sync."""
+    pool: ConnectionPool
+    live: Optional[LiveIndex]
+    reconciler: Reconciler
+
+
+class Fleet:
+    """Members of all managed hosts, by host id, created on first use of their host.
+
+    target(host_id) returns address and username of a host, None for those of the configuration, and raises for an
+    unknown host. load(host_id, names) returns interfaces of a host as Reconciler expects them. Live indexes and
+    reconcilers run once start() is called, members created before are started then.
+    """
+
+    def __init__(self, target: Callable[[int], Tuple[Optional[str], Optional[str]]],
+                 load: Callable[[int, Optional[Set[str]]], List[Interface]], parallelism: int = host_parallelism,
+                 live: bool = live_index):
+        self._target = target
+        self._load = load
+        self._parallelism = parallelism
+        self._live = live
+        self._members: Dict[int, Member] = {}
+        self._lock = Lock()
+        self._started = False
+
+    def get(self, host_id: int) -> Member:
+        member = self._members.get(host_id)
+        if member is not None:
+            return member
+        address, username = self._target(host_id)
+        with self._lock:
+            if host_id not in self._members:
+                address, username = address or server_address, username or server_username
+                live = LiveIndex(address, username) if self._live else None
+                pool = ConnectionPool(live=live, address=address, username=username)
+                member = Member(pool, live, Reconciler(pool, lambda names: self._load(host_id, names)))
+                if live is not None:
+                    live.subscribe(member.reconciler.notify)
+                if self._started:
+                    self._start(member)
+                self._members[host_id] = member
+            return self._members[host_id]
+
+    def pool(self, host_id: int) -> ConnectionPool:
+        return self.get(host_id).pool
+
+    def peek(self, host_id: int, name: str) -> Optional[LinkState]:
+        """Return state of interface of a host as far as its live index knows, see LiveIndex.peek()."""
+        live = self.get(host_id).live
+        return live.peek(name) if live is not None else None
+
+    def members(self) -> Dict[int, Member]:
+        with self._lock:
+            return dict(self._members)
+
+    @staticmethod
+    def _start(member: Member) -> None:
+        member.reconciler.start()
+        if member.live is not None:
+            member.live.start()
+
+    def start(self) -> None:
+        with self._lock:
+            self._started = True
+            for member in self._members.values():
+                self._start(member)
+
+    def remove(self, host_id: int) -> None:
+        """Stop background work of a host and close its connections."""
+        with self._lock:
+            member = self._members.pop(host_id, None)
+        if member is not None:
+            member.reconciler.stop()
+            if member.live is not None:
+                member.live.stop()
+            member.pool.close()
+
+    def fan_out(self, host_ids: Iterable[int],
+                work: Callable[[Connection, int], T]) -> Tuple[Dict[int, T], Dict[int, Exception]]:
+        """Run work(connection, host_id) for every host, with a connection from its pool, and return results and
+        exceptions by host.
+
+        At most parallelism hosts are worked on at a time, each host is also limited by its own pool. A host that
+        fails does not stop the others. A single host is worked on in the calling thread.
+        """
+        host_ids = list(dict.fromkeys(host_ids))
+
+        def run(host_id: int) -> T:
+            with self.pool(host_id).connection() as connection:
+                return work(connection, host_id)
+
+        results, errors = {}, {}
+        if len(host_ids) == 1:
+            try:
+                results[host_ids[0]] = run(host_ids[0])
+            except Exception as e:
+                errors[host_ids[0]] = e
+            return results, errors
+        with ThreadPoolExecutor(max(1, min(self._parallelism, len(host_ids)))) as executor:
+            futures = {host_id: executor.submit(run, host_id) for host_id in host_ids}
+        for host_id, future in futures.items():
+            try:
+                results[host_id] = future.result()
+            except Exception as e:
+                logger.warning(f'Host {host_id} failed: {e}')
+                errors[host_id] = e
+        return results, errors
@@ -0,0 +1,7 @@
+"""gunicorn settings, read from the working directory, e.g. by `gunicorn 'app:create_app()'`."""
+
+
+def on_starting(_):
+    """Read the configuration in the master, so that its workers inherit the deployment id of this start of the
+    server whatever their process titles, also without --preload."""
+    import config  # noqa: F401
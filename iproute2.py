@@ -0,0 +1,81 @@
+import errno
+import json
+import os
+from typing import List, Dict, Optional, Union
+
+
+class AddressState:
+    __slots__ = ('family', 'local', 'prefixlen')
+
+    def __init__(self, family: str, local: str, prefixlen: int):
+        self.family = family
+        self.local = local
+        self.prefixlen = prefixlen
+
+    def __repr__(self):
+        return f"<AddressState({self.local}/{self.prefixlen})>"
+
+
+class LinkState:
+    __slots__ = ('ifindex', 'name', 'mtu', 'addresses', 'kind')
+
+    def __init__(self, ifindex: int, name: str, mtu: int, addresses: List[AddressState], kind: Optional[str] = None):
+        self.ifindex = ifindex
+        self.name = name
+        self.mtu = mtu
+        self.addresses = addresses
+        self.kind = kind  # only known if the output was requested with -details
+
+    @property
+    def addrs(self) -> List[str]:
+        """IPv4 addresses of the link, as stored in the database."""
+        return [address.local for address in self.addresses if address.family == 'inet']
+
+    def __repr__(self):
+        return f"<LinkState(#{self.ifindex}, {self.name}, {self.mtu}, {self.addrs})>"
+
+
+def parse_address(addr: Dict) -> AddressState:
+    return AddressState(addr['family'], addr['local'], addr['prefixlen'])
+
+
+def parse_link(link: Dict) -> LinkState:
+    return LinkState(link['ifindex'], link['ifname'], link['mtu'],
+                     [parse_address(addr) for addr in link.get('addr_info', []) if 'local' in addr],
+                     (link.get('linkinfo') or {}).get('info_kind'))
+
+
+def parse_links(out: Union[str, bytes]) -> List[LinkState]:
+    """Parse output of `ip -json link show` or `ip -json address show`."""
+    return [parse_link(link) for link in json.loads(out or '[]')]
+
+
+def parse_events(line: Union[str, bytes]) -> List[Dict]:
+    """Parse a line of `ip -json monitor link address` output into event objects, skipping anything else."""
+    try:
+        events = json.loads(line)
+    except ValueError:
+        return []
+    events = events if isinstance(events, list) else [events]
+    return [event for event in events if isinstance(event, dict)]
+
+
+# errno names by their strerror text, as printed after `RTNETLINK answers: `
+ERRNO_NAMES = {os.strerror(number): name for number, name in errno.errorcode.items()}
+
+
+def error_code(message: List[str]) -> str:
+    """Return errno name of the error reported by ip on stderr, e.g. EEXIST, 'EUNKNOWN' if it is not recognized.
+
+    Netlink errors are reported as `RTNETLINK answers: <strerror>`, a missing device as `Cannot find device "x"` or
+    `Device "x" does not exist.`, invalid arguments as `Error: ...`.
+    """
+    for line in message:
+        line = line.strip()
+        if line.startswith('RTNETLINK answers: '):
+            return ERRNO_NAMES.get(line[len('RTNETLINK answers: '):], 'EUNKNOWN')
+        if line.startswith('Cannot find device') or line.startswith('Device ') and line.endswith('does not exist.'):
+            return 'ENODEV'
+        if line.startswith('Error: '):
+            return 'EINVAL'
+    return 'EUNKNOWN'
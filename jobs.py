@@ -0,0 +1,87 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from threading import Lock
+from typing import Callable, Dict, Optional
+from uuid import uuid4
+from config import job_workers, job_history
+
+
+class Job:
+    """Reconciliation of one interface requested by an asynchronous request.
+
+    live_name is the name of the interface in the kernel of its host when the job starts, None if it was not created
+    yet.
+    """
+
+    def __init__(self, interface_id: int, live_name: Optional[str], host_id: int):
+        self.id = uuid4().hex
+        self.interface_id = interface_id
+        self.live_name = live_name
+        self.host_id = host_id
+        self.status = 'queued'
+        self.error: Optional[str] = None
+        self.created = datetime.utcnow()
+        self.finished: Optional[datetime] = None
+
+    def __repr__(self):
+        return f"<Job({self.id}, interface #{self.interface_id}, {self.status})>"
+
+
+class JobQueue:
+    """Background executor of jobs, kept in memory of the process that accepted them.
+
+    Jobs of one interface run one at a time, in order. A job submitted while another job of the same interface is
+    still queued is coalesced into it: the queued job reconciles the latest desired state anyway. run(job) returns
+    the name the interface has in the kernel afterwards: a job submitted while another one of the interface runs, e.g.
+    a rename that may yet fail, starts from that name rather than from the live_name it was submitted with.
+    """
+
+    def __init__(self, run: Callable[[Job], Optional[str]], workers: int = job_workers, history: int = job_history):
+        self._run = run
+        self._history = history
+        self._executor = ThreadPoolExecutor(workers)
+        self._lock = Lock()
+        self._jobs: Dict[str, Job] = OrderedDict()
+        self._queued: Dict[int, Job] = {}
+        self._interface_locks: Dict[int, Lock] = {}
+        self._live_names: Dict[int, Optional[str]] = {}  # of interfaces with jobs queued or running
+
+    def submit(self, interface_id: int, live_name: Optional[str], host_id: int) -> Job:
+        with self._lock:
+            if interface_id in self._queued:
+                return self._queued[interface_id]
+            job = Job(interface_id, live_name, host_id)
+            self._live_names.setdefault(interface_id, live_name)
+            self._queued[interface_id] = self._jobs[job.id] = job
+            self._interface_locks.setdefault(interface_id, Lock())
+            self._trim()
+        self._executor.submit(self._execute, job)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    def _trim(self) -> None:
+        excess = len(self._jobs) - self._history
+        if excess > 0:
+            for job_id in [job_id for job_id, job in self._jobs.items() if job.finished][:excess]:
+                del self._jobs[job_id]
+
+    def _execute(self, job: Job) -> None:
+        with self._interface_locks[job.interface_id]:
+            with self._lock:
+                del self._queued[job.interface_id]
+                job.status = 'running'
+                job.live_name = live_name = self._live_names[job.interface_id]
+            try:
+                live_name = self._run(job)
+                job.status = 'done'
+            except Exception as e:
+                job.status, job.error = 'failed', str(e)
+            job.finished = datetime.utcnow()
+            with self._lock:
+                if job.interface_id in self._queued:
+                    self._live_names[job.interface_id] = live_name
+                else:
+                    del self._live_names[job.interface_id]
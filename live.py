@@ -0,0 +1,162 @@
+import logging
+from threading import Condition, Thread
+from time import monotonic, sleep
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+from paramiko import SSHClient
+from iproute2 import LinkState, parse_address
+from connection import Connection, NetlinkConnection
+from config import backend, reconnect_backoff, server_address, server_username
+
+logger = logging.getLogger(__name__)
+
+
+class LiveIndex:
+    """Kernel state of a host kept in memory by a long-lived `ip -json monitor link address` stream.
+
+    The stream is opened before the full dump that seeds the index, so no change is lost in between, and on stream
+    loss the index is not ready until it is seeded again. Interfaces touched by our own commands are marked stale,
+    as their events may still be on the way, and connections read them remotely once to refresh them. Listeners are
+    called with the name of every changed interface, or with None after a resync, when any interface may have
+    changed.
+    """
+
+    def __init__(self, address: str = server_address, username: str = server_username):
+        self.address = address
+        self.username = username
+        self._conn: Optional[Connection] = None
+        self._stopped = False
+        self._condition = Condition()
+        self._by_name: Dict[str, LinkState] = {}
+        self._by_index: Dict[int, LinkState] = {}
+        self._stale: Set[str] = set()
+        self._seq = 0
+        self._touched: Dict[str, int] = {}  # sequence number of the last event or invalidation by name
+        self._listeners: List[Callable[[Optional[str]], None]] = []
+        self.ready = False
+
+    def subscribe(self, listener: Callable[[Optional[str]], None]) -> None:
+        self._listeners.append(listener)
+
+    def _notify(self, name: Optional[str]) -> None:
+        for listener in self._listeners:
+            listener(name)
+
+    def load(self, links: Iterable[LinkState]) -> None:
+        with self._condition:
+            self._by_name = {link.name: link for link in links}
+            self._by_index = {link.ifindex: link for link in self._by_name.values()}
+            self._touched = {}
+            self.ready = True
+        self._notify(None)
+
+    def lost(self) -> None:
+        with self._condition:
+            self.ready = False
+
+    def _touch(self, names: Iterable[str]) -> None:
+        self._seq += 1
+        for name in names:
+            self._touched[name] = self._seq
+
+    def invalidate(self, names: Iterable[str]) -> None:
+        with self._condition:
+            self._stale.update(names)
+            self._touch(names)
+
+    def stale(self, name: Optional[str] = None) -> Tuple[List[str], int]:
+        """Return stale names, or given name if it is stale, and the sequence number to pass to update() once they
+        are read."""
+        with self._condition:
+            if name is None:
+                return list(self._stale), self._seq
+            return [name] if name in self._stale else [], self._seq
+
+    def update(self, name: str, link: Optional[LinkState], seq: int) -> None:
+        """Store state of interface with given name read remotely, None if it does not exist. The read started at
+        sequence number seq, it is dropped if an event or invalidation of the interface came since, as it may be
+        older, and the interface stays stale."""
+        with self._condition:
+            if self._touched.get(name, 0) > seq:
+                return
+            self._stale.discard(name)
+            self._remove(self._by_name.get(name))
+            if link is not None:
+                self._remove(self._by_index.get(link.ifindex))
+                self._by_name[name] = self._by_index[link.ifindex] = link
+
+    def _remove(self, link: Optional[LinkState]) -> None:
+        if link is not None:
+            self._by_name.pop(link.name, None)
+            self._by_index.pop(link.ifindex, None)
+
+    def peek(self, name: str) -> Optional[LinkState]:
+        """Return state of interface with given name if the index is ready and it is not stale, None otherwise."""
+        with self._condition:
+            return self._by_name.get(name) if self.ready and name not in self._stale else None
+
+    def state(self, name: Optional[str] = None) -> Dict[str, LinkState]:
+        """Return state of every interface, or of interface with given name if it exists, by name."""
+        with self._condition:
+            if name is None:
+                return dict(self._by_name)
+            return {name: self._by_name[name]} if name in self._by_name else {}
+
+    def apply(self, event: Dict) -> None:
+        """Apply a monitor event and notify listeners about interfaces it changed."""
+        with self._condition:
+            if 'local' in event:
+                link = self._by_index.get(event.get('index', event.get('ifindex')))
+                if link is None:
+                    return
+                address = parse_address(event)
+                link.addresses = [addr for addr in link.addresses
+                                  if (addr.local, addr.prefixlen) != (address.local, address.prefixlen)]
+                if not event.get('deleted'):
+                    link.addresses.append(address)
+                names = [link.name]
+            elif 'ifname' in event and 'ifindex' in event:
+                old, name = self._by_index.get(event['ifindex']), event['ifname']
+                self._remove(old)
+                if not event.get('deleted'):
+                    addresses = [parse_address(addr) for addr in event.get('addr_info', []) if 'local' in addr]
+                    link = LinkState(event['ifindex'], name, event.get('mtu', old.mtu if old else 0),
+                                     addresses if 'addr_info' in event or old is None else old.addresses,
+                                     (event.get('linkinfo') or {}).get('info_kind', old.kind if old else None))
+                    self._by_name[name] = self._by_index[link.ifindex] = link
+                names = [name] if old is None or old.name == name else [old.name, name]
+            else:
+                return
+            self._touch(names)
+        for name in names:
+            self._notify(name)
+
+    def start(self) -> None:
+        Thread(target=self._watch, name=f'live-index-{self.address}', daemon=True).start()
+
+    def stop(self) -> None:
+        """Stop watching, closing the stream."""
+        self._stopped = True
+        if self._conn is not None:
+            self._conn.close()
+
+    def _watch(self) -> None:
+        failures = 0
+        while not self._stopped:
+            start = monotonic()
+            try:
+                # the stream takes a connection of its own, over SSH unless the host manages itself
+                conn = self._conn = (NetlinkConnection if backend == 'netlink' else Connection)(
+                    SSHClient(), self.address, self.username)
+                events = conn.monitor()
+                self.load(conn.dump_state(details=True).values())
+                logger.info(f'Live index seeded with {len(self._by_name)} interfaces')
+                for event in events:
+                    self.apply(event)
+            except Exception as e:
+                if self._stopped:
+                    return
+                logger.warning(f'ip monitor of {self.address} failed: {e}')
+            self.lost()
+            # back off if the stream keeps failing at once
+            failures = failures + 1 if monotonic() - start < 1 else 0
+            sleep(min(reconnect_backoff * 2 ** failures, 60))
@@ -0,0 +1,138 @@
+import sys
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager
+from threading import Event, Lock, Thread
+from time import perf_counter
+from typing import Dict, Iterable, Iterator, List, Tuple, TypeVar
+from config import metrics_enabled
+
+T = TypeVar('T')
+
+# upper bounds in seconds, from single SQLite statements to slow batches over SSH
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+STDLIB = getattr(sys, 'stdlib_module_names', frozenset())
+
+
+def escape(value: str) -> str:
+    return value.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+class Histogram:
+    """Durations in seconds by label values, rendered in the Prometheus text format.
+
+    Label values are passed in the order of labels, e.g. observe(0.002, 'GET', '/interfaces', '200'). Nothing is
+    recorded if metrics are disabled.
+    """
+
+    def __init__(self, name: str, help_: str, labels: Tuple[str, ...], buckets: Tuple[float, ...] = BUCKETS):
+        self.name = name
+        self.help = help_
+        self.labels = labels
+        self.buckets = buckets
+        self._series: Dict[Tuple[str, ...], List[float]] = {}  # count per bucket and above the last one, then sum
+        self._lock = Lock()
+        registry.append(self)
+
+    def observe(self, seconds: float, *values: str) -> None:
+        if not metrics_enabled:
+            return
+        with self._lock:
+            series = self._series.get(values)
+            if series is None:
+                series = self._series[values] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[bisect_left(self.buckets, seconds)] += 1
+            series[-1] += seconds
+
+    @contextmanager
+    def time(self, *values: str) -> Iterator[None]:
+        """Observe how long the block takes, also if it raises."""
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(perf_counter() - start, *values)
+
+    def time_items(self, items: Iterable[T], *values: str) -> Iterator[T]:
+        """Yield items and observe the time spent producing all of them once they are exhausted, e.g. rows rendered
+        while a response is streamed, without the time the consumer spends in between."""
+        iterator, spent = iter(items), 0.0
+        try:
+            while True:
+                start = perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    spent += perf_counter() - start
+                yield item
+        finally:
+            self.observe(spent, *values)
+
+    def render(self) -> Iterator[str]:
+        yield f'# HELP {self.name} {self.help}\n# TYPE {self.name} histogram\n'
+        with self._lock:
+            series = {values: list(counts) for values, counts in self._series.items()}
+        for values, counts in sorted(series.items()):
+            labels = ''.join(f'{label}="{escape(value)}",' for label, value in zip(self.labels, values))
+            total = 0
+            for bound, count in zip([repr(float(bound)) for bound in self.buckets] + ['+Inf'], counts):
+                total += count
+                yield f'{self.name}_bucket{{{labels}le="{bound}"}} {total}\n'
+            labels = '{' + labels.rstrip(',') + '}' if labels else ''
+            yield f'{self.name}_count{labels} {total}\n{self.name}_sum{labels} {counts[-1]!r}\n'
+
+
+registry: List[Histogram] = []
+
+request_duration = Histogram('nims_http_request_duration_seconds', 'Time to handle requests, without streaming '
+                             'their body, by route.', ('method', 'route', 'status'))
+command_duration = Histogram('nims_iproute2_command_duration_seconds', 'Time to run iproute2 commands on hosts, '
+                             'including the round trip, by command, whole batches as batch.', ('command',))
+statement_duration = Histogram('nims_sql_statement_duration_seconds', 'Time to execute SQL statements, by their '
+                               'first keyword.', ('statement',))
+serialization_duration = Histogram('nims_serialization_duration_seconds', 'Time to render rows and responses as '
+                                   'JSON, by route, background for the cache filled outside requests.', ('route',))
+
+
+def render() -> str:
+    return ''.join(line for histogram in registry for line in histogram.render())
+
+
+class Profile:
+    """Sampling profiler of one thread, e.g. the one handling a request.
+
+    Every interval seconds the innermost frame of the thread outside the standard library is counted by module and
+    function, e.g. `sqlalchemy.engine.default:do_execute`, so waiting for a lock or a socket is charged to the code
+    that waits.
+    """
+
+    def __init__(self, thread_id: int, interval: float):
+        self.interval = interval
+        self.samples = 0
+        self.counts: Counter = Counter()
+        self._stopped = Event()
+        self._thread = Thread(target=self._sample, args=(thread_id,), name='profile', daemon=True)
+        self._thread.start()
+
+    def _sample(self, thread_id: int) -> None:
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(thread_id)
+            if frame is None or self._stopped.is_set():
+                return
+            innermost = frame
+            while frame is not None and frame.f_globals.get('__name__', '').partition('.')[0] in STDLIB:
+                frame = frame.f_back
+            frame = frame or innermost
+            self.samples += 1
+            self.counts[f'{frame.f_globals.get("__name__")}:{frame.f_code.co_name}'] += 1
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._thread.join()
+
+    def summary(self, top: int) -> str:
+        """Samples of the top functions, e.g. `12 samples every 1 ms; paramiko.channel:recv=8, app:get_interfaces=4`."""
+        functions = ', '.join(f'{function}={count}' for function, count in self.counts.most_common(top))
+        return f'{self.samples} samples every {self.interval * 1e3:g} ms; {functions}'
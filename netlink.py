@@ -0,0 +1,239 @@
+import errno
+import os
+import socket
+import struct
+from itertools import count
+from threading import Lock
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# message types and flags of linux/netlink.h and linux/rtnetlink.h
+NLMSG_ERROR, NLMSG_DONE = 2, 3
+RTM_NEWLINK, RTM_DELLINK, RTM_GETLINK = 16, 17, 18
+RTM_NEWADDR, RTM_DELADDR, RTM_GETADDR = 20, 21, 22
+NLM_F_REQUEST, NLM_F_ACK, NLM_F_DUMP_INTR, NLM_F_DUMP = 0x1, 0x4, 0x10, 0x300
+NLM_F_EXCL, NLM_F_CREATE = 0x200, 0x400
+IFLA_IFNAME, IFLA_MTU, IFLA_LINKINFO, IFLA_INFO_KIND = 3, 4, 18, 1
+IFA_ADDRESS, IFA_LOCAL = 1, 2
+RTMGRP_LINK, RTMGRP_IPV4_IFADDR, RTMGRP_IPV6_IFADDR = 0x1, 0x10, 0x100
+SOL_NETLINK, NETLINK_CAP_ACK, NETLINK_GET_STRICT_CHK = 270, 10, 12
+
+NLMSGHDR = struct.Struct('=IHHII')
+IFINFOMSG = struct.Struct('=BxHiII')
+IFADDRMSG = struct.Struct('=BBBBI')
+NLMSGERR = struct.Struct('=i')
+FAMILIES = {socket.AF_INET: 'inet', socket.AF_INET6: 'inet6'}
+
+# type, flags and payload of a request, NLM_F_REQUEST and NLM_F_ACK are added when it is sent
+Message = Tuple[int, int, bytes]
+
+
+def attribute(type_: int, data: bytes) -> bytes:
+    length = 4 + len(data)
+    return struct.pack('=HH', length, type_) + data + b'\0' * (-length % 4)
+
+
+def attributes(data: bytes, offset: int = 0) -> Dict[int, bytes]:
+    attrs = {}
+    while offset + 4 <= len(data):
+        length, type_ = struct.unpack_from('=HH', data, offset)
+        if length < 4:
+            break
+        attrs[type_ & 0x3fff] = data[offset + 4:offset + length]  # without NLA_F_NESTED and NLA_F_NET_BYTEORDER
+        offset += (length + 3) & ~3
+    return attrs
+
+
+def string(data: bytes) -> str:
+    return data.split(b'\0', 1)[0].decode()
+
+
+def link_add(name: str, mtu: Optional[int], kind: Optional[str]) -> Message:
+    """`ip link add <name> [mtu <mtu>] [type <kind>]`"""
+    attrs = attribute(IFLA_IFNAME, name.encode() + b'\0')
+    if mtu:
+        attrs += attribute(IFLA_MTU, struct.pack('=I', mtu))
+    if kind:
+        attrs += attribute(IFLA_LINKINFO, attribute(IFLA_INFO_KIND, kind.encode()))
+    return RTM_NEWLINK, NLM_F_CREATE | NLM_F_EXCL, IFINFOMSG.pack(socket.AF_UNSPEC, 0, 0, 0, 0) + attrs
+
+
+def link_set(index: int, name: Optional[str], mtu: Optional[int]) -> Message:
+    """`ip link set dev <index> [name <name>] [mtu <mtu>]`"""
+    attrs = b''
+    if name:
+        attrs += attribute(IFLA_IFNAME, name.encode() + b'\0')
+    if mtu:
+        attrs += attribute(IFLA_MTU, struct.pack('=I', mtu))
+    return RTM_NEWLINK, 0, IFINFOMSG.pack(socket.AF_UNSPEC, 0, index, 0, 0) + attrs
+
+
+def link_delete(name: str) -> Message:
+    """`ip link delete dev <name>`, the kernel looks the interface up by name."""
+    return RTM_DELLINK, 0, IFINFOMSG.pack(socket.AF_UNSPEC, 0, 0, 0, 0) + attribute(IFLA_IFNAME, name.encode() + b'\0')
+
+
+def address(add: bool, index: int, local: str, prefixlen: int) -> Message:
+    """`ip address add|delete dev <index> local <local>/<prefixlen>`"""
+    family = socket.AF_INET6 if ':' in local else socket.AF_INET
+    packed = socket.inet_pton(family, local)
+    body = IFADDRMSG.pack(family, prefixlen, 0, 0, index) + attribute(IFA_LOCAL, packed) + \
+        attribute(IFA_ADDRESS, packed)
+    return (RTM_NEWADDR, NLM_F_CREATE | NLM_F_EXCL, body) if add else (RTM_DELADDR, 0, body)
+
+
+def parse_link(body: bytes) -> Dict:
+    """Parse RTM_NEWLINK or RTM_DELLINK into the object `ip -details -json link show` prints for it."""
+    _, _, index, _, _ = IFINFOMSG.unpack_from(body)
+    attrs = attributes(body, IFINFOMSG.size)
+    link = {'ifindex': index, 'ifname': string(attrs.get(IFLA_IFNAME, b'')),
+            'mtu': struct.unpack('=I', attrs[IFLA_MTU])[0] if IFLA_MTU in attrs else 0}
+    kind = attributes(attrs.get(IFLA_LINKINFO, b'')).get(IFLA_INFO_KIND)
+    if kind:
+        link['linkinfo'] = {'info_kind': string(kind)}
+    return link
+
+
+def parse_address(body: bytes) -> Optional[Dict]:
+    """Parse RTM_NEWADDR or RTM_DELADDR into the object `ip -json monitor address` prints for it, None if it is
+    neither IPv4 nor IPv6."""
+    family, prefixlen, _, _, index = IFADDRMSG.unpack_from(body)
+    attrs = attributes(body, IFADDRMSG.size)
+    local = attrs.get(IFA_LOCAL, attrs.get(IFA_ADDRESS))
+    if family not in FAMILIES or local is None:
+        return None
+    return {'index': index, 'family': FAMILIES[family], 'local': socket.inet_ntop(family, local),
+            'prefixlen': prefixlen}
+
+
+class RtnlSocket:
+    """NETLINK_ROUTE socket, the kernel interface `ip` itself talks to, usable from many threads.
+
+    Requests are sent without spawning a process and many of them fit in one datagram. A socket created with
+    multicast groups receives notifications of those groups, see events().
+    """
+
+    def __init__(self, groups: int = 0):
+        self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE)
+        for option in (NETLINK_CAP_ACK, NETLINK_GET_STRICT_CHK):
+            try:
+                self.sock.setsockopt(SOL_NETLINK, option, 1)
+            except OSError:  # older kernels, acks echo whole requests and dumps are filtered here
+                pass
+        self.sock.bind((0, groups))
+        self._seq = count(1)
+        self._lock = Lock()
+
+    def close(self) -> None:
+        self.sock.close()
+
+    @property
+    def closed(self) -> bool:
+        return self.sock.fileno() == -1
+
+    def _receive(self) -> Iterator[Tuple[int, int, int, bytes]]:
+        """Yield type, flags, sequence number and payload of every message of the next datagram."""
+        data = self.sock.recv(1 << 16)
+        offset = 0
+        while offset + NLMSGHDR.size <= len(data):
+            length, type_, flags, seq, _ = NLMSGHDR.unpack_from(data, offset)
+            if length < NLMSGHDR.size:
+                break
+            yield type_, flags, seq, data[offset + NLMSGHDR.size:offset + length]
+            offset += (length + 3) & ~3
+
+    def execute(self, messages: List[Message], chunk_size: int = 128) -> List[int]:
+        """Send requests, chunk_size of them per datagram, and return the errno of each, 0 if it succeeded.
+
+        The kernel handles every request of a datagram even if some of them fail.
+        """
+        results = []
+        with self._lock:
+            for start in range(0, len(messages), chunk_size):
+                seqs = {}
+                data = b''
+                for type_, flags, body in messages[start:start + chunk_size]:
+                    seq = next(self._seq)
+                    seqs[seq] = len(seqs)
+                    data += NLMSGHDR.pack(NLMSGHDR.size + len(body), type_, NLM_F_REQUEST | NLM_F_ACK | flags, seq, 0)
+                    data += body
+                self.sock.send(data)
+                errors: List[Optional[int]] = [None] * len(seqs)
+                while None in errors:
+                    for type_, _, seq, body in self._receive():
+                        if type_ == NLMSG_ERROR and seq in seqs:
+                            errors[seqs[seq]] = -NLMSGERR.unpack_from(body)[0]
+                results += errors
+        return results
+
+    def _request(self, type_: int, flags: int, body: bytes) -> List[Tuple[int, bytes]]:
+        """Send one request and return type and payload of every message of the reply until it is done.
+
+        A dump that was interrupted by changes is repeated, a failed request raises OSError.
+        """
+        with self._lock:
+            while True:
+                seq = next(self._seq)
+                self.sock.send(NLMSGHDR.pack(NLMSGHDR.size + len(body), type_, NLM_F_REQUEST | flags, seq, 0) + body)
+                messages, interrupted, done = [], False, False
+                while not done:
+                    for reply_type, reply_flags, reply_seq, reply in self._receive():
+                        if reply_seq != seq:
+                            continue
+                        if reply_type == NLMSG_ERROR:
+                            number = -NLMSGERR.unpack_from(reply)[0]
+                            if number:
+                                raise OSError(number, os.strerror(number))
+                            done = True
+                        elif reply_type == NLMSG_DONE:
+                            done = True
+                        else:
+                            messages.append((reply_type, reply))
+                            done = not flags & NLM_F_DUMP
+                        interrupted |= bool(reply_flags & NLM_F_DUMP_INTR)
+                if not interrupted:
+                    return messages
+
+    def links(self, name: Optional[str] = None) -> List[Dict]:
+        """Return every interface, or the interface with given name if it exists, as `ip -details -json address
+        show` does."""
+        if name is None:
+            links = [parse_link(body) for _, body in self._request(RTM_GETLINK, NLM_F_DUMP,
+                                                                  IFINFOMSG.pack(socket.AF_UNSPEC, 0, 0, 0, 0))]
+            index = 0
+        else:
+            try:
+                links = [parse_link(body) for _, body in self._request(
+                    RTM_GETLINK, 0, IFINFOMSG.pack(socket.AF_UNSPEC, 0, 0, 0, 0) +
+                    attribute(IFLA_IFNAME, name.encode() + b'\0'))]
+            except OSError as e:
+                if e.errno == errno.ENODEV:
+                    return []
+                raise e
+            index = links[0]['ifindex']
+        by_index = {link['ifindex']: link for link in links}
+        for link in links:
+            link['addr_info'] = []
+        # with strict checking the kernel only dumps addresses of the interface, older kernels dump all of them
+        for _, body in self._request(RTM_GETADDR, NLM_F_DUMP, IFADDRMSG.pack(socket.AF_UNSPEC, 0, 0, 0, index)):
+            addr = parse_address(body)
+            if addr is not None and addr['index'] in by_index:
+                by_index[addr.pop('index')]['addr_info'].append(addr)
+        return links
+
+    def events(self) -> Iterator[Dict]:
+        """Yield notifications as the objects `ip -json monitor link address` prints, until the socket is closed.
+
+        A socket that could not keep up with notifications raises OSError with ENOBUFS, some of them are lost.
+        """
+        while not self.closed:
+            for type_, _, _, body in self._receive():
+                if type_ in (RTM_NEWLINK, RTM_DELLINK):
+                    event = parse_link(body)
+                elif type_ in (RTM_NEWADDR, RTM_DELADDR):
+                    event = parse_address(body)
+                else:
+                    continue
+                if event is not None:
+                    if type_ in (RTM_DELLINK, RTM_DELADDR):
+                        event['deleted'] = True
+                    yield event
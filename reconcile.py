@@ -0,0 +1,240 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from threading import Condition, Thread
+from time import monotonic, perf_counter
+from typing import Callable, Dict, List, NamedTuple, Optional, Set, Tuple
+from create_db import Interface
+from iproute2 import LinkState
+from connection import Connection, AsyncConnection, ConnectionPool, Iproute2Error, AddressPlan, plan_addresses
+from config import startup_parallelism, startup_chunk_size, drift_interval, drift_settle
+
+logger = logging.getLogger(__name__)
+
+
+class InterfacePlan(NamedTuple):
+    """Changes that make kernel state of an interface match the database: create it or set its mtu, fix addresses."""
+    interface: Interface
+    create: bool
+    mtu: Optional[int]
+    addresses: AddressPlan
+
+    def __bool__(self) -> bool:
+        return self.create or self.mtu is not None or bool(self.addresses)
+
+    def __str__(self) -> str:
+        if self.create:
+            return f'{self.interface.name}: create, {self.addresses}'
+        return f'{self.interface.name}: mtu {self.mtu}, {self.addresses}'
+
+
+def plan_interfaces(interfaces: List[Interface], state: Dict[str, LinkState]) -> List[InterfacePlan]:
+    plans = []
+    for interface in interfaces:
+        if interface.name not in state:
+            plan = InterfacePlan(interface, True, None, AddressPlan(list(interface.addresses), []))
+        else:
+            link = state[interface.name]
+            plan = InterfacePlan(interface, False, interface.mtu if interface.mtu != link.mtu else None,
+                                 plan_addresses(interface, link.addrs))
+        if plan:
+            plans.append(plan)
+    return plans
+
+
+def apply_plans(conn: Connection, plans: List[InterfacePlan]) -> None:
+    with conn.batch(force=True):
+        for plan in plans:
+            if plan.create:
+                conn.ip_link_add(plan.interface)
+            elif plan.mtu is not None:
+                conn.ip_link_set(plan.interface, mtu=plan.mtu)
+            conn.apply_address_plan(plan.interface, plan.addresses)
+
+
+def reconcile(conn: Connection, interfaces: List[Interface], parallelism: int = startup_parallelism,
+              chunk_size: int = startup_chunk_size) -> List[InterfacePlan]:
+    """Make kernel state of all interfaces match the database.
+
+    Remote state is fetched once, the plan for all interfaces is split into chunks of chunk_size interfaces and
+    each chunk is sent as one batch, at most parallelism of them at a time on separate channels of the connection.
+    Addresses of interfaces must be loaded, worker threads do not touch the database session.
+    """
+    start = perf_counter()
+    plans = plan_interfaces(interfaces, conn.dump_state(fresh=True))
+    chunks = [plans[i:i + chunk_size] for i in range(0, len(plans), chunk_size)]
+    logger.info(f'{len(plans)} of {len(interfaces)} interfaces out of sync, planned in {perf_counter() - start:.3f}s')
+    for plan in plans:
+        logger.debug(plan)
+
+    with ThreadPoolExecutor(max(1, parallelism)) as executor:
+        for done, _ in enumerate(executor.map(lambda chunk: apply_plans(conn, chunk), chunks), 1):
+            logger.info(f'{done}/{len(chunks)} chunks applied in {perf_counter() - start:.3f}s')
+    return plans
+
+
+async def reconcile_async(conn: AsyncConnection, interfaces: List[Interface],
+                          chunk_size: int = startup_chunk_size) -> List[InterfacePlan]:
+    """Same as reconcile(), but all chunks are sent at once, as many run concurrently as the connection has
+    channels."""
+    start = perf_counter()
+    plans = plan_interfaces(interfaces, await conn.dump_state())
+    chunks = [plans[i:i + chunk_size] for i in range(0, len(plans), chunk_size)]
+    logger.info(f'{len(plans)} of {len(interfaces)} interfaces out of sync, planned in {perf_counter() - start:.3f}s')
+    for plan in plans:
+        logger.debug(plan)
+
+    await asyncio.gather(*(conn.execute(lambda recorder, chunk=chunk: apply_plans(recorder, chunk), force=True)
+                           for chunk in chunks))
+    logger.info(f'{len(chunks)} chunks applied in {perf_counter() - start:.3f}s')
+    return plans
+
+
+def reconcile_interface(conn: Connection, interface: Optional[Interface], live_name: Optional[str]) -> None:
+    """Make kernel state of one interface match the database in one batch.
+
+    live_name is the name the interface has in the kernel, None if it was not created yet. interface is None if it
+    was deleted from the database.
+    """
+    state = conn.dump_state(live_name) if live_name else {}
+    with conn.batch():
+        if interface is None:
+            if live_name in state:
+                conn.ip_link_delete(Interface(name=live_name, mtu=state[live_name].mtu))
+            return
+        if live_name in state and live_name != interface.name:
+            conn.ip_link_set(Interface(name=live_name, mtu=state[live_name].mtu), name=interface.name)
+            state[interface.name] = state.pop(live_name)
+        apply_plans(conn, plan_interfaces([interface], state))
+
+
+class Reconciler:
+    """Background fixer of drift between the database and the kernel, e.g. interfaces deleted or changed on the VM.
+
+    Interfaces passed to notify(), e.g. by the live index on `ip monitor` events, are checked at once, all
+    interfaces every interval seconds and on notify(None), e.g. after the index resyncs. An interface out of sync
+    is fixed only if it is still out of sync the same way settle seconds later, so that changes of requests in
+    progress, applied to the kernel but not committed yet, are not reverted. load(names) returns interfaces with
+    given names, all if names is None, with their addresses loaded.
+    """
+
+    def __init__(self, pool: ConnectionPool, load: Callable[[Optional[Set[str]]], List[Interface]],
+                 interval: float = drift_interval, settle: float = drift_settle):
+        self._pool = pool
+        self._load = load
+        self._interval = interval
+        self._settle = settle
+        self._condition = Condition()
+        self._dirty: Set[str] = set()
+        self._full = False
+        self._next_full = monotonic() + interval
+        self._suspects: Dict[str, Tuple[float, str]] = {}  # when drift was seen first and what it was, by name
+        self._stopped = False
+        self.counters = {'events': 0, 'checks': 0, 'interfaces_checked': 0, 'drift_detected': 0, 'drift_fixed': 0,
+                         'fix_failures': 0}
+        self.last_check: Optional[datetime] = None
+        self.last_drift: Optional[datetime] = None
+
+    def start(self) -> None:
+        Thread(target=self._run, name='reconciler', daemon=True).start()
+
+    def stop(self) -> None:
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+
+    def notify(self, name: Optional[str]) -> None:
+        """Mark interface with given kernel name, or all interfaces if name is None, as changed."""
+        with self._condition:
+            if name is None:
+                self._full = True
+            else:
+                self._dirty.add(name)
+                self.counters['events'] += 1
+            self._condition.notify_all()
+
+    def settling(self) -> int:
+        """Return the number of interfaces seen out of sync and checked again once settle seconds passed."""
+        with self._condition:
+            return len(self._suspects)
+
+    def _wait(self) -> Optional[Set[str]]:
+        """Wait until something has to be checked, return names to check, None to check all interfaces."""
+        with self._condition:
+            while not self._stopped:
+                now = monotonic()
+                due = {name for name, (seen, _) in self._suspects.items() if now - seen >= self._settle}
+                if self._full or self._interval > 0 and now >= self._next_full:
+                    self._full, self._dirty = False, set()
+                    self._next_full = now + self._interval
+                    return None
+                if self._dirty or due:
+                    names, self._dirty = self._dirty | due, set()
+                    return names
+                deadlines = [seen + self._settle for seen, _ in self._suspects.values()]
+                if self._interval > 0:
+                    deadlines.append(self._next_full)
+                self._condition.wait(max(0.0, min(deadlines) - now) if deadlines else None)
+        return set()
+
+    def _run(self) -> None:
+        while True:
+            names = self._wait()
+            if self._stopped:
+                return
+            try:
+                self.check(names)
+            except Exception as e:
+                logger.warning(f'Drift check failed: {e}')
+
+    def check(self, names: Optional[Set[str]] = None) -> List[InterfacePlan]:
+        """Compare interfaces with given names (all if None) with the kernel, fix those out of sync for settle
+        seconds already and return their plans."""
+        many = names is None or len(names) > startup_chunk_size
+        interfaces = self._load(None if many else names)
+        if names is not None:
+            interfaces = [interface for interface in interfaces if interface.name in names]
+        with self._pool.connection() as conn:
+            if many:
+                # a full check also catches anything the live index may have missed
+                state = conn.dump_state(fresh=names is None)
+            else:
+                state = {}
+                for name in names:
+                    state.update(conn.dump_state(name))
+            plans = plan_interfaces(interfaces, state)
+
+            # what drifted: kernel state and the plan that fixes it
+            now, drifted = monotonic(), {plan.interface.name: f'{state.get(plan.interface.name)!r}: {plan}'
+                                         for plan in plans}
+            with self._condition:
+                self.counters['checks'] += 1
+                self.counters['interfaces_checked'] += len(interfaces)
+                self.last_check = datetime.utcnow()
+                for name in [name for name in self._suspects if names is None or name in names]:
+                    if name not in drifted:
+                        del self._suspects[name]
+                # drift that changed since it was seen, e.g. by another request in progress, settles again
+                for name, drift in drifted.items():
+                    if self._suspects.get(name, (None, None))[1] != drift:
+                        self._suspects[name] = now, drift
+                        self.counters['drift_detected'] += 1
+                        self.last_drift = self.last_check
+                due = [plan for plan in plans if now - self._suspects[plan.interface.name][0] >= self._settle]
+                for plan in due:
+                    del self._suspects[plan.interface.name]
+                self._condition.notify_all()
+
+            for plan in due:
+                logger.warning(f'Drift: {plan}')
+            try:
+                apply_plans(conn, due)
+                failed = 0
+            except Iproute2Error as e:
+                failed = len(e.args[0].get('errors', [e.args[0]]))
+                logger.warning(f'Drift fix failed: {e}')
+        with self._condition:
+            self.counters['drift_fixed'] += max(0, len(due) - failed)
+            self.counters['fix_failures'] += failed
+        return due
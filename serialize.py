@@ -0,0 +1,90 @@
+import json
+from operator import attrgetter
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Tuple
+from marshmallow import fields, Schema, ValidationError
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(data: Any, pretty: bool = False) -> bytes:
+    """Encode data as compact JSON, or as `json.dumps(data, indent=2)` would if pretty."""
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_INDENT_2 if pretty else 0)
+    if pretty:
+        return json.dumps(data, indent=2, ensure_ascii=False).encode()
+    return json.dumps(data, separators=(',', ':'), ensure_ascii=False).encode()
+
+
+def reformat(body: bytes) -> bytes:
+    """Indent compact JSON, e.g. a cached rendering, for a client that asked for pretty output."""
+    return dumps(json.loads(body), pretty=True)
+
+
+def iter_list(items: Iterable[bytes], pretty: bool = False) -> Iterator[bytes]:
+    """Yield pieces of the JSON list of items rendered by dumps() with the same pretty, one item at a time."""
+    first = True
+    for item in items:
+        if pretty:
+            yield (b'[\n  ' if first else b',\n  ') + item.replace(b'\n', b'\n  ')
+        else:
+            yield (b'[' if first else b',') + item
+        first = False
+    if first:
+        yield b'[]'
+    else:
+        yield b'\n]' if pretty else b']'
+
+
+def read_ndjson(lines: Iterable[bytes], size: int) -> Iterator[List[Tuple[int, Any]]]:
+    """Yield lists of at most size objects of NDJSON lines with the index of their line, blank lines are skipped.
+
+    Lines are read only as far as the next list needs, so a stream is consumed at the pace its lists are handled.
+    """
+    chunk = []
+    for index, line in enumerate(lines):
+        if not line.strip():
+            continue
+        try:
+            chunk.append((index, json.loads(line)))
+        except ValueError:
+            raise ValidationError({index: ['Not a valid JSON document.']})
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class Serializer:
+    """Renderer of objects to the dicts schema.dump() returns, with the fields of the schema resolved once.
+
+    Integer, string and boolean attributes are taken as they are and nested schemas are compiled too, any other field
+    falls back to its own serialize(). Objects must have all attributes of the schema, as models do.
+    """
+
+    def __init__(self, schema: Schema):
+        self._fields = [(field.data_key or name, self._accessor(name, field))
+                        for name, field in schema.dump_fields.items()]
+
+    @staticmethod
+    def _accessor(name: str, field: fields.Field) -> Callable[[Any], Any]:
+        get = attrgetter(field.attribute or name)
+        if isinstance(field, fields.List) and isinstance(field.inner, fields.Nested) and not field.inner.many:
+            nested = Serializer(field.inner.schema)
+            return lambda obj: None if get(obj) is None else nested.dump_many(get(obj))
+        if isinstance(field, fields.Nested):
+            nested = Serializer(field.schema)
+            dump = nested.dump_many if field.many else nested.dump
+            return lambda obj: None if get(obj) is None else dump(get(obj))
+        if type(field) in (fields.Integer, fields.String, fields.Boolean):
+            return get
+        return lambda obj: field.serialize(name, obj)
+
+    def dump(self, obj: Any) -> Dict[str, Any]:
+        return {key: get(obj) for key, get in self._fields}
+
+    def dump_many(self, objs: Iterable) -> List[Dict[str, Any]]:
+        return [self.dump(obj) for obj in objs]
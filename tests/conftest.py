@@ -0,0 +1,32 @@
+"""Tests import the service from the repository root, configured by the environment set here before the first import
+of config.py, against a temporary database."""
+import os
+import sys
+import tempfile
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'benchmarks')]
+
+directory = tempfile.TemporaryDirectory()
+os.environ['NIMS_DATABASE_PATH'] = f'sqlite:///{directory.name}/interfaces.db'
+os.environ['NIMS_DEPLOYMENT_ID'] = 'tests'
+os.environ['NIMS_QUERY_COUNT_HEADER'] = '1'
+os.environ.setdefault('NIMS_BACKEND', 'exec')
+os.environ.setdefault('NIMS_DRIFT_INTERVAL', '0')
+
+
+@pytest.fixture(scope='session')
+def network():
+    """Hosts of the service in the test process, simulated."""
+    import fakevm
+
+    return fakevm.Network()
+
+
+@pytest.fixture(scope='session')
+def client(network):
+    """Test client of the service in the test process, started once."""
+    from service import start
+
+    return start(network)
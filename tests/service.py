@@ -0,0 +1,49 @@
+"""The service against hosts simulated by benchmarks/fakevm.py, for tests.
+
+config.py is read once, when the service is imported, so a test that needs another configuration than the one of
+conftest.py runs a function of its module in a process of its own with run().
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from importlib import import_module
+from threading import enumerate as enumerate_threads
+from typing import Any
+
+
+def start(network):
+    """Make the service reach hosts of network, a fakevm.Network, start it and return its test client once it is
+    ready. It waits for reconciliation at startup to finish instead of polling for readiness meanwhile: an in-memory
+    database is a single connection that threads must not use at once."""
+    import fakevm
+
+    fakevm.install(network)
+    import app
+
+    app.create_app()
+    for thread in enumerate_threads():
+        if thread.name == 'startup':
+            thread.join(30)
+            assert not thread.is_alive(), 'not started after 30s'
+    client = app.app.test_client()
+    assert client.get('/health/ready').status_code == 200
+    return client
+
+
+def run(function: str, **env: str) -> Any:
+    """Call function, given as `module:name` of a module of the tests, in a new process with env added to the
+    environment and a database of its own unless env sets one, and return its result, which must be JSON."""
+    with tempfile.TemporaryDirectory() as directory:
+        env = dict(os.environ, **{'NIMS_DATABASE_PATH': f'sqlite:///{directory}/interfaces.db', **env})
+        out = subprocess.run([sys.executable, '-W', 'ignore', __file__, function], env=env, check=True,
+                             stdout=subprocess.PIPE, universal_newlines=True).stdout
+    return json.loads(out.splitlines()[-1])
+
+
+if __name__ == '__main__':
+    tests = os.path.dirname(os.path.abspath(__file__))
+    sys.path[:0] = [os.path.dirname(tests), os.path.join(os.path.dirname(tests), 'benchmarks'), tests]
+    module, name = sys.argv[1].split(':')
+    print(json.dumps(getattr(import_module(module), name)()))
@@ -0,0 +1,52 @@
+"""The asyncssh backend must serve requests exactly as the exec backend does, compared on simulated hosts."""
+import json
+from typing import Dict, List
+import fakevm
+from service import run, start
+
+REQUESTS = [
+    ('post', '/interfaces', {'name': 'd1', 'mtu': 1400, 'addresses': [{'address': '10.0.0.1'},
+                                                                     {'address': '10.0.0.2'}]}),
+    ('post', '/interfaces', {'name': 'd1'}),
+    ('post', '/interfaces', {'name': 'bad-name'}),
+    ('post', '/interfaces', {'name': 'd2', 'addresses': [{'address': '10.0.0.5'}, {'address': '10.0.0.5'}]}),
+    ('post', '/interfaces', {'name': 'eth0'}),
+    ('put', '/interfaces/{d1}', {'name': 'd1x', 'mtu': 1300, 'addresses': [{'address': '10.0.0.2'},
+                                                                       {'address': '10.0.0.3'}]}),
+    ('post', '/interfaces/{d1}/addresses', {'address': '10.0.0.9'}),
+    ('post', '/addresses', {'address': '10.0.0.9', 'interface_id': '{d1}'}),
+    ('post', '/interfaces:bulk', [{'name': f'bulk_{i}', 'addresses': [{'address': f'10.0.1.{i}'}]} for i in range(4)]),
+    ('post', '/interfaces', {'name': 'fails', 'mtu': 9000}),
+    ('delete', '/interfaces/{d1}', None),
+    ('get', '/interfaces', None),
+    ('get', '/addresses', None),
+]
+
+
+def sequence() -> Dict:
+    """Statuses and bodies of REQUESTS and the kernel state they leave, of the backend configured."""
+    network = fakevm.Network()
+    host = network.host('192.168.122.178')
+    host.add_link('eth0', addrs=('192.168.122.178',), kind=None)
+    host.fail('mtu 9000', fakevm.NOT_SUPPORTED)
+    client = start(network)
+    responses: List = []
+    ids: Dict[str, int] = {}
+    for method, path, body in REQUESTS:
+        path = path.format(**ids)
+        if isinstance(body, dict):
+            body = {key: value.format(**ids) if value == '{d1}' else value for key, value in body.items()}
+        response = getattr(client, method)(path, json=body)
+        data = json.loads(response.get_data() or 'null')
+        if not ids:
+            ids['d1'] = data['id']
+        responses.append([method, path, response.status_code, data])
+    kernel = {name: [link.mtu, link.kind, sorted(link.addrs)] for name, link in host.links.items()}
+    return {'responses': responses, 'kernel': kernel}
+
+
+def test_asyncssh_serves_as_exec():
+    expected = run('test_backends:sequence', NIMS_BACKEND='exec')
+    assert run('test_backends:sequence', NIMS_BACKEND='asyncssh') == expected
+    assert [status for _, _, status, _ in expected['responses']] == [201, 409, 400, 409, 409, 200, 201, 409, 201, 500,
+                                                                     204, 200, 200]
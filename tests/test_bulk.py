@@ -0,0 +1,73 @@
+"""Bulk requests spanning hosts are all or nothing: a failure on one host, or of the commit, reverts every host."""
+import json
+from typing import Dict, List
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+NO_BUFFER_SPACE = 'RTNETLINK answers: No buffer space available\n'
+
+
+@pytest.fixture(scope='module')
+def hosts(client, network) -> List[Dict]:
+    """Two hosts with two interfaces each, bulk_<host>_<i>."""
+    hosts_ = []
+    for name, address in [('bulk_a', '10.254.1.1'), ('bulk_b', '10.254.1.2')]:
+        host = json.loads(client.post('/hosts', json={'name': name, 'address': address}).get_data())
+        hosts_.append(dict(host, vm=network.host(address)))
+    response = client.post('/interfaces:bulk', json=[
+        {'name': f'{host["name"]}_{i}', 'host_id': host['id'], 'addresses': [{'address': f'10.83.{host["id"]}.{i}'}]}
+        for host in hosts_ for i in range(2)])
+    assert response.status_code == 201
+    return hosts_
+
+
+def state(client, hosts_: List[Dict]) -> Dict:
+    """Interfaces of the hosts in the database and in their kernels."""
+    return {host['name']: {'database': json.loads(client.get(f'/hosts/{host["id"]}/interfaces').get_data()),
+                           'kernel': {name: [link.mtu, sorted(link.addrs)] for name, link in host['vm'].links.items()}}
+            for host in hosts_}
+
+
+def failing(client, hosts_: List[Dict], pattern: str, method: str, body: List) -> Dict:
+    """Send a bulk request with commands matching pattern failing on the second host, assert it changed nothing
+    and return the error."""
+    before = state(client, hosts_)
+    hosts_[1]['vm'].fail(pattern, NO_BUFFER_SPACE)
+    try:
+        response = getattr(client, method)('/interfaces:bulk', json=body)
+    finally:
+        hosts_[1]['vm'].heal()
+    assert response.status_code == 500
+    assert state(client, hosts_) == before
+    return json.loads(response.get_data())
+
+
+def test_failed_host_reverts_created_interfaces(client, hosts):
+    a, b = hosts
+    body = [{'name': f'bulk_new_{i}', 'host_id': host['id'], 'mtu': 1400, 'addresses': [{'address': f'10.84.0.{i}'}]}
+            for i, host in enumerate([a, b, a, b, a])]
+    error = failing(client, hosts, 'bulk_new_3', 'post', body)
+    assert (error['code'], error['index']) == ('ENOBUFS', 3)
+
+
+def test_failed_host_reverts_changed_interfaces(client, hosts):
+    interfaces = [interface for host in hosts for interface in json.loads(
+        client.get(f'/hosts/{host["id"]}/interfaces').get_data())]
+    body = [dict(interface, mtu=1300, addresses=[{'address': f'10.85.0.{i}'}])
+            for i, interface in enumerate(interfaces)]
+    error = failing(client, hosts, 'mtu 1300', 'put', body[::-1])
+    assert (error['code'], error['index']) == ('ENOBUFS', 0)
+
+
+def test_failed_commit_reverts_kernels(client, hosts, monkeypatch):
+    import app
+
+    def commit():
+        raise IntegrityError('INSERT', {}, Exception('UNIQUE constraint failed'))
+    before = state(client, hosts)
+    monkeypatch.setattr(app.db.session, 'commit', commit)
+    response = client.post('/interfaces:bulk', json=[{'name': f'bulk_commit_{host["id"]}', 'host_id': host['id']}
+                                                    for host in hosts])
+    monkeypatch.undo()
+    assert response.status_code == 409
+    assert state(client, hosts) == before
@@ -0,0 +1,38 @@
+"""Conditional requests by ETag and the change log, which clients use to stay in sync without listing everything."""
+import json
+
+
+def test_unchanged_list_is_not_modified(client):
+    etag = client.get('/interfaces').headers['ETag']
+    assert client.get('/interfaces', headers={'If-None-Match': etag}).status_code == 304
+    response = client.post('/interfaces', json={'name': 'changes_etag'})
+    assert response.status_code == 201
+    interface = json.loads(response.get_data())
+    response = client.get('/interfaces', headers={'If-None-Match': etag})
+    assert response.status_code == 200 and response.headers['ETag'] != etag
+    assert interface in json.loads(response.get_data())
+    etag = client.get(f'/interfaces/{interface["id"]}').headers['ETag']
+    assert client.get(f'/interfaces/{interface["id"]}', headers={'If-None-Match': etag}).status_code == 304
+
+
+def test_changes_since_returns_later_changes_only(client):
+    deleted = json.loads(client.post('/interfaces', json={'name': 'changes_deleted'}).get_data())
+    seq = json.loads(client.get('/changes').get_data())['seq']
+    created = json.loads(client.post('/interfaces', json={'name': 'changes_created',
+                                                          'addresses': [{'address': '10.78.0.1'}]}).get_data())
+    assert client.delete(f'/interfaces/{deleted["id"]}').status_code == 204
+    response = client.get(f'/changes?since={seq}')
+    changes = json.loads(response.get_data())
+    assert changes['seq'] > seq
+    assert changes['interfaces'] == [created]
+    assert [address['address'] for address in changes['addresses']] == ['10.78.0.1']
+    assert changes['deleted'] == {'interfaces': [deleted['id']], 'addresses': []}
+    assert client.get(f'/changes?since={seq}', headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+    assert json.loads(client.get(f'/changes?since={changes["seq"]}').get_data()) == \
+        {'seq': changes['seq'], 'interfaces': [], 'addresses': [], 'deleted': {'interfaces': [], 'addresses': []}}
+
+
+def test_malformed_since_is_rejected(client):
+    response = client.get('/changes?since=abc')
+    assert response.status_code == 400
+    assert 'since' in json.loads(response.get_data())['error']
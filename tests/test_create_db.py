@@ -0,0 +1,23 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+from sqlalchemy.pool import QueuePool
+import fakevm
+from create_db import engine_options
+from service import run, start
+
+
+def test_pool_only_for_file_databases():
+    assert engine_options('sqlite:///interfaces.db', 4)['poolclass'] is QueuePool
+    assert engine_options('sqlite://', 4) == {}
+    assert engine_options('sqlite:///:memory:', 4) == {}
+
+
+def concurrent_requests() -> List[int]:
+    client = start(fakevm.Network())
+    with ThreadPoolExecutor(4) as executor:
+        return list(executor.map(lambda path: client.get(path).status_code, ['/hosts', '/interfaces'] * 8))
+
+
+def test_in_memory_database_serves_concurrent_requests():
+    # without the live index, whose reconciler would read the single connection during reconciliation at startup
+    assert run('test_create_db:concurrent_requests', NIMS_DATABASE_PATH='sqlite://', NIMS_LIVE_INDEX='0') == [200] * 16
@@ -0,0 +1,85 @@
+"""GET /export and chunked POST /import, in processes of their own with 2 interfaces per chunk and an empty database
+to import into."""
+import json
+import os
+from typing import Dict, List
+import fakevm
+from service import run, start
+
+LINES = [{'name': f'import_{i}', 'mtu': 1400 + i, 'addresses': [{'address': f'10.82.0.{i}'}] * (i % 2)}
+         for i in range(5)]
+
+
+def host():
+    network = fakevm.Network()
+    host_ = network.host('192.168.122.178')
+    host_.add_link('import_sys', kind=None)
+    return start(network), host_
+
+
+def post(client, lines: List[Dict]) -> List:
+    response = client.post('/import', data=''.join(json.dumps(line) + '\n' for line in lines),
+                           content_type='application/x-ndjson')
+    return [response.status_code, json.loads(response.get_data())]
+
+
+def state(client, host_) -> Dict:
+    """Interfaces in the database without ids, and in the kernel."""
+    exported = [json.loads(line) for line in client.get('/export').get_data().splitlines()]
+    return {'database': [[line['name'], line['mtu'], [address['address'] for address in line['addresses']]]
+                         for line in exported],
+            'kernel': {name: [link.mtu, [addr for addr, _ in link.addrs]] for name, link in host_.links.items()
+                       if link.kind == 'dummy'}}
+
+
+def export() -> List[str]:
+    client, _ = host()
+    assert post(client, LINES)[0] == 200
+    return client.get('/export').get_data(as_text=True).splitlines()
+
+
+def import_() -> Dict:
+    """Import what export() exported, twice, then once more with one interface changed."""
+    client, host_ = host()
+    lines = [json.loads(line) for line in json.loads(os.environ['EXPORTED'])]
+    results = [post(client, lines), post(client, lines)]
+    lines[3]['mtu'] = 9000
+    results.append(post(client, lines))
+    return {'results': results, **state(client, host_)}
+
+
+def failures() -> Dict:
+    """Import streams failing in their third line, by validation and by a conflict with a system interface, and
+    return the responses and what each left imported."""
+    client, host_ = host()
+    results = {}
+    for case, failing in [('invalid', {'name': 'bad-name'}), ('conflict', {'name': 'import_sys'})]:
+        results[case] = [post(client, LINES[:2] + [failing] + LINES[2:]), state(client, host_)]
+        for interface in json.loads(client.get('/interfaces').get_data()):
+            assert client.delete(f'/interfaces/{interface["id"]}').status_code == 204
+    return results
+
+
+def test_export_imports_into_empty_database():
+    exported = run('test_import:export', NIMS_IMPORT_CHUNK_SIZE='2')
+    assert len(exported) == len(LINES)
+    result = run('test_import:import_', NIMS_IMPORT_CHUNK_SIZE='2', EXPORTED=json.dumps(exported))
+    assert result['results'] == [[200, {'created': 5, 'updated': 0, 'unchanged': 0}],
+                                 [200, {'created': 0, 'updated': 0, 'unchanged': 5}],
+                                 [200, {'created': 0, 'updated': 1, 'unchanged': 4}]]
+    expected = [[line['name'], line['mtu'], [address['address'] for address in line['addresses']]] for line in LINES]
+    expected[3][1] = 9000
+    assert result['database'] == expected
+    assert result['kernel'] == {name: [mtu, addrs] for name, mtu, addrs in expected}
+
+
+def test_failed_chunk_keeps_earlier_chunks():
+    results = run('test_import:failures', NIMS_IMPORT_CHUNK_SIZE='2')
+    imported = [[line['name'], line['mtu'], [address['address'] for address in line['addresses']]]
+                for line in LINES[:2]]
+    response, left = results['invalid']
+    assert response == [400, {'error': {'2': {'name': ['String does not match expected pattern.']}}}]
+    assert left == {'database': imported, 'kernel': {name: [mtu, addrs] for name, mtu, addrs in imported}}
+    response, left = results['conflict']
+    assert response == [409, {'error': 'Interface name import_sys is already in use.', 'index': 2}]
+    assert left == {'database': imported, 'kernel': {name: [mtu, addrs] for name, mtu, addrs in imported}}
@@ -0,0 +1,32 @@
+from threading import Event
+from typing import Optional
+from jobs import Job, JobQueue
+
+
+def rename(fails: bool) -> Job:
+    """Submit a job of an interface while its rename from old to new is running, return it once it finished."""
+    started, release = Event(), Event()
+
+    def run(job: Job) -> Optional[str]:
+        started.set()
+        release.wait()
+        if job.live_name == 'old' and fails:
+            raise RuntimeError('RTNETLINK answers: File exists')
+        return 'new'
+
+    jobs = JobQueue(run, workers=2)
+    jobs.submit(1, 'old', 1)
+    started.wait()
+    job = jobs.submit(1, 'new', 1)  # renamed in the database already
+    release.set()
+    while job.finished is None:
+        release.wait(0.001)
+    return job
+
+
+def test_job_starts_from_name_left_by_previous_job():
+    assert rename(fails=False).live_name == 'new'
+
+
+def test_job_after_failed_rename_starts_from_old_name():
+    assert rename(fails=True).live_name == 'old'
@@ -0,0 +1,59 @@
+"""Keyset pagination by the Link header and the filters of list requests."""
+import json
+import re
+from typing import List
+
+
+def walk(client, path: str) -> List:
+    """Rows of all pages of a list, following next links, asserting every page but the last is full."""
+    rows, limit = [], int(re.search(r'limit=(\d+)', path).group(1))
+    while path:
+        response = client.get(path)
+        assert response.status_code == 200, path
+        page = json.loads(response.get_data())
+        link = re.fullmatch(r'<(.*)>; rel="next"', response.headers.get('Link', '<>; rel="next"')).group(1)
+        assert len(page) == limit if link else len(page) <= limit
+        rows += page
+        path = link
+    return rows
+
+
+def test_pages_hold_every_row_once(client):
+    host_id = json.loads(client.post('/hosts', json={'name': 'lists', 'address': '10.254.0.2'}).get_data())['id']
+    response = client.post('/interfaces:bulk', json=[
+        {'name': f'lists_{i}', 'host_id': host_id, 'addresses': [{'address': f'10.79.0.{i}'}]}
+        for i in range(1, 24)])
+    assert response.status_code == 201
+    for path in ['/interfaces', '/addresses', f'/hosts/{host_id}/interfaces']:
+        everything = json.loads(client.get(path).get_data())
+        assert len(everything) >= 23
+        for limit in [1, 5, len(everything)]:
+            assert walk(client, f'{path}?limit={limit}') == everything, (path, limit)
+
+
+def names(client, path: str) -> List[str]:
+    return [interface['name'] for interface in json.loads(client.get(path).get_data())]
+
+
+def test_filters(client):
+    host_id = json.loads(client.post('/hosts', json={'name': 'filters', 'address': '10.254.0.3'}).get_data())['id']
+    response = client.post('/interfaces:bulk', json=[
+        {'name': 'filters_a', 'host_id': host_id, 'mtu': 1400, 'addresses': [{'address': '10.80.1.1'}]},
+        {'name': 'filters_b', 'host_id': host_id, 'mtu': 9000, 'addresses': []},
+        {'name': 'filters_c', 'host_id': host_id, 'mtu': 1500, 'addresses': [{'address': '10.80.2.1'},
+                                                                            {'address': '10.81.0.1'}]}])
+    assert response.status_code == 201
+    a, b, c = json.loads(response.get_data())
+    assert names(client, '/interfaces?name_prefix=filters_') == ['filters_a', 'filters_b', 'filters_c']
+    assert names(client, f'/interfaces?host_id={host_id}&has_address=1') == ['filters_a', 'filters_c']
+    assert names(client, f'/interfaces?host_id={host_id}&has_address=0') == ['filters_b']
+    assert names(client, f'/interfaces?host_id={host_id}&mtu_min=1450&mtu_max=1500') == ['filters_c']
+    assert names(client, '/interfaces?name_prefix=filters_&cidr=10.80.0.0/16') == ['filters_a', 'filters_c']
+    assert json.loads(client.get(f'/interfaces?host_id={host_id}&fields=id,name').get_data()) == \
+        [{'id': interface['id'], 'name': interface['name']} for interface in [a, b, c]]
+    addresses = json.loads(client.get('/addresses?cidr=10.80.0.0/16&fields=address').get_data())
+    assert addresses == [{'address': '10.80.1.1'}, {'address': '10.80.2.1'}]
+    addresses = json.loads(client.get(f'/addresses?interface_id={c["id"]}').get_data())
+    assert [address['address'] for address in addresses] == ['10.80.2.1', '10.81.0.1']
+    assert client.get('/interfaces?cidr=10.80.0.0/33').status_code == 400
+    assert client.get('/interfaces?fields=id,unknown').status_code == 400
@@ -0,0 +1,34 @@
+from iproute2 import LinkState
+from live import LiveIndex
+
+
+def dummy(mtu: int) -> LinkState:
+    return LinkState(1, 'dummy_1', mtu, [], 'dummy')
+
+
+def test_read_does_not_overwrite_newer_event():
+    index = LiveIndex()
+    index.load([dummy(1500)])
+    index.invalidate(['dummy_1'])
+    stale, seq = index.stale('dummy_1')
+    assert stale == ['dummy_1']
+    # the event of a later change arrives while the remote read started before it is on the way
+    index.apply({'ifindex': 1, 'ifname': 'dummy_1', 'mtu': 1400})
+    index.update('dummy_1', dummy(1500), seq)
+    assert index.state('dummy_1')['dummy_1'].mtu == 1400
+    assert index.peek('dummy_1') is None
+
+    stale, seq = index.stale('dummy_1')
+    assert stale == ['dummy_1']
+    index.update('dummy_1', dummy(1400), seq)
+    assert index.peek('dummy_1').mtu == 1400
+
+
+def test_read_refreshes_stale_interface():
+    index = LiveIndex()
+    index.load([dummy(1500)])
+    index.invalidate(['dummy_1'])
+    stale, seq = index.stale()
+    index.update('dummy_1', dummy(1300), seq)
+    assert index.stale() == ([], seq)
+    assert index.peek('dummy_1').mtu == 1300
@@ -0,0 +1,54 @@
+"""The netlink backend against the kernel, in a network namespace of its own, skipped without iproute2 or without
+CAP_NET_ADMIN, which `unshare -n` needs. It changes a veth pair created by `ip`, as not every kernel has dummy links."""
+import json
+import os
+import shutil
+import subprocess
+import sys
+from typing import Dict
+import pytest
+import service
+
+
+def changes() -> Dict:
+    """Change a veth interface as the service does and return the messages of failures and the kernel state."""
+    from connection import Iproute2Error, NetlinkConnection
+    from create_db import Interface, Address
+
+    subprocess.run(['ip', 'link', 'add', 'v0', 'type', 'veth', 'peer', 'name', 'v1'], check=True)
+    conn = NetlinkConnection(None)
+    errors = []
+    conn.ip_link_set(Interface(name='v0', mtu=1500), name='v5', mtu=1300)
+    for address in ['10.1.0.1', '10.1.0.2']:
+        conn.ip_address_add(Address(address=address), Interface(name='v5'))
+    desired = Interface(name='v5', addresses=[Address(address='10.1.0.2'), Address(address='10.1.0.3')])
+    plan = conn.set_addresses(desired, ['10.1.0.1', '10.1.0.2'])
+    for change in [lambda: conn.ip_address_add(Address(address='10.1.0.3'), Interface(name='v5')),
+                   lambda: conn.ip_link_set(Interface(name='missing', mtu=1500), mtu=1400),
+                   lambda: conn.ip_link_set(Interface(name='v5', mtu=1300), name='v1')]:
+        try:
+            change()
+        except Iproute2Error as e:
+            errors.append(e.args[0]['message'])
+    state = {link.name: [link.mtu, sorted(link.addrs)] for link in conn.dump_state().values()}
+    conn.ip_link_delete(Interface(name='v5'))
+    remaining = sorted(conn.dump_state())
+    conn.close()
+    return {'plan': [[address.address for address in plan.add], plan.delete], 'errors': errors, 'state': state,
+            'remaining': remaining}
+
+
+def test_netlink_changes_the_kernel():
+    if shutil.which('ip') is None or shutil.which('unshare') is None or \
+            subprocess.run(['unshare', '-n', 'true'], stderr=subprocess.DEVNULL).returncode != 0:
+        pytest.skip('needs iproute2 and CAP_NET_ADMIN')
+    out = subprocess.run(['unshare', '-n', sys.executable, '-W', 'ignore', service.__file__, 'test_netlink:changes'],
+                         env=dict(os.environ, NIMS_BACKEND='netlink'), check=True, stdout=subprocess.PIPE,
+                         universal_newlines=True).stdout
+    assert json.loads(out.splitlines()[-1]) == {
+        'plan': [['10.1.0.3'], ['10.1.0.1']],
+        'errors': [['RTNETLINK answers: File exists\n'], ['Cannot find device "missing"\n'],
+                   ['RTNETLINK answers: File exists\n']],
+        'state': {'lo': [65536, []], 'v1': [1500, []], 'v5': [1300, ['10.1.0.2', '10.1.0.3']]},
+        'remaining': ['lo'],
+    }
@@ -0,0 +1,42 @@
+"""Requests must execute as many SQL statements with 5 interfaces as with 50, as counted by X-Query-Count."""
+import json
+from itertools import count
+from typing import Dict, List
+
+names = (f'queries_{i}' for i in count())
+addresses = (f'10.77.{i >> 8}.{i & 255}' for i in count(1))
+
+
+def grow(client, host_id: int, number: int) -> List[Dict]:
+    response = client.post('/interfaces:bulk', json=[
+        {'name': next(names), 'host_id': host_id, 'addresses': [{'address': next(addresses)}]}
+        for _ in range(number)])
+    assert response.status_code == 201, response.get_data(as_text=True)
+    return json.loads(response.get_data())
+
+
+PATHS = ['/interfaces', '/interfaces?limit=3', '/interfaces?host_id={host}&name_prefix=queries_',
+         '/interfaces?has_address=1&fields=id,name', '/interfaces/{interface}', '/addresses', '/addresses?limit=3',
+         '/addresses?interface_id={interface}', '/addresses?cidr=10.77.0.0/16', '/addresses/{address}',
+         '/interfaces/{interface}/addresses', '/interfaces/{interface}/addresses/{address}', '/changes', '/hosts',
+         '/hosts/{host}', '/hosts/{host}/interfaces', '/hosts/{host}/interfaces?limit=3']
+
+
+def statements(client, host_id: int, interface: Dict) -> Dict[str, int]:
+    """Statements of every list and item request by path, GET /export streams its rows after the header is sent."""
+    counts = {}
+    for path in PATHS:
+        response = client.get(path.format(host=host_id, interface=interface['id'],
+                                          address=interface['addresses'][0]['id']))
+        assert response.status_code == 200, path
+        assert ('Link' in response.headers) == ('limit=' in path), path
+        counts[path] = int(response.headers['X-Query-Count'])
+    return counts
+
+
+def test_statements_do_not_grow_with_inventory(client):
+    response = client.post('/hosts', json={'name': 'queries', 'address': '10.254.0.1'})
+    host_id = json.loads(response.get_data())['id']
+    small = statements(client, host_id, grow(client, host_id, 5)[-1])
+    large = statements(client, host_id, grow(client, host_id, 45)[-1])
+    assert large == small
@@ -0,0 +1,62 @@
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+from connection import Batch, Recorder
+from create_db import Interface
+from iproute2 import LinkState
+import reconcile
+from reconcile import Reconciler
+
+
+class Kernel(Recorder):
+    """Connection to a kernel in the state the test sets, which records commands instead of running them."""
+
+    def __init__(self):
+        super().__init__(Batch(force=True))
+        self.state: Dict[str, LinkState] = {}
+
+    def dump_state(self, name: Optional[str] = None, details: bool = False,
+                   fresh: bool = False) -> Dict[str, LinkState]:
+        return dict(self.state) if name is None else {name: self.state[name]} if name in self.state else {}
+
+
+class Pool:
+    def __init__(self, conn: Kernel):
+        self.conn = conn
+
+    @contextmanager
+    def connection(self) -> Iterator[Kernel]:
+        yield self.conn
+
+
+def reconciler(monkeypatch, now: list, kernel: Kernel) -> Reconciler:
+    monkeypatch.setattr(reconcile, 'monotonic', lambda: now[0])
+    interface = Interface(name='dummy_1', mtu=1500)
+    return Reconciler(Pool(kernel), lambda names: [interface], interval=0, settle=10)
+
+
+def test_drift_is_fixed_once_settled(monkeypatch):
+    now, kernel = [0.0], Kernel()
+    kernel.state = {'dummy_1': LinkState(1, 'dummy_1', 1400, [])}
+    fixer = reconciler(monkeypatch, now, kernel)
+    assert fixer.check() == []
+    now[0] = 10
+    assert [str(plan) for plan in fixer.check()] == ['dummy_1: mtu 1500, add [], delete []']
+    assert kernel._batch.lines == ['link set dev dummy_1 mtu 1500']
+
+
+def test_drift_that_changes_settles_again(monkeypatch):
+    now, kernel = [0.0], Kernel()
+    kernel.state = {'dummy_1': LinkState(1, 'dummy_1', 1400, [])}
+    fixer = reconciler(monkeypatch, now, kernel)
+    assert fixer.check() == []
+    # a request in progress changes the interface again, its change must not be reverted before it settled
+    now[0] = 8
+    kernel.state = {'dummy_1': LinkState(1, 'dummy_1', 1300, [])}
+    assert fixer.check() == []
+    now[0] = 12
+    assert fixer.check() == []
+    assert kernel._batch.lines == []
+    assert fixer.counters['drift_detected'] == 2
+    now[0] = 18
+    assert [str(plan) for plan in fixer.check()] == ['dummy_1: mtu 1500, add [], delete []']
+    assert kernel._batch.lines == ['link set dev dummy_1 mtu 1500']
@@ -0,0 +1,61 @@
+import os
+import subprocess
+import sys
+from datetime import datetime, timedelta
+from typing import Optional
+from app import app, db, startup_once
+from create_db import Deployment
+from config import deployment_history, deployment_timeout
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MASTER = """
+import runpy, subprocess, sys
+runpy.run_path('gunicorn.conf.py')['on_starting'](None)
+worker = [sys.executable, '-c', 'import config; print(config.deployment_id)']
+print(' '.join(subprocess.run(worker, stdout=subprocess.PIPE, universal_newlines=True, check=True).stdout.strip()
+               for _ in range(2)))
+"""
+
+
+def add(id_: str, started: datetime, finished: Optional[datetime] = None) -> None:
+    with app.app_context():
+        db.session.add(Deployment(id=id_, started=started, finished=finished))
+        db.session.commit()
+
+
+def deployment(id_: str) -> Optional[Deployment]:
+    with app.app_context():
+        return db.session.query(Deployment).get(id_)
+
+
+def test_interrupted_reconciliation_runs_again(client):
+    add('killed', datetime.utcnow() - timedelta(seconds=2 * deployment_timeout))
+    startup_once('killed')
+    assert deployment('killed').finished is not None
+
+
+def test_running_reconciliation_is_not_run_twice(client):
+    started = datetime.utcnow()
+    add('running', started)
+    startup_once('running')
+    assert deployment('running').finished is None
+    assert deployment('running').started == started
+
+
+def test_old_deployments_are_pruned(client):
+    for i in range(deployment_history + 5):
+        add(f'old-{i}', datetime(2020, 1, 1) + timedelta(days=i), datetime(2020, 1, 1) + timedelta(days=i))
+    startup_once('new')
+    with app.app_context():
+        assert db.session.query(Deployment).count() == deployment_history
+    assert deployment('new').finished is not None
+    assert deployment('old-0') is None
+
+
+def test_workers_share_the_deployment_of_their_server():
+    """Workers of a gunicorn master, simulated by processes it starts, whose command lines differ from its own."""
+    env = {name: value for name, value in os.environ.items() if name != 'NIMS_DEPLOYMENT_ID'}
+    starts = [subprocess.run([sys.executable, '-c', MASTER], cwd=ROOT, env=env, stdout=subprocess.PIPE,
+                             universal_newlines=True, check=True).stdout.split() for _ in range(2)]
+    assert [len(set(workers)) for workers in starts] == [1, 1]
+    assert starts[0][0] != starts[1][0]